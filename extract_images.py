@@ -1,28 +1,115 @@
-import h5py
-from pathlib import Path
-from argparse import ArgumentParser
-from PIL import Image
-import io
-
-
-if __name__ == "__main__":
-    parser = ArgumentParser()
-    parser.add_argument("--dest", type=str, help="Root directory for the images.")
-    parser.add_argument("--src", type=str, help="Root source directory of the .hdf5 files.")
-
-    args = parser.parse_args()
-
-    dest = Path(args.dest)
-    if not dest.exists():
-        dest.mkdir(parents=True)
-
-    p = Path(args.src)
-    for trial in p.glob("*.hdf5"):
-        f = h5py.File(str(trial.resolve()), "r")
-        dest_dir = dest.joinpath(trial.stem)
-        if not dest_dir.exists():
-            dest_dir.mkdir()
-        for fr in f["frames"]:
-            dest_path = dest_dir.joinpath(fr + ".jpg")
-            img = Image.open(io.BytesIO(f["frames"][fr]["images"]["_img"][:]))
-            img.save(str(dest_path.resolve()))
+import io
+import time
+from pathlib import Path
+from argparse import ArgumentParser
+from typing import Optional, Tuple
+import h5py
+from PIL import Image
+from tqdm import tqdm
+from tdw_physics.columnar_layout import legacy_view
+from tdw_physics.image_storage import DEPTH_PASSES, read_storage_policy, read_pass
+from tdw_physics.pass_schedule import get_pass_frames
+from tdw_physics.postprocessing.stimuli import get_image_extension
+from tdw_physics.postprocessing.trial_stats import run_in_pool
+
+# The PIL format of each image extension.
+PIL_FORMATS = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG"}
+
+
+def extract_trial(state, trial: str) -> Tuple[int, int]:
+    """
+    Save the images of a pass of a trial. Encoded images are written as-is if they're already in the target format.
+
+    :param state: Tuple: The destination root directory, the pass, the image format (None to keep the stored one), and the `slice` of frames.
+    :param trial: The path to the .hdf5 file.
+
+    :return: Tuple: The number of images and the number of bytes written.
+    """
+
+    dest, pass_mask, image_format, frames_slice = state
+    trial = Path(trial)
+    dest_dir = Path(dest).joinpath(trial.stem)
+    if not dest_dir.exists():
+        dest_dir.mkdir(parents=True)
+    suffix = "" if pass_mask == "_img" else pass_mask
+    num_images = 0
+    num_bytes = 0
+    f = h5py.File(str(trial.resolve()), "r")
+    try:
+        policy = read_storage_policy(f)
+        pass_frames = get_pass_frames(f, pass_mask)
+        frames_grp = legacy_view(f)["frames"]
+        for fr in sorted(frames_grp.keys())[frames_slice]:
+            images = frames_grp[fr]["images"]
+            if pass_mask not in images.keys() or (pass_frames is not None and int(fr) not in pass_frames):
+                continue
+            data = images[pass_mask][:]
+            if pass_mask in DEPTH_PASSES:
+                image = Image.fromarray(read_pass(f, data, pass_mask, policy))
+                extension = "png" if image_format is None else image_format
+            else:
+                stored = get_image_extension(data)
+                extension = stored if image_format is None else image_format
+                image = None if PIL_FORMATS[extension] == PIL_FORMATS[stored] else Image.open(io.BytesIO(data.tobytes()))
+            if image is None:
+                encoded = data.tobytes()
+            else:
+                buffer = io.BytesIO()
+                image.convert("RGB").save(buffer, format=PIL_FORMATS[extension])
+                encoded = buffer.getvalue()
+            dest_dir.joinpath(fr + suffix + "." + extension).write_bytes(encoded)
+            num_images += 1
+            num_bytes += len(encoded)
+    finally:
+        f.close()
+    return num_images, num_bytes
+
+
+def extract_images(src: str, dest: str, pass_mask: str = "_img", image_format: Optional[str] = None,
+                   start: Optional[int] = None, end: Optional[int] = None, stride: int = 1,
+                   num_workers: Optional[int] = None) -> Tuple[int, int, float]:
+    """
+    Extract the images of a pass of every .hdf5 file in a directory, in a pool of worker processes (one per trial).
+
+    :return: Tuple: The number of images, the number of bytes written, and the time in seconds.
+    """
+
+    dest = Path(dest)
+    if not dest.exists():
+        dest.mkdir(parents=True)
+    if image_format is not None and image_format not in PIL_FORMATS:
+        raise ValueError("Can't save images as %s; expected one of %s" % (image_format, list(PIL_FORMATS.keys())))
+    trials = [str(trial) for trial in sorted(Path(src).glob("*.hdf5"))]
+    state = (str(dest), pass_mask, image_format, slice(start, end, stride))
+
+    t0 = time.time()
+    num_images = 0
+    num_bytes = 0
+    pbar = tqdm(total=len(trials))
+    for n, b in run_in_pool(extract_trial, trials, state, num_workers):
+        num_images += n
+        num_bytes += b
+        pbar.update(1)
+    pbar.close()
+    dt = time.time() - t0
+    print("Extracted %d images (%.1f MB) from %d trials in %.1fs: %.1f images/s, %.1f MB/s" %
+          (num_images, num_bytes / 1e6, len(trials), dt, num_images / max(dt, 1e-6), num_bytes / 1e6 / max(dt, 1e-6)))
+    return num_images, num_bytes, dt
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--dest", type=str, help="Root directory for the images.")
+    parser.add_argument("--src", type=str, help="Root source directory of the .hdf5 files.")
+    parser.add_argument("--pass", dest="pass_mask", type=str, default="_img", help="The pass to extract.")
+    parser.add_argument("--format", type=str, default=None,
+                        help="The image format (png or jpg). By default, the format the images are stored in.")
+    parser.add_argument("--start", type=int, default=None, help="The first frame to extract.")
+    parser.add_argument("--end", type=int, default=None, help="Extract frames before this one.")
+    parser.add_argument("--stride", type=int, default=1, help="Extract every Nth frame.")
+    parser.add_argument("--num_workers", type=int, default=None,
+                        help="Number of worker processes; one per CPU by default.")
+
+    args = parser.parse_args()
+    extract_images(src=args.src, dest=args.dest, pass_mask=args.pass_mask, image_format=args.format,
+                   start=args.start, end=args.end, stride=args.stride, num_workers=args.num_workers)
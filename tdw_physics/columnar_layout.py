@@ -0,0 +1,271 @@
+from typing import Dict, List, Union
+import h5py
+import numpy as np
+from tdw.tdw_utils import TDWUtils
+
+# The layouts of the per-frame data of a trial file.
+LAYOUTS = ["legacy", "columnar"]
+
+# Datasets in these groups have a different number of rows every frame.
+RAGGED_GROUPS = ["collisions", "env_collisions"]
+# The per-frame offsets of a ragged dataset are in a sibling dataset with this suffix.
+OFFSETS_SUFFIX = "_offsets"
+# Encoded images are stored as one variable-length array of bytes per frame.
+VLEN_BYTES = h5py.vlen_dtype(np.dtype('uint8'))
+# Target size of a chunk of a column.
+CHUNK_BYTES = 1 << 16
+
+
+def is_columnar(f: h5py.File) -> bool:
+    """
+    :param f: A trial file.
+
+    :return: True if the trial's frames were written with `ColumnarFrames`.
+    """
+
+    return f.attrs.get("layout", "legacy") == "columnar"
+
+
+def legacy_view(f: h5py.File) -> Union[h5py.File, "ColumnarTrial"]:
+    """
+    :param f: A trial file in either layout.
+
+    :return: Something that can be read like a legacy trial file: `f['frames']['0000']['images']['_img']`, etc.
+    """
+
+    return ColumnarTrial(f) if is_columnar(f) else f
+
+
+class ColumnarFrames:
+    """
+    Stands in for the `frames` group of a trial file and writes each per-frame dataset as a single column over frames,
+    instead of one group per frame:
+
+    ```
+    frames/
+    ....objects/positions                   # (T, N, 3)
+    ....images/_img                         # (T,) variable-length encoded bytes
+    ....images/_depth                       # (T, H, W, ...)
+    ....labels/trial_end                    # (T,)
+    ....collisions/contacts                 # (total number of contacts, 2, 3)
+    ....collisions/contacts_offsets         # (T + 1,): the contacts of frame t are contacts[offsets[t]:offsets[t + 1]]
+    ```
+
+    `_write_frame()` and `_write_frame_labels()` don't need to know about this: they get a stand-in for the frame's
+    group from `create_group()` and call `create_group()` and `create_dataset()` on it as usual.
+    Frames must be written in order. Call `close()` once the last frame is written.
+    """
+
+    def __init__(self, frames_grp: h5py.Group):
+        """
+        :param frames_grp: The trial's `frames` group.
+        """
+
+        self.frames_grp = frames_grp
+        self.num_frames = 0
+        self._columns: Dict[str, h5py.Dataset] = dict()
+        self._groups = set()
+
+    def create_group(self, name: str) -> "_ColumnarGroup":
+        """
+        :param name: The zero-padded frame number.
+
+        :return: A stand-in for the frame's group.
+        """
+
+        frame = int(name)
+        self.num_frames = max(self.num_frames, frame + 1)
+        return _ColumnarGroup(self, frame, "")
+
+    def _require_group(self, path: str) -> None:
+        # Groups are created even if they stay empty (e.g. `images` when no pass was sent), as in the legacy layout.
+        if path not in self._groups:
+            self.frames_grp.require_group(path)
+            self._groups.add(path)
+
+    @staticmethod
+    def _get_chunk_rows(row_shape: tuple, dtype: np.dtype) -> int:
+        row_bytes = max(1, int(np.prod(row_shape)) * dtype.itemsize)
+        return int(np.clip(CHUNK_BYTES // row_bytes, 1, 1024))
+
+    def _create_column(self, path: str, frame: int, data: np.ndarray, kwargs: dict) -> h5py.Dataset:
+        parts = path.split("/")
+        if data.dtype.kind == "S":
+            # Leave room for longer strings in later frames, e.g. "enter" after "stay".
+            data = data.astype("S%d" % max(16, data.dtype.itemsize))
+        compression = {k: v for k, v in kwargs.items() if k in ["compression", "compression_opts", "shuffle"]}
+        if parts[0] in RAGGED_GROUPS:
+            kind = "ragged"
+            column = self.frames_grp.create_dataset(
+                path, shape=(0,) + data.shape[1:], maxshape=(None,) + data.shape[1:], dtype=data.dtype,
+                chunks=(self._get_chunk_rows(data.shape[1:], data.dtype),) + data.shape[1:], **compression)
+            # Frames before this one have no rows.
+            self.frames_grp.create_dataset(path + OFFSETS_SUFFIX, data=np.zeros(frame + 1, dtype=np.int64),
+                                           maxshape=(None,), chunks=(1024,))
+        elif parts[0] == "images" and data.dtype == np.uint8 and data.ndim == 1:
+            kind = "vlen"
+            column = self.frames_grp.create_dataset(path, shape=(0,), maxshape=(None,), dtype=VLEN_BYTES,
+                                                    chunks=(16,))
+        else:
+            kind = "stacked"
+            column = self.frames_grp.create_dataset(
+                path, shape=(0,) + data.shape, maxshape=(None,) + data.shape, dtype=data.dtype,
+                chunks=(self._get_chunk_rows(data.shape, data.dtype),) + data.shape, **compression)
+        column.attrs["columnar"] = kind
+        self._columns[path] = column
+        return column
+
+    def _write(self, path: str, frame: int, data, kwargs: dict) -> None:
+        data = np.asarray(data)
+        column = self._columns.get(path)
+        if column is None:
+            column = self._create_column(path, frame, data, kwargs)
+        kind = column.attrs["columnar"]
+        if kind == "ragged":
+            offsets = self.frames_grp[path + OFFSETS_SUFFIX]
+            start = column.shape[0]
+            # Frames that skipped this dataset have no rows.
+            if offsets.shape[0] < frame + 1:
+                num_offsets = offsets.shape[0]
+                offsets.resize((frame + 1,))
+                offsets[num_offsets:] = start
+            column.resize((start + len(data),) + column.shape[1:])
+            if len(data) > 0:
+                column[start:] = data
+            offsets.resize((frame + 2,))
+            offsets[frame + 1] = start + len(data)
+        else:
+            if column.shape[0] < frame + 1:
+                column.resize((frame + 1,) + column.shape[1:])
+            if data.shape != column.shape[1:] and kind == "stacked":
+                raise ValueError("Can't write %s with shape %s to a column of shape %s" %
+                                 (path, data.shape, column.shape[1:]))
+            column[frame] = data
+
+    def close(self) -> None:
+        """
+        Pad every column to the number of frames, so that frames that skipped a dataset read as empty or zeros.
+        An empty row of encoded images reads as a missing dataset (KeyError) in `legacy_view()`.
+        """
+
+        for path, column in self._columns.items():
+            if column.attrs["columnar"] == "ragged":
+                offsets = self.frames_grp[path + OFFSETS_SUFFIX]
+                num_offsets = offsets.shape[0]
+                if num_offsets < self.num_frames + 1:
+                    offsets.resize((self.num_frames + 1,))
+                    offsets[num_offsets:] = column.shape[0]
+            elif column.shape[0] < self.num_frames:
+                column.resize((self.num_frames,) + column.shape[1:])
+        self.frames_grp.attrs["num_frames"] = self.num_frames
+
+
+class _ColumnarGroup:
+    """
+    A stand-in for a group of one frame of a `ColumnarFrames`.
+    """
+
+    def __init__(self, frames: ColumnarFrames, frame: int, path: str):
+        self.frames = frames
+        self.frame = frame
+        self.name = path
+
+    def create_group(self, name: str) -> "_ColumnarGroup":
+        self.frames._require_group(self.name + name)
+        return _ColumnarGroup(self.frames, self.frame, self.name + name + "/")
+
+    def create_dataset(self, name: str, data=None, **kwargs) -> None:
+        self.frames._write(self.name + name, self.frame, data, kwargs)
+
+
+class ColumnarTrial:
+    """
+    Read a trial file with columnar frames as if it had the legacy layout: `d['frames']['0000']['objects']['positions']`
+    returns the row of frame 0. Everything outside of `frames` is read from the file as usual.
+
+    Whole trajectories are faster to read from the file directly, e.g. `f['frames/objects/positions'][:]`.
+    """
+
+    def __init__(self, f: h5py.File):
+        """
+        :param f: The trial file.
+        """
+
+        self.file = f
+
+    def __getitem__(self, key: str):
+        if key == "frames":
+            return _ColumnarFramesView(self.file["frames"])
+        return self.file[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.file
+
+    def keys(self):
+        return self.file.keys()
+
+    @property
+    def attrs(self):
+        return self.file.attrs
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _ColumnarFramesView:
+    def __init__(self, frames_grp: h5py.Group):
+        self.frames_grp = frames_grp
+        self.num_frames = int(frames_grp.attrs["num_frames"])
+
+    def keys(self) -> List[str]:
+        return [TDWUtils.zero_padding(t, 4) for t in range(self.num_frames)]
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key: str) -> bool:
+        return 0 <= int(key) < self.num_frames
+
+    def __getitem__(self, key: Union[str, int]) -> "_ColumnarFrameView":
+        frame = int(key)
+        if not 0 <= frame < self.num_frames:
+            raise KeyError(key)
+        return _ColumnarFrameView(self.frames_grp, frame)
+
+
+class _ColumnarFrameView:
+    def __init__(self, grp: h5py.Group, frame: int):
+        self.grp = grp
+        self.frame = frame
+
+    def keys(self) -> List[str]:
+        return [k for k in self.grp.keys() if not k.endswith(OFFSETS_SUFFIX)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name: str) -> bool:
+        if name not in self.grp or name.endswith(OFFSETS_SUFFIX):
+            return False
+        obj = self.grp[name]
+        # An empty row of encoded images is a frame that didn't have the pass (e.g. with a pass schedule).
+        return not (isinstance(obj, h5py.Dataset) and obj.attrs["columnar"] == "vlen" and len(obj[self.frame]) == 0)
+
+    def __getitem__(self, name: str):
+        obj = self.grp[name]
+        if isinstance(obj, h5py.Group):
+            return _ColumnarFrameView(obj, self.frame)
+        kind = obj.attrs["columnar"]
+        if kind == "ragged":
+            offsets = self.grp[name + OFFSETS_SUFFIX]
+            return obj[offsets[self.frame]:offsets[self.frame + 1]]
+        elif kind == "vlen":
+            data = np.asarray(obj[self.frame], dtype=np.uint8)
+            # Like the legacy layout, where the frame has no dataset for the pass.
+            if len(data) == 0:
+                raise KeyError(name)
+            return data
+        return obj[self.frame]
@@ -1,6 +1,6 @@
 import sys, os, copy, subprocess, glob, logging, time
 import platform
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Callable, Union
 from abc import ABC, abstractmethod
 from pathlib import Path
 from tqdm import tqdm
@@ -11,23 +11,35 @@ import h5py, json
 from collections import OrderedDict
 import numpy as np
 import random
+import zmq
 from tdw.controller import Controller
 from tdw.tdw_utils import TDWUtils
-from tdw.output_data import OutputData, SegmentationColors, Meshes, Images
-from tdw.librarian import ModelRecord, MaterialLibrarian
+from tdw.output_data import SegmentationColors, Meshes
+from tdw.librarian import ModelRecord
 
-from tdw_physics.postprocessing.stimuli import pngs_to_mp4
+from tdw_physics.movie_encoder import MP4Encoder
 from tdw_physics.postprocessing.labels import (get_labels_from,
                                                get_all_label_funcs,
                                                get_across_trial_stats_from)
 from tdw_physics.util_geom import save_obj
+from tdw_physics.frame_response import FrameResponse, CollisionBuffer, ObjectIndex
+from tdw_physics.frame_writer import FrameWriter, BufferedGroup
+from tdw_physics.stand_in_build import launch_stand_in_build
+from tdw_physics.trial_scheduler import TrialScheduler, MAX_TRIALS
+from tdw_physics.response_log import ResponseRecorder, ResponseReplayer, get_responses_path
+from tdw_physics.stage_timer import StageTimer
+from tdw_physics.columnar_layout import LAYOUTS, ColumnarFrames, legacy_view
+from tdw_physics.image_storage import get_storage_policy
+from tdw_physics.image_cache import DecodedImageCache
+from tdw_physics.metadata_log import MetadataLog
+from tdw_physics.trial_manifest import TrialManifest
+from tdw_physics.library_index import LIBRARY_INDEX
+from tdw_physics.prescreen import PHYSICS_ONLY_COMMANDS, PrescreenLog, get_commands_digest, get_prescreen_predicate
+from tdw_physics.outcome_sampler import OutcomeSampler, parse_balance
+from tdw_physics.pass_schedule import PassSchedule, write_pass_frames
 import shutil
 
 PASSES = ["_img", "_depth", "_normals", "_flow", "_id", "_category", "_albedo"]
-M = MaterialLibrarian()
-MATERIAL_TYPES = M.get_material_types()
-MATERIAL_NAMES = {mtype: [m.name for m in M.get_all_materials_of_type(mtype)] \
-                  for mtype in MATERIAL_TYPES}
 
 # colors for the target/zone overlay
 ZONE_COLOR = [255,255,0]
@@ -51,6 +63,7 @@ class Dataset(Controller, ABC):
                  randomize: int=0,
                  seed: int=0,
                  save_args=True,
+                 stand_in_build: bool=False,
                  **kwargs
     ):
         # save the command-line args
@@ -58,6 +71,32 @@ class Dataset(Controller, ABC):
         self._trial_num = None
         self.command_log = None
 
+        # record or replay the build's responses to each trial
+        self.response_recorder = None
+        self.response_replayer = None
+        self._response_trial = None
+
+        # per-stage timing of each trial
+        self.timer = StageTimer(enabled=False)
+
+        # decoded image passes of the frames of the current trial
+        self.image_cache = DecodedImageCache()
+
+        # the MP4 of each pass of the current trial, if movies are saved
+        self.movie_encoders = OrderedDict()
+
+        # collisions are parsed into these buffers, which are reused from frame to frame
+        self.collision_buffer = CollisionBuffer()
+        self.env_collision_buffer = CollisionBuffer(env=True)
+
+        # remember how the build was started, so that sharded workers can start their own
+        self._port = port
+        self._launch_build = launch_build and not stand_in_build
+        self._stand_in_build = stand_in_build
+        if stand_in_build:
+            launch_stand_in_build(port)
+            launch_build = False
+
         super().__init__(port=port,
                          check_version=check_version,
                          launch_build=launch_build)
@@ -71,21 +110,103 @@ class Dataset(Controller, ABC):
 
         # fluid actors need to be handled separately
         self.fluid_object_ids = []
+
+        # whether to write frames to the hdf5 file on a background thread
+        self.pipeline_writes = False
+        # whether to send a frame's commands before the previous frame is written, if they don't depend on it
+        self.pipeline_commands = False
+        self.write_queue_size = 8
+        self.hdf5_layout = "legacy"
+        self.image_storage = get_storage_policy()
+
+        # the state of each trial of the run; see get_trials_to_run()
+        self.manifest = None
+
+        # the result of the physics-only prescreen of each trial, if trials are prescreened; see prescreen_trials()
+        self.prescreened = None
+        self.trial_init_digest = None
+
+        # chooses the scenario parameters of each trial to balance the outcomes of the run; see run_balanced_trial()
+        self.outcome_sampler = None
+        self.balance_log = None
+
+        # which frames each pass is rendered on, if not every frame; see PassSchedule
+        self.pass_schedule = None
         
     def communicate(self, commands) -> list:
         '''
-        Save a log of the commands so that they can be rerun
+        Save a log of the commands so that they can be rerun.
+        During a trial, also record the build's responses, or replay recorded responses instead of using the build.
         '''
         if self.command_log is not None:
             with open(str(self.command_log), "at") as f:
                 f.write(json.dumps(commands) + (" trial %s" % self._trial_num) + "\n")
-        return super().communicate(commands)
+        with self.timer.time("communicate"):
+            if self._response_trial is not None and self.response_replayer is not None:
+                return self.response_replayer.next()
+            resp = super().communicate(commands)
+        if self._response_trial is not None and self.response_recorder is not None:
+            self.response_recorder.record(resp)
+        return resp
+
+    def send_commands(self, commands: List[dict]) -> None:
+        """
+        Send commands to the build without waiting for its response, so that the build runs the frame while the
+        controller does something else. Every call must be followed by one `receive_response()`.
+
+        :param commands: The commands.
+        """
+
+        if self.command_log is not None:
+            with open(str(self.command_log), "at") as f:
+                f.write(json.dumps(commands) + (" trial %s" % self._trial_num) + "\n")
+        if self._response_trial is not None and self.response_replayer is not None:
+            return
+        with self.timer.time("communicate"):
+            self.socket.send_multipart([json.dumps(commands).encode('utf-8')])
+
+    def receive_response(self) -> list:
+        """
+        :return: The build's response to the commands of the last `send_commands()`.
+        """
+
+        with self.timer.time("communicate"):
+            if self._response_trial is not None and self.response_replayer is not None:
+                return self.response_replayer.next()
+            resp = self.socket.recv_multipart()
+        if self._response_trial is not None and self.response_recorder is not None:
+            self.response_recorder.record(resp)
+        return resp
+
+    def _start_response_log(self, trial_num: int) -> None:
+        self._response_trial = trial_num
+        if self.response_recorder is not None:
+            self.response_recorder.start_trial(trial_num)
+        if self.response_replayer is not None:
+            self.response_replayer.start_trial(trial_num)
+
+    def _end_response_log(self) -> None:
+        self._response_trial = None
+        if self.response_recorder is not None:
+            self.response_recorder.end_trial()
+        if self.response_replayer is not None:
+            self.response_replayer.end_trial()
 
     def clear_static_data(self) -> None:
         self.object_ids = np.empty(dtype=int, shape=0)
+        self.object_index = None
         self.model_names = []
         self._initialize_object_counter()
 
+    def get_object_index(self) -> ObjectIndex:
+        """
+        :return: The map from object IDs to rows of `self.object_ids`. It's built once per trial, after the objects are added.
+        """
+
+        if self.object_index is None or self.object_index.num_ids != len(self.object_ids):
+            self.object_index = ObjectIndex(self.object_ids)
+        return self.object_index
+
     @staticmethod
     def get_controller_label_funcs(classname = 'Dataset'):
         """
@@ -169,7 +290,7 @@ class Dataset(Controller, ABC):
                          {"$type": "set_field_of_view",
                           "field_of_view": self.get_field_of_view()},
                          {"$type": "send_images",
-                          "frequency": "always"},
+                          "frequency": "always" if self.pass_schedule is None else "never"},
                          {"$type": "set_anti_aliasing",
                           "mode": "subpixel"}
                          ])
@@ -187,6 +308,21 @@ class Dataset(Controller, ABC):
             save_movies: bool = False,
             save_labels: bool = False,
             save_meshes: bool = False,
+            pipeline_writes: bool = False,
+            write_queue_size: int = 8,
+            num_workers: int = 1,
+            worker_ports: List[int] = None,
+            record_responses: bool = False,
+            replay_responses: str = None,
+            save_timing: bool = False,
+            hdf5_layout: str = "legacy",
+            image_storage: str = None,
+            stats_workers: int = None,
+            prescreen: Union[str, Callable[[dict], bool]] = None,
+            balance: str = None,
+            balance_strata: str = "room,probe_type",
+            pass_schedule: str = None,
+            pipeline_commands: bool = False,
             terminate: bool = True,
             args_dict: dict={}) -> None:
         """
@@ -200,6 +336,22 @@ class Dataset(Controller, ABC):
         :param save_passes: a list of which passes to save out as PNGs (or convert to MP4)
         :param save_movies: whether to save out a movie of each trial
         :param save_labels: whether to save out JSON labels for the full trial set.
+        :param save_meshes: whether to send and save object meshes
+        :param pipeline_writes: whether to write each frame to the hdf5 file on a background thread while the next frame renders
+        :param write_queue_size: the maximum number of frames waiting to be written when writes are pipelined
+        :param num_workers: the number of builds to shard trials across; see `TrialScheduler`
+        :param worker_ports: one port per worker; the first must be this controller's port. Defaults to consecutive ports
+        :param record_responses: whether to record the build's responses to each trial in responses/tdw_responses.hdf5
+        :param replay_responses: a tdw_responses.hdf5 file (or the dataset directory with one) to replay instead of using the build
+        :param save_timing: whether to time each stage of each trial and save the times to timing.json and timing.csv
+        :param hdf5_layout: "legacy" for one group per frame, or "columnar" for one dataset per field over all frames
+        :param image_storage: how to store each pass, e.g. "_depth:uint16,_img:gzip"; see `tdw_physics.image_storage`
+        :param stats_workers: the number of processes that compute the across-trial stats. Defaults to one per CPU
+        :param prescreen: if not None, first run every trial without rendering and then render only the trials whose labels pass this predicate (or whose labels in this comma-separated list are all true); see `prescreen_trials()`
+        :param balance: if not None, a trial-level label (optionally with the fraction of trials for which it should be true, e.g. "does_target_contact_zone:0.5"); the parameters of each trial are chosen to meet that fraction and trials are only run until it's met. See `OutcomeSampler`
+        :param balance_strata: comma-separated labels (or static data) whose values split trials into the strata that the outcomes are tracked in
+        :param pass_schedule: which frames to render each pass on, e.g. "_img:every2,_id:0|-1"; passes without a rule are rendered every frame. See `PassSchedule`
+        :param pipeline_commands: whether to send the next frame's commands before the current frame is written, on frames whose commands don't depend on the previous response; see `is_response_independent()`
         """
 
         # If no temp_path given, place in local folder to prevent conflicts with other builds
@@ -215,6 +367,17 @@ class Dataset(Controller, ABC):
         # save a log of the commands send to TDW build
         self.command_log = Path(output_dir).joinpath('tdw_commands.json')
 
+        # record the build's responses to each trial, or replay recorded responses instead of using the build
+        if record_responses and (replay_responses is not None):
+            raise ValueError("Can't record and replay responses at the same time")
+        if record_responses:
+            self.response_recorder = ResponseRecorder(get_responses_path(output_dir))
+        if replay_responses is not None:
+            self.response_replayer = ResponseReplayer(replay_responses)
+
+        # whether to time each stage of each trial
+        self.timer = StageTimer(enabled=save_timing)
+
         # which passes to write to the HDF5
         self.write_passes = write_passes
         if isinstance(self.write_passes, str):
@@ -228,9 +391,27 @@ class Dataset(Controller, ABC):
         self.save_passes = [p for p in self.save_passes if (p in self.write_passes)]
         self.save_movies = save_movies
 
+        # which frames to render each pass on
+        if pass_schedule is not None:
+            self.pass_schedule = PassSchedule(self.write_passes, pass_schedule)
+            self.pass_schedule.reset(self.write_passes)
+
         # whether to send and save meshes
         self.save_meshes = save_meshes
 
+        # whether to overlap hdf5 writes with rendering
+        self.pipeline_writes = pipeline_writes
+        self.write_queue_size = write_queue_size
+
+        # whether to overlap writing a frame with the build running the next one
+        self.pipeline_commands = pipeline_commands
+
+        # how to lay out the per-frame data of each trial file
+        if hdf5_layout not in LAYOUTS:
+            raise ValueError("Unknown hdf5 layout %s; expected one of %s" % (hdf5_layout, LAYOUTS))
+        self.hdf5_layout = hdf5_layout
+        self.image_storage = get_storage_policy(image_storage)
+
         print("write passes", self.write_passes)
         print("save passes", self.save_passes)
         print("save movies", self.save_movies)
@@ -244,31 +425,69 @@ class Dataset(Controller, ABC):
         self.save_labels = save_labels
         if self.save_labels:
             self.meta_file = Path(output_dir).joinpath('metadata.json')
-            if self.meta_file.exists():
-                self.trial_metadata = json.loads(self.meta_file.read_text())
+            # Each trial's labels are appended to metadata.jsonl; metadata.json is written from it at the end of the run
+            self.meta_log = MetadataLog(Path(output_dir).joinpath('metadata.jsonl'))
+            if not self.meta_log.exists() and self.meta_file.exists():
+                # Start the log from the metadata.json of a run from before there was a log
+                legacy_metadata = json.loads(self.meta_file.read_text())
+                self.meta_log.extend(legacy_metadata, [None] * len(legacy_metadata))
             else:
-                self.trial_metadata = []
+                self.meta_log.repair()
+                # Pick up the logs of the workers of a sharded run that didn't finish
+                self.meta_log.merge(sorted(Path(output_dir).glob('metadata_worker*.jsonl')))
+            last_record = self.meta_log.read_tail(1)
+            if len(last_record):
+                print("Appending to the metadata log after trial %s" % last_record[0]["trial"])
+            # The labels of the trials of this run
+            self.trial_metadata = []
 
         initialization_commands = self.get_initialization_commands(width=width, height=height)
 
         # Initialize the scene.
         self.communicate(initialization_commands)
 
+        # Run the physics of every trial without rendering; only the accepted trials are run again with images
+        if prescreen is not None:
+            if bool(self.randomize):
+                print("Prescreened trials can only be re-simulated the same way if the controller isn't randomized (--random 0)")
+            self.prescreened = self.prescreen_trials(num, output_dir, get_prescreen_predicate(prescreen))
+
+        # Choose the parameters of each trial to balance its outcomes
+        if balance is not None:
+            if num_workers > 1 or prescreen is not None:
+                raise ValueError("Balanced runs can't be sharded or prescreened")
+            label, ratio = parse_balance(balance)
+            ranges = self.get_balance_ranges()
+            if len(ranges) == 0:
+                print("%s has no parameters to balance %s with; trials are only filtered" % (type(self).__name__, label))
+            self.outcome_sampler = OutcomeSampler(label=label, num=num, ranges=ranges, ratio=ratio,
+                                                  strata=[s for s in balance_strata.split(",") if len(s) > 0],
+                                                  seed=self.seed)
+            self.balance_log = MetadataLog(OutcomeSampler.get_path(output_dir))
+            self.balance_log.repair()
+            self.outcome_sampler.restore(self.balance_log)
+
         # Run trials
-        self.trial_loop(num, output_dir, temp_path)
+        if num_workers > 1:
+            TrialScheduler(self, num_workers=num_workers, ports=worker_ports).run(num, output_dir, temp_path)
+        else:
+            self.trial_loop(num, output_dir, temp_path)
+
+        if self.response_recorder is not None:
+            self.response_recorder.close()
+        if self.response_replayer is not None:
+            self.response_replayer.close()
+
+        # Write the legacy metadata.json from the log
+        if self.save_labels:
+            self.meta_log.consolidate(self.meta_file)
+
+        if self.outcome_sampler is not None:
+            print(self.outcome_sampler.summary())
 
         # Terminate TDW
-        # Windows doesn't know signal timeout
         if terminate:
-            if platform.system() == 'Windows': end = self.communicate({"$type": "terminate"})
-            else: #Unix systems can use signal to timeout
-                with stopit.SignalTimeout(5) as to_ctx_mgr: #since TDW sometimes doesn't acknowledge being stopped we only *try* to close it
-                    assert to_ctx_mgr.state == to_ctx_mgr.EXECUTING
-                    end = self.communicate({"$type": "terminate"})
-                if to_ctx_mgr.state == to_ctx_mgr.EXECUTED:
-                    print("tdw closed successfully")
-                elif to_ctx_mgr.state == to_ctx_mgr.TIMED_OUT:
-                    print("tdw failed to acknowledge being closed. tdw window might need to be manually closed")
+            self.terminate_build()
 
         # Save the command line args
         if self.save_args:
@@ -277,9 +496,11 @@ class Dataset(Controller, ABC):
 
         # Save the across-trial stats
         if self.save_labels:
-            hdf5_paths = glob.glob(str(output_dir) + '/*.hdf5')
+            # Only the trial files (0000.hdf5, ...)
+            hdf5_paths = [str(p) for p in sorted(Path(output_dir).glob('*.hdf5')) if p.stem.isdigit()]
             stats = get_across_trial_stats_from(
-                hdf5_paths, funcs=self.get_controller_label_funcs(classname=type(self).__name__))
+                hdf5_paths, funcs=self.get_controller_label_funcs(classname=type(self).__name__),
+                num_workers=stats_workers)
             stats["num_trials"] = int(len(hdf5_paths))
             stats_str = json.dumps(stats, indent=4)
             stats_file = Path(output_dir).joinpath('trial_stats.json')
@@ -287,6 +508,45 @@ class Dataset(Controller, ABC):
             print("ACROSS TRIAL STATS")
             print(stats_str)
 
+        # Save the per-stage timing
+        self.timer.write(output_dir)
+
+
+    def terminate_build(self) -> None:
+        """
+        Ask the build to quit.
+        """
+
+        # Windows doesn't know signal timeout
+        if platform.system() == 'Windows': end = self.communicate({"$type": "terminate"})
+        else: #Unix systems can use signal to timeout
+            with stopit.SignalTimeout(5) as to_ctx_mgr: #since TDW sometimes doesn't acknowledge being stopped we only *try* to close it
+                assert to_ctx_mgr.state == to_ctx_mgr.EXECUTING
+                end = self.communicate({"$type": "terminate"})
+            if to_ctx_mgr.state == to_ctx_mgr.EXECUTED:
+                print("tdw closed successfully")
+            elif to_ctx_mgr.state == to_ctx_mgr.TIMED_OUT:
+                print("tdw failed to acknowledge being closed. tdw window might need to be manually closed")
+
+    def connect_to_build(self, port: int) -> None:
+        """
+        Bind a new socket and wait for a build to connect to it, launching the build the same way this controller's was.
+        This is how the sharded workers of a `TrialScheduler`, which are forked from this controller, get their own build.
+
+        :param port: The port of the new build.
+        """
+
+        if self._stand_in_build:
+            launch_stand_in_build(port)
+        elif self._launch_build:
+            Controller.launch_build(port=port)
+        self._port = port
+        self.socket = zmq.Context().socket(zmq.REP)
+        self.socket.bind('tcp://*:' + str(port))
+        self.socket.recv()
+        self.communicate([{"$type": "set_error_handling"},
+                          {"$type": "load_scene",
+                           "scene_name": "ProcGenScene"}])
 
     def update_controller_state(self, **kwargs):
         """
@@ -294,6 +554,13 @@ class Dataset(Controller, ABC):
         """
         return
 
+    def get_balance_ranges(self) -> Dict[str, Tuple[float, float]]:
+        """
+        :return: The range of each scenario parameter that an `OutcomeSampler` can choose a value from. The chosen values are passed to `update_controller_state()` before each trial.
+        """
+
+        return {}
+
     def trial_loop(self,
                    num: int,
                    output_dir: str,
@@ -317,73 +584,306 @@ class Dataset(Controller, ABC):
             temp_path.unlink()
 
         pbar = tqdm(total=num)
-        # Skip trials that aren't on the disk, and presumably have been uploaded; jump to the highest number.
-        exists_up_to = 0
-        for f in output_dir.glob("*.hdf5"):
-            if int(f.stem) > exists_up_to:
-                exists_up_to = int(f.stem)
-
-        if exists_up_to > 0:
-            print('Trials up to %d already exist, skipping those' % exists_up_to)
-
-        pbar.update(exists_up_to)
-        for i in range(exists_up_to, num):
-            filepath = output_dir.joinpath(TDWUtils.zero_padding(i, 4) + ".hdf5")
-            self.stimulus_name = '_'.join([filepath.parent.name, str(Path(filepath.name).with_suffix(''))])
-
-            ## update the controller state
-            self.update_controller_state(**update_kwargs[i])
-
-            if not filepath.exists():
-                if do_log:
-                    start = time.time()
-                    logging.info("Starting trial << %d >> with kwargs %s" % (i, update_kwargs[i]))
-                # Save out images
-                self.png_dir = None
-                if any([pa in PASSES for pa in self.save_passes]):
-                    self.png_dir = output_dir.joinpath("pngs_" + TDWUtils.zero_padding(i, 4))
-                    if not self.png_dir.exists():
-                        self.png_dir.mkdir(parents=True)
-
-                # Do the trial.
+        # Run exactly the trials that aren't complete.
+        indices = self.get_trials_to_run(num, output_dir)
+        pbar.update(num - len(indices))
+        for i in indices:
+            # Seed each trial from its index, as the workers of a sharded run do, so that trial i is the same
+            # whatever the number of workers (and a prescreened trial is re-simulated from the same seed)
+            self.seed_trial(i)
+            if self.outcome_sampler is not None:
+                if not self.run_balanced_trial(i,
+                                               output_dir=output_dir,
+                                               temp_path=temp_path,
+                                               save_frame=save_frame,
+                                               unload_assets_every=unload_assets_every,
+                                               update_kwargs=update_kwargs[i],
+                                               do_log=do_log):
+                    print("Stopping after %d trials without meeting the quotas" % self.outcome_sampler.attempts)
+                    break
+            else:
+                self._run_trial_index(i,
+                                      output_dir=output_dir,
+                                      temp_path=temp_path,
+                                      save_frame=save_frame,
+                                      unload_assets_every=unload_assets_every,
+                                      update_kwargs=update_kwargs[i],
+                                      do_log=do_log)
+            pbar.update(1)
+        pbar.close()
+
+    def get_trials_to_run(self, num: int, output_dir: Path) -> List[int]:
+        """
+        Open the run's manifest (`manifest.jsonl` in the output directory) and find the trials that still have to be run.
+        If there's no manifest yet, the trial files that are already in the output directory are added to it first.
+
+        :param num: The number of trials in the dataset.
+        :param output_dir: The output directory.
+
+        :return: The numbers of the trials that aren't complete.
+        """
+
+        self.manifest = TrialManifest(output_dir.joinpath("manifest.jsonl"))
+        self.manifest.repair()
+        if not self.manifest.exists():
+            existing = self.manifest.add_existing(output_dir)
+            if len(existing) > 0:
+                print('%d trials already exist, skipping those' % len(existing))
+        indices = self.manifest.get_missing(num)
+        if len(indices) < num:
+            print('%d of %d trials are complete, running the other %d' % (num - len(indices), num, len(indices)))
+        if self.prescreened is not None:
+            indices = [i for i in indices if self.prescreened.get(i, {}).get("accepted", False)]
+            print('rendering the %d of these trials that passed the prescreen' % len(indices))
+        return indices
+
+    def seed_trial(self, trial_num: int) -> None:
+        """
+        Reseed the random number generators for a trial, unless the controller is randomized.
+
+        :param trial_num: The index of the trial.
+        """
+
+        if bool(self.randomize):
+            return
+        trial_seed = getattr(self, "MAX_TRIALS", MAX_TRIALS) * self.seed + trial_num
+        random.seed(trial_seed)
+        np.random.seed(trial_seed % (2 ** 32))
+
+    def prescreen_trials(self,
+                         num: int,
+                         output_dir: str,
+                         accept: Callable[[dict], bool],
+                         unload_assets_every: int = 10) -> Dict[int, dict]:
+        """
+        Run each trial without image passes (`set_pass_masks` is empty and no images are sent), writing only the
+        physics data to `prescreen/NNNN.hdf5`, and evaluate `accept` on the trial's labels.
+        Each trial is seeded with `seed_trial()`, so an accepted trial can be re-simulated the same way with full passes.
+        The results are appended to `prescreen/prescreen.jsonl`; trials that are already in it aren't run again.
+
+        :param num: The number of trials in the dataset.
+        :param output_dir: The output directory of the run.
+        :param accept: A function of the trial's labels that returns True if the trial should be rendered.
+        :param unload_assets_every: Unload asset bundles every this many trials.
+
+        :return: The result of each trial: whether it was accepted, the digest of its initialization commands, and its labels.
+        """
+
+        log = PrescreenLog(PrescreenLog.get_path(output_dir))
+        prescreen_dir = log.path.parent
+        if not prescreen_dir.exists():
+            prescreen_dir.mkdir(parents=True)
+        log.repair()
+        results = log.results()
+        todo = [i for i in range(num) if i not in results]
+
+        if len(todo) > 0:
+            self.communicate(PHYSICS_ONLY_COMMANDS)
+            write_passes, save_labels, pass_schedule = self.write_passes, self.save_labels, self.pass_schedule
+            self.write_passes, self.save_labels, self.pass_schedule = [], False, None
+            self.png_dir = None
+            self.movie_encoders = OrderedDict()
+            temp_path = prescreen_dir.joinpath("temp.hdf5")
+            if temp_path.exists():
+                temp_path.unlink()
+            try:
+                for i in tqdm(todo, desc="prescreen"):
+                    self.seed_trial(i)
+                    filepath = prescreen_dir.joinpath(TDWUtils.zero_padding(i, 4) + ".hdf5")
+                    self.stimulus_name = '_'.join([Path(output_dir).name, TDWUtils.zero_padding(i, 4)])
+                    self.trial(filepath=filepath,
+                               temp_path=temp_path,
+                               trial_num=i,
+                               unload_assets_every=unload_assets_every)
+                    f = h5py.File(str(filepath), "r")
+                    labels = get_labels_from(f, label_funcs=self.get_controller_label_funcs(type(self).__name__))
+                    f.close()
+                    results[i] = {"accepted": bool(accept(labels)),
+                                  "init_commands": self.trial_init_digest,
+                                  "labels": labels}
+                    log.append(results[i], i)
+            finally:
+                self.write_passes, self.save_labels, self.pass_schedule = write_passes, save_labels, pass_schedule
+                self.communicate([{"$type": "set_pass_masks",
+                                   "pass_masks": self.write_passes},
+                                  {"$type": "send_images",
+                                   "frequency": "always" if self.pass_schedule is None else "never"}])
+                if self.pass_schedule is not None:
+                    self.pass_schedule.reset(self.write_passes)
+
+        num_accepted = len([i for i in range(num) if results.get(i, {}).get("accepted", False)])
+        print("%d of %d trials passed the prescreen" % (num_accepted, num))
+        return results
+
+    def run_balanced_trial(self,
+                           i: int,
+                           output_dir: Path,
+                           temp_path: Path,
+                           save_frame: int = None,
+                           unload_assets_every: int = 10,
+                           update_kwargs: dict = {},
+                           do_log: bool = False) -> bool:
+        """
+        Run trial `i` with parameters from the outcome sampler until its outcome is one that's still below quota.
+        Each run of the trial is appended to the balance log (`balance.jsonl`); the files of a trial whose outcome is
+        over quota are deleted, its labels are dropped from the metadata log with a tombstone, and the trial is run
+        again with new parameters.
+
+        :param i: The index of the trial.
+
+        :return: True if the trial was accepted, False if the sampler ran out of attempts.
+        """
+
+        sampler = self.outcome_sampler
+        filepath = output_dir.joinpath(TDWUtils.zero_padding(i, 4) + ".hdf5")
+        while not sampler.is_exhausted():
+            bins, params = sampler.sample()
+            kwargs = dict(update_kwargs)
+            kwargs.update(params)
+            # If the trial's file is already there (e.g. the run is being resumed), it isn't run again.
+            ran = not filepath.exists()
+            self._run_trial_index(i,
+                                  output_dir=output_dir,
+                                  temp_path=temp_path,
+                                  save_frame=save_frame,
+                                  unload_assets_every=unload_assets_every,
+                                  update_kwargs=kwargs,
+                                  do_log=do_log)
+            f = h5py.File(str(filepath), "r")
+            try:
+                if self.save_labels and ran:
+                    labels = self.trial_metadata[-1]
+                else:
+                    labels = get_labels_from(f, label_funcs=self.get_controller_label_funcs(type(self).__name__))
+                outcome = sampler.get_outcome(labels)
+                stratum = sampler.get_stratum(f, labels)
+            finally:
+                f.close()
+            accepted = sampler.observe(outcome, stratum, bins)
+            self.balance_log.append({"outcome": outcome, "stratum": stratum, "bins": bins, "params": params,
+                                     "accepted": accepted}, i)
+            if accepted:
+                return True
+            print("Trial %d (%s) has %s=%s, which is over quota; running it again" %
+                  (i, stratum, sampler.label, outcome))
+            self._remove_trial_files(i, output_dir)
+            if self.save_labels:
+                if ran:
+                    self.trial_metadata.pop()
+                self.meta_log.remove(i)
+            if self.manifest is not None:
+                self.manifest.fail(i, "rejected by the outcome sampler")
+        return False
+
+    @staticmethod
+    def _remove_trial_files(i: int, output_dir: Path) -> None:
+        """
+        Delete the hdf5 file, movies, images and meshes of trial `i`.
+        """
+
+        prefix = TDWUtils.zero_padding(i, 4)
+        for path in output_dir.glob(prefix + "*"):
+            if path.is_file() and not path.name[len(prefix):len(prefix) + 1].isdigit():
+                path.unlink()
+        png_dir = output_dir.joinpath("pngs_" + prefix)
+        if png_dir.exists():
+            shutil.rmtree(str(png_dir))
+
+    def _run_trial_index(self,
+                         i: int,
+                         output_dir: Path,
+                         temp_path: Path,
+                         save_frame: int = None,
+                         unload_assets_every: int = 10,
+                         update_kwargs: dict = {},
+                         do_log: bool = False) -> None:
+        """
+        Run the trial with index `i` (unless its file already exists), then save its movies and meshes.
+
+        :param i: The index of the trial.
+        :param output_dir: The directory that trial files are written to.
+        :param temp_path: The path to the temporary file.
+        :param save_frame: If not None, keep this frame of the movie as a PNG.
+        :param unload_assets_every: Unload asset bundles every this many trials.
+        :param update_kwargs: kwargs passed to `update_controller_state()` before the trial.
+        :param do_log: Whether to log the start and end of the trial.
+        """
+
+        filepath = output_dir.joinpath(TDWUtils.zero_padding(i, 4) + ".hdf5")
+        self.stimulus_name = '_'.join([filepath.parent.name, str(Path(filepath.name).with_suffix(''))])
+
+        ## update the controller state
+        self.update_controller_state(**update_kwargs)
+
+        if not filepath.exists():
+            self.timer.start_trial()
+            if do_log:
+                start = time.time()
+                logging.info("Starting trial << %d >> with kwargs %s" % (i, update_kwargs))
+            # Stream the movie of each pass to ffmpeg while the trial runs; the PNG of frame `save_frame`
+            # of the first pass (in sorted order) is kept
+            self.png_dir = None
+            self.movie_encoders = OrderedDict()
+            if self.save_movies:
+                for pass_mask in self.save_passes:
+                    self.movie_encoders[pass_mask] = MP4Encoder(
+                        filename=str(filepath).split('.hdf5')[0] + pass_mask,
+                        save_frame=(save_frame if pass_mask == sorted(self.save_passes)[0] else None))
+            # Save out images
+            elif any([pa in PASSES for pa in self.save_passes]):
+                self.png_dir = output_dir.joinpath("pngs_" + TDWUtils.zero_padding(i, 4))
+                if not self.png_dir.exists():
+                    self.png_dir.mkdir(parents=True)
+
+            # Do the trial.
+            if self.manifest is not None:
+                self.manifest.start(i)
+            try:
                 self.trial(filepath=filepath,
                            temp_path=temp_path,
                            trial_num=i,
                            unload_assets_every=unload_assets_every)
-
-                # Save an MP4 of the stimulus
-                if self.save_movies:
-                    for pass_mask in self.save_passes:
-                        mp4_filename = str(filepath).split('.hdf5')[0] + pass_mask
-                        cmd, stdout, stderr = pngs_to_mp4(
-                            filename=mp4_filename,
-                            image_stem=pass_mask[1:]+'_',
-                            png_dir=self.png_dir,
-                            size=[self._height, self._width],
-                            overwrite=True,
-                            remove_pngs=(True if save_frame is None else False),
-                            use_parent_dir=False)
-
+            except BaseException as e:
+                if self.manifest is not None:
+                    self.manifest.fail(i, repr(e))
+                for encoder in self.movie_encoders.values():
+                    encoder.abort()
+                self.movie_encoders = OrderedDict()
+                raise
+            if self.manifest is not None:
+                self.manifest.complete(i, filepath)
+            if self.prescreened is not None and i in self.prescreened and \
+                    self.prescreened[i]["init_commands"] != self.trial_init_digest:
+                print("Trial %d wasn't initialized the same way as in the prescreen" % i)
+
+            # Finish the MP4s of the stimulus
+            if self.save_movies:
+                for encoder in self.movie_encoders.values():
+                    try:
+                        with self.timer.time("write_mp4"):
+                            cmd, stdout, stderr = encoder.close()
+                    except RuntimeError as e:
+                        # The trial is kept without this MP4.
+                        print(e)
                     if save_frame is not None:
-                        frames = os.listdir(str(self.png_dir))
-                        sv = sorted(frames)[save_frame]
-                        png = output_dir.joinpath(TDWUtils.zero_padding(i, 4) + ".png")
-                        _ = subprocess.run('mv ' + str(self.png_dir) + '/' + sv + ' ' + str(png), shell=True)
+                        encoder.save_still(output_dir.joinpath(TDWUtils.zero_padding(i, 4)))
+                self.movie_encoders = OrderedDict()
 
-                    rm = subprocess.run('rm -rf ' + str(self.png_dir), shell=True)
 
-
-                if self.save_meshes:
-                    for o_id in self.object_ids:
-                        obj_filename = str(filepath).split('.hdf5')[0] + f"_obj{o_id}.obj"
-                        vertices, faces = self.object_meshes[o_id]
+            if self.save_meshes:
+                for o_id in self.object_ids:
+                    obj_filename = str(filepath).split('.hdf5')[0] + f"_obj{o_id}.obj"
+                    vertices, faces = self.object_meshes[o_id]
+                    with self.timer.time("save_obj"):
                         save_obj(vertices, faces, obj_filename)
 
-                if do_log:
-                    end = time.time()
-                    logging.info("Finished trial << %d >> with trial seed = %d (elapsed time: %d seconds)" % (i, self.trial_seed, int(end-start)))
-            pbar.update(1)
-        pbar.close()
+            self.timer.end_trial(i)
+            if do_log:
+                end = time.time()
+                logging.info("Finished trial << %d >> with trial seed = %d (elapsed time: %d seconds)" % (i, self.trial_seed, int(end-start)))
+        elif self.manifest is not None:
+            # The file was written, but the manifest doesn't have the trial as complete (e.g. it's from another run).
+            self.manifest.complete(i, filepath)
 
     def trial(self,
               filepath: Path,
@@ -401,6 +901,8 @@ class Dataset(Controller, ABC):
         # Clear the object IDs and other static data
         self.clear_static_data()
         self._trial_num = trial_num
+        self._start_response_log(trial_num)
+        self.image_cache.clear()
 
         # Create the .hdf5 file.
         f = h5py.File(str(temp_path.resolve()), "a")
@@ -411,19 +913,28 @@ class Dataset(Controller, ABC):
             commands.append({"$type": "unload_asset_bundles"})
 
         # Add commands to start the trial.
-        commands.extend(self.get_trial_initialization_commands())
+        init_commands = self.get_trial_initialization_commands()
+        self.trial_init_digest = get_commands_digest(init_commands)
+        commands.extend(init_commands)
         # Add commands to request output data.
         commands.extend(self._get_send_data_commands())
+        # Render only the passes that are scheduled for this frame
+        if self.pass_schedule is not None:
+            commands.extend(self.pass_schedule.get_commands(0))
 
         # Send the commands and start the trial.
-        r_types = ['']
-        count = 0
-        resp = self.communicate(commands)
+        frame = 0
+        resp = FrameResponse(self.communicate(commands), frame_num=frame, timer=self.timer,
+                             collision_buffer=self.collision_buffer, env_collision_buffer=self.env_collision_buffer)
+        # The frames that have each pass
+        pass_frames = OrderedDict((pass_mask, []) for pass_mask in self.write_passes)
+        self._add_pass_frames(pass_frames, resp, frame)
+        # Whether the next frame's commands were sent before this frame was written
+        sent_ahead = self._send_ahead(resp, frame + 1)
 
         self._set_segmentation_colors(resp)
 
         self._get_object_meshes(resp)
-        frame = 0
         # Write static data to disk.
         static_group = f.create_group("static")
         self._write_static_data(static_group)
@@ -431,52 +942,127 @@ class Dataset(Controller, ABC):
         # Add the first frame.
         done = False
         frames_grp = f.create_group("frames")
-        frame_grp, _, _, _ = self._write_frame(frames_grp=frames_grp, resp=resp, frame_num=frame)
-        self._write_frame_labels(frame_grp, resp, -1, False)
-
-        # Continue the trial. Send commands, and parse output data.
-        while not done:
-            frame += 1
-            # print('frame %d' % frame)
-            resp = self.communicate(self.get_per_frame_commands(resp, frame))
-            r_ids = [OutputData.get_data_type_id(r) for r in resp[:-1]]
-
-            # Sometimes the build freezes and has to reopen the socket.
-            # This prevents such errors from throwing off the frame numbering
-            # if ('imag' not in r_ids) or ('tran' not in r_ids):
-            #     print("retrying frame %d, response only had %s" % (frame, r_ids))
-            #     frame -= 1
-            #     continue
-            frame_grp, objs_grp, tr_dict, done = self._write_frame(frames_grp=frames_grp, resp=resp, frame_num=frame)
-
-            # Write whether this frame completed the trial and any other trial-level data
-            labels_grp, _, _, done = self._write_frame_labels(frame_grp, resp, frame, done)
+        # A columnar trial writes each per-frame dataset as one column over all frames.
+        if self.hdf5_layout == "columnar":
+            f.attrs["layout"] = "columnar"
+            frames_grp = ColumnarFrames(frames_grp)
+        # If writes are pipelined, each frame is buffered in memory and written to disk on a background thread.
+        writer = FrameWriter(frames_grp, self.write_queue_size) if self.pipeline_writes else None
+        try:
+            frame_buffer = BufferedGroup("frames") if writer is not None else frames_grp
+            with self.timer.time("write_frame"):
+                frame_grp, _, _, _ = self._write_frame(frames_grp=frame_buffer, resp=resp, frame_num=frame)
+            with self.timer.time("write_frame_labels"):
+                self._write_frame_labels(frame_grp, resp, -1, False)
+            if writer is not None:
+                with self.timer.time("write_wait"):
+                    writer.put(frame_buffer)
+            # The _map.png overlay reads frame 0's _id pass at the end of the trial.
+            self.image_cache.evict(frame, keep=["_id"])
+
+            # Continue the trial. Send commands, and parse output data.
+            while not done:
+                frame += 1
+                # print('frame %d' % frame)
+                if sent_ahead:
+                    raw = self.receive_response()
+                    sent_ahead = False
+                else:
+                    raw = self.communicate(self._get_frame_commands(resp, frame))
+                resp = FrameResponse(raw, frame_num=frame,
+                                     timer=self.timer, collision_buffer=self.collision_buffer,
+                                     env_collision_buffer=self.env_collision_buffer)
+                self._add_pass_frames(pass_frames, resp, frame)
+                sent_ahead = self._send_ahead(resp, frame + 1)
+
+                # Sometimes the build freezes and has to reopen the socket.
+                # This prevents such errors from throwing off the frame numbering
+                # if (not resp.has('imag')) or (not resp.has('tran')):
+                #     print("retrying frame %d, response only had %s" % (frame, resp.r_ids))
+                #     frame -= 1
+                #     continue
+                frame_buffer = BufferedGroup("frames") if writer is not None else frames_grp
+                with self.timer.time("write_frame"):
+                    frame_grp, objs_grp, tr_dict, done = self._write_frame(frames_grp=frame_buffer, resp=resp, frame_num=frame)
+
+                # Write whether this frame completed the trial and any other trial-level data
+                with self.timer.time("write_frame_labels"):
+                    labels_grp, _, _, done = self._write_frame_labels(frame_grp, resp, frame, done)
+                if writer is not None:
+                    with self.timer.time("write_wait"):
+                        writer.put(frame_buffer)
+                self.image_cache.evict(frame)
+
+            # The frame after the last one was already sent; its response is discarded
+            if sent_ahead:
+                self.receive_response()
+                sent_ahead = False
+            # Wait for the remaining frames to be written before the file is read back for labels.
+            if writer is not None:
+                with self.timer.time("write_wait"):
+                    writer.close()
+            # Render the passes scheduled for the last frame, now that it's known, without stepping physics
+            last_frame_commands = [] if self.pass_schedule is None else \
+                self.pass_schedule.get_last_frame_commands(frame)
+            if len(last_frame_commands) > 0:
+                resp = FrameResponse(self.communicate(last_frame_commands), frame_num=frame, timer=self.timer)
+                if self.hdf5_layout == "columnar":
+                    images_grp = frames_grp.create_group(TDWUtils.zero_padding(frame, 4)).create_group("images")
+                else:
+                    images_grp = frames_grp[TDWUtils.zero_padding(frame, 4)]["images"]
+                with self.timer.time("write_frame"):
+                    self._write_frame_images(images_grp, resp, frame)
+                self._add_pass_frames(pass_frames, resp, frame)
+                self.image_cache.evict(frame)
+            if self.hdf5_layout == "columnar":
+                frames_grp.close()
+            write_pass_frames(f, pass_frames)
+        except BaseException:
+            # Don't leave a half-written temp file behind, and don't write to it from the background thread.
+            if writer is not None:
+                writer.abort()
+            # Take the build's response to a frame that was sent ahead, so the socket can send again
+            if sent_ahead:
+                self.receive_response()
+            f.close()
+            if temp_path.exists():
+                temp_path.unlink()
+            self._end_response_log()
+            self.image_cache.clear()
+            raise
 
         # Cleanup.
         commands = []
+        if len(last_frame_commands) > 0:
+            commands.append({"$type": "simulate_physics",
+                             "value": True})
         for o_id in self.object_ids:
             commands.append({"$type": self._get_destroy_object_command_name(o_id),
                              "id": int(o_id)})
         self.communicate(commands)
+        self._end_response_log()
 
         # Compute the trial-level metadata. Save it per trial in case of failure mid-trial loop
         if self.save_labels:
             meta = OrderedDict()
-            meta = get_labels_from(f, label_funcs=self.get_controller_label_funcs(type(self).__name__), res=meta)
+            with self.timer.time("compute_labels"):
+                meta = get_labels_from(f, label_funcs=self.get_controller_label_funcs(type(self).__name__), res=meta,
+                                       image_cache=self.image_cache)
             self.trial_metadata.append(meta)
 
-            # Save the trial-level metadata
-            json_str =json.dumps(self.trial_metadata, indent=4)
-            self.meta_file.write_text(json_str, encoding='utf-8')
+            # Append the trial-level metadata to the log
+            with self.timer.time("write_metadata"):
+                self.meta_log.append(meta, self._trial_num)
             print("TRIAL %d LABELS" % self._trial_num)
             print(json.dumps(self.trial_metadata[-1], indent=4))
 
-        # Save out the target/zone segmentation mask
-        if (self.zone_id in self.object_ids) and (self.target_id in self.object_ids):
+        # Save out the target/zone segmentation mask (if the _id pass was written)
+        first_frame = legacy_view(f)['frames']['0000']
+        if (self.zone_id in self.object_ids) and (self.target_id in self.object_ids) and \
+                ('_id' in first_frame['images']) and (0 in pass_frames.get('_id', [])):
 
-            _id = f['frames']['0000']['images']['_id']
-            #get PIL image
-            _id_map = np.array(Image.open(io.BytesIO(np.array(_id))))
+            #get the decoded image
+            _id_map = self.image_cache.get(0, '_id', lambda: first_frame['images']['_id'][:])
             #get colors
             zone_idx = [i for i,o_id in enumerate(self.object_ids) if o_id == self.zone_id]
             zone_color = self.object_segmentation_colors[zone_idx[0] if len(zone_idx) else 0]
@@ -495,10 +1081,13 @@ class Dataset(Controller, ABC):
             #as image
             map_img = Image.fromarray(np.uint8(joint_map))
             #save image
-            map_img.save(filepath.parent.joinpath(filepath.stem+"_map.png"))
+            with self.timer.time("save_png"):
+                map_img.save(filepath.parent.joinpath(filepath.stem+"_map.png"))
+        self.image_cache.clear()
 
         # Close the file.
-        f.close()
+        with self.timer.time("close_hdf5"):
+            f.close()
         # Move the file.
         try:
             temp_path.replace(filepath)
@@ -564,7 +1153,7 @@ class Dataset(Controller, ABC):
 
         return {"x": a_x, "y": a_y, "z": a_z}
 
-    def is_done(self, resp: List[bytes], frame: int) -> bool:
+    def is_done(self, resp: FrameResponse, frame: int) -> bool:
         """
         Override this command for special logic to end the trial.
 
@@ -620,30 +1209,85 @@ class Dataset(Controller, ABC):
             static_group.create_dataset("object_segmentation_colors", data=self.object_segmentation_colors)
 
     @abstractmethod
-    def _write_frame(self, frames_grp: h5py.Group, resp: List[bytes], frame_num: int) -> \
+    def _write_frame(self, frames_grp: h5py.Group, resp: FrameResponse, frame_num: int) -> \
             Tuple[h5py.Group, h5py.Group, dict, bool]:
         """
         Write a frame to the hdf5 file.
 
         :param frames_grp: The frames hdf5 group.
-        :param resp: The response from the build.
+        :param resp: The parsed response from the build.
         :param frame_num: The frame number.
 
-        :return: Tuple: (The frame group, the objects group, a dictionary of Transforms, True if the trial is "done")
+        :return: Tuple: (The frame group, the objects group, the Transforms data, True if the trial is "done")
+        """
+
+        raise Exception()
+
+    def is_response_independent(self, frame: int) -> bool:
+        """
+        Override this to let the frame loop send a frame's commands before the previous frame's response is written
+        (see `run(pipeline_commands=True)`), so that the build runs the frame while the controller writes the last one.
+
+        :param frame: The frame number.
+
+        :return: True if `get_per_frame_commands(resp, frame)` doesn't read `resp` or anything that's updated while the previous frame is written (e.g. by `is_done()`).
+        """
+
+        return False
+
+    def _get_frame_commands(self, resp: FrameResponse, frame: int) -> List[dict]:
+        commands = self.get_per_frame_commands(resp, frame)
+        if self.pass_schedule is not None:
+            commands = commands + self.pass_schedule.get_commands(frame)
+        return commands
+
+    def _send_ahead(self, resp: FrameResponse, frame: int) -> bool:
+        """
+        If commands are pipelined and the frame's commands don't depend on the previous response, send them now.
+        The build can only run one frame at a time, so at most one frame is sent ahead. If the trial turns out to be
+        done, the frame's response is discarded. Frames aren't sent ahead if the last frame has scheduled passes,
+        which are rendered after it without stepping physics.
+
+        :param resp: The previous frame's response.
+        :param frame: The frame number.
+
+        :return: True if the frame's commands were sent.
+        """
+
+        if not self.pipeline_commands or not self.is_response_independent(frame):
+            return False
+        if self.pass_schedule is not None and self.pass_schedule.renders_last_frame():
+            return False
+        self.send_commands(self._get_frame_commands(resp, frame))
+        return True
+
+    def _write_frame_images(self, images_grp: h5py.Group, resp: FrameResponse, frame_num: int) -> None:
+        """
+        Write the images of a response to the `images` group of a frame.
+
+        :param images_grp: The frame's `images` group.
+        :param resp: The response from the build.
+        :param frame_num: The frame number.
         """
 
         raise Exception()
 
+    @staticmethod
+    def _add_pass_frames(pass_frames: Dict[str, List[int]], resp: FrameResponse, frame_num: int) -> None:
+        for pass_mask in resp.images.keys():
+            if pass_mask in pass_frames:
+                pass_frames[pass_mask].append(frame_num)
+
     def _write_frame_labels(self,
                             frame_grp: h5py.Group,
-                            resp: List[bytes],
+                            resp: FrameResponse,
                             frame_num: int,
                             sleeping: bool) -> Tuple[h5py.Group, bool]:
         """
         Writes the trial-level data for this frame.
 
         :param frame_grp: The hdf5 group for a single frame.
-        :param resp: The response from the build.
+        :param resp: The parsed response from the build.
         :param frame_num: The frame number.
         :param sleeping: Whether this trial timed out due to objects falling asleep.
 
@@ -680,9 +1324,9 @@ class Dataset(Controller, ABC):
         return "destroy_object"
 
     @abstractmethod
-    def get_per_frame_commands(self, resp: List[bytes], frame: int) -> List[dict]:
+    def get_per_frame_commands(self, resp: FrameResponse, frame: int) -> List[dict]:
         """
-        :param resp: The output data response.
+        :param resp: The parsed output data response.
         :param frame: The frame number
 
         :return: Commands to send per frame.
@@ -721,16 +1365,17 @@ class Dataset(Controller, ABC):
 
     def get_material_name(self, material):
 
+        material_names = LIBRARY_INDEX.get_material_names()
         if material is not None:
-            if material in MATERIAL_TYPES:
-                mat = random.choice(MATERIAL_NAMES[material])
+            if material in material_names:
+                mat = random.choice(material_names[material])
             else:
-                assert any((material in MATERIAL_NAMES[mtype] for mtype in self.material_types)), \
+                assert any((material in material_names[mtype] for mtype in self.material_types)), \
                     (material, self.material_types)
                 mat = material
         else:
             mtype = random.choice(self.material_types)
-            mat = random.choice(MATERIAL_NAMES[mtype])
+            mat = random.choice(material_names[mtype])
 
         return mat
 
@@ -740,7 +1385,7 @@ class Dataset(Controller, ABC):
         return commands
 
 
-    def _set_segmentation_colors(self, resp: List[bytes]) -> None:
+    def _set_segmentation_colors(self, resp: FrameResponse) -> None:
 
         self.object_segmentation_colors = None
 
@@ -748,41 +1393,32 @@ class Dataset(Controller, ABC):
             self.object_segmentation_colors = []
             return
 
-        for r in resp:
-            if OutputData.get_data_type_id(r) == 'segm':
-                seg = SegmentationColors(r)
-                colors = {}
-                for i in range(seg.get_num()):
-                    try:
-                        colors[seg.get_object_id(i)] = seg.get_object_color(i)
-                    except:
-                        print("No object id found for seg", i)
+        for r in resp.get_raw('segm'):
+            seg = SegmentationColors(r)
+            colors = {}
+            for i in range(seg.get_num()):
+                try:
+                    colors[seg.get_object_id(i)] = seg.get_object_color(i)
+                except:
+                    print("No object id found for seg", i)
 
-                self.object_segmentation_colors = []
-                for o_id in self.object_ids:
-                    if o_id in colors.keys():
-                        self.object_segmentation_colors.append(
-                            np.array(colors[o_id], dtype=np.uint8).reshape(1,3))
-                    else:
-                        self.object_segmentation_colors.append(
-                            np.array([0,0,0], dtype=np.uint8).reshape(1,3))
-
-                self.object_segmentation_colors = np.concatenate(self.object_segmentation_colors, 0)
-
-    def _is_object_in_view(self, resp, o_id, pix_thresh=10) -> bool:
-
-        id_map = None
-        for r in resp[:-1]:
-            r_id = OutputData.get_data_type_id(r)
-            if r_id == "imag":
-                im = Images(r)
-                for i in range(im.get_num_passes()):
-                    pass_mask = im.get_pass_mask(i)
-                    if pass_mask == "_id":
-                        id_map = np.array(Image.open(io.BytesIO(np.array(im.get_image(i))))).reshape(self._height, self._width, 3)
-
-        if id_map is None:
+            self.object_segmentation_colors = []
+            for o_id in self.object_ids:
+                if o_id in colors.keys():
+                    self.object_segmentation_colors.append(
+                        np.array(colors[o_id], dtype=np.uint8).reshape(1,3))
+                else:
+                    self.object_segmentation_colors.append(
+                        np.array([0,0,0], dtype=np.uint8).reshape(1,3))
+
+            self.object_segmentation_colors = np.concatenate(self.object_segmentation_colors, 0)
+
+    def _is_object_in_view(self, resp: FrameResponse, o_id, pix_thresh=10) -> bool:
+
+        _id = self.image_cache.get(resp.frame_num, "_id", lambda: resp.get_image("_id"))
+        if _id is None:
             return True
+        id_map = _id.reshape(self._height, self._width, 3)
 
         obj_index = [i for i,_o_id in enumerate(self.object_ids) if _o_id == o_id]
         if not len(obj_index):
@@ -796,36 +1432,26 @@ class Dataset(Controller, ABC):
         return in_view
 
 
-    def _max_optical_flow(self, resp):
+    def _max_optical_flow(self, resp: FrameResponse):
 
-        flow_map = None
-        for r in resp[:-1]:
-            r_id = OutputData.get_data_type_id(r)
-            if r_id == "imag":
-                im = Images(r)
-                for i in range(im.get_num_passes()):
-                    pass_mask = im.get_pass_mask(i)
-                    if pass_mask == "_flow":
-                        flow_map = np.array(Image.open(io.BytesIO(np.array(im.get_image(i))))).reshape(self._height, self._width, 3)
-
-        if flow_map is None:
+        _flow = self.image_cache.get(resp.frame_num, "_flow", lambda: resp.get_image("_flow"))
+        if _flow is None:
             return float(0)
 
-        else:
-            return flow_map.sum(-1).max().astype(float)
+        flow_map = _flow.reshape(self._height, self._width, 3)
+        return flow_map.sum(-1).max().astype(float)
 
-    def _get_object_meshes(self, resp: List[bytes]) -> None:
+    def _get_object_meshes(self, resp: FrameResponse) -> None:
 
         self.object_meshes = dict()
         # {object_id: (vertices, faces)}
-        for r in resp:
-            if OutputData.get_data_type_id(r) == 'mesh':
-                meshes = Meshes(r)
-                nmeshes = meshes.get_num()
-
-                assert(len(self.object_ids) == nmeshes)
-                for index in range(nmeshes):
-                    o_id = meshes.get_object_id(index)
-                    vertices = meshes.get_vertices(index)
-                    faces = meshes.get_triangles(index)
-                    self.object_meshes[o_id] = (vertices, faces)
+        for r in resp.get_raw('mesh'):
+            meshes = Meshes(r)
+            nmeshes = meshes.get_num()
+
+            assert(len(self.object_ids) == nmeshes)
+            for index in range(nmeshes):
+                o_id = meshes.get_object_id(index)
+                vertices = meshes.get_vertices(index)
+                faces = meshes.get_triangles(index)
+                self.object_meshes[o_id] = (vertices, faces)
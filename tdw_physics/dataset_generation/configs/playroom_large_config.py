@@ -1,14 +1,11 @@
 import random
 import numpy as np
-from tdw_physics.util import MODEL_LIBRARIES
+from tdw_physics.util import MODEL_LIBRARIES, get_model_names
+from tdw_physics.library_index import LIBRARY_INDEX
 
 SEED = 0
-RECORDS = []
-for lib in MODEL_LIBRARIES.values():
-    RECORDS.extend(lib.records)
-
-MODELS = sorted(list(set([r.name for r in RECORDS if not r.do_not_use])))
-CATEGORIES = sorted(list(set([r.wcategory for r in RECORDS])))
+MODELS = sorted(list(set([name for lib in MODEL_LIBRARIES.keys() for name in get_model_names(lib, usable=True)])))
+CATEGORIES = sorted(list(set([c for lib in MODEL_LIBRARIES.keys() for c in LIBRARY_INDEX.get_model_categories(lib).values()])))
 NUM_MOVING_MODELS = 1000
 NUM_STATIC_MODELS = 1000
 
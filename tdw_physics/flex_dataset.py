@@ -6,6 +6,7 @@ from abc import ABC
 from tdw.librarian import ModelRecord
 from tdw.output_data import FlexParticles
 from tdw_physics.transforms_dataset import TransformsDataset
+from tdw_physics.frame_response import FrameResponse, ObjectArrays
 
 
 class _Actor(ABC):
@@ -130,24 +131,23 @@ class FlexDataset(TransformsDataset, ABC):
             for key in actor_data:
                 actors_group.create_dataset(key, data=actor_data[key])
 
-    def _write_frame(self, frames_grp: h5py.Group, resp: List[bytes], frame_num: int) -> \
-            Tuple[h5py.Group, h5py.Group, dict, bool]:
+    def _write_frame(self, frames_grp: h5py.Group, resp: FrameResponse, frame_num: int) -> \
+            Tuple[h5py.Group, h5py.Group, ObjectArrays, bool]:
         frame, objs, tr, done = super()._write_frame(frames_grp=frames_grp, resp=resp, frame_num=frame_num)
         particles_group = frame.create_group("particles")
         velocities_group = frame.create_group("velocities")
-        for r in resp[:-1]:
-            if FlexParticles.get_data_type_id(r) == "flex":
-                f = FlexParticles(r)
-                flex_dict = dict()
-                for i in range(f.get_num_objects()):
-                    flex_dict.update({f.get_id(i): {"par": f.get_particles(i),
-                                                    "vel": f.get_velocities(i)}})
-                # Add the Flex data.
-                for o_id in self.object_ids:
-                    if o_id not in flex_dict:
-                        continue
-                    particles_group.create_dataset(str(o_id), data=flex_dict[o_id]["par"])
-                    velocities_group.create_dataset(str(o_id), data=flex_dict[o_id]["vel"])
+        for r in resp.get_raw("flex"):
+            f = FlexParticles(r)
+            flex_dict = dict()
+            for i in range(f.get_num_objects()):
+                flex_dict.update({f.get_id(i): {"par": f.get_particles(i),
+                                                "vel": f.get_velocities(i)}})
+            # Add the Flex data.
+            for o_id in self.object_ids:
+                if o_id not in flex_dict:
+                    continue
+                particles_group.create_dataset(str(o_id), data=flex_dict[o_id]["par"])
+                velocities_group.create_dataset(str(o_id), data=flex_dict[o_id]["vel"])
         return frame, objs, tr, done
 
     def add_solid_object(self, record: ModelRecord, position: Dict[str, float], rotation: Dict[str, float],
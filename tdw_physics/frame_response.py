@@ -0,0 +1,561 @@
+from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict
+import numpy as np
+from tdw.tdw_utils import TDWUtils
+from tdw.output_data import (OutputData, Transforms, Rigidbodies, Bounds, Images, CameraMatrices,
+                             Collision, EnvironmentCollision)
+from tdw_physics.stage_timer import StageTimer
+
+# The bound types sent by `send_bounds`, in the order they are written to the hdf5 file.
+BOUND_TYPES = ['front', 'back', 'left', 'right', 'top', 'bottom', 'center']
+
+_NO_TIMER = StageTimer(enabled=False)
+
+# The layouts of the per-object structs of `Transforms`, `Rigidbodies` and `Bounds`, so that they can be read in bulk.
+TRANSFORMS_DTYPE = np.dtype([("id", "<i4"), ("positions", "<f4", 3), ("rotations", "<f4", 4), ("forwards", "<f4", 3)])
+RIGIDBODIES_DTYPE = np.dtype([("id", "<i4"), ("velocities", "<f4", 3), ("angular_velocities", "<f4", 3),
+                              ("sleeping", "?"), ("pad", "V3")])
+BOUNDS_DTYPE = np.dtype([("id", "<i4"), ("front", "<f4", 3), ("back", "<f4", 3), ("right", "<f4", 3),
+                         ("left", "<f4", 3), ("top", "<f4", 3), ("bottom", "<f4", 3), ("center", "<f4", 3)])
+
+
+def _concatenate(chunks: List[np.ndarray], dtype: np.dtype) -> np.ndarray:
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=dtype)
+    elif len(chunks) == 1:
+        return chunks[0]
+    return np.concatenate(chunks)
+
+
+def read_structs(output_data: OutputData, dtype: np.dtype) -> Optional[np.ndarray]:
+    """
+    Read the vector of per-object structs of output data in one `np.frombuffer()` call, instead of one struct at a time.
+
+    :param output_data: `Transforms`, `Rigidbodies` or `Bounds` output data.
+    :param dtype: The layout of the struct.
+
+    :return: One row per object, or None if the output data doesn't have the expected layout.
+    """
+
+    data = getattr(output_data, "data", None)
+    tab = getattr(data, "_tab", None)
+    # Other versions of TDW lay out some output data differently, e.g. `Bounds` without an `Objects` vector.
+    if tab is None or not hasattr(data, "ObjectsLength") or not hasattr(data, "Objects"):
+        return None
+    try:
+        num = data.ObjectsLength()
+        if num == 0:
+            return np.zeros(0, dtype=dtype)
+        o = tab.Offset(4)
+        structs = np.frombuffer(tab.Bytes, dtype=dtype, count=num, offset=tab.Vector(o))
+        # Check the layout against the first and last objects.
+        if structs["id"][0] != data.Objects(0).Id() or structs["id"][-1] != data.Objects(num - 1).Id():
+            return None
+    except (AttributeError, ValueError):
+        return None
+    return structs
+
+
+class ObjectIndex:
+    """
+    A vectorized map from object IDs to their rows in an array of IDs, e.g. `self.object_ids` or the IDs of some output data.
+    If an ID appears more than once, the last row wins.
+    """
+
+    def __init__(self, ids: np.ndarray):
+        """
+        :param ids: The object IDs, one per row.
+        """
+
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        self.num_ids = len(ids)
+        self._order = np.argsort(ids, kind="stable")
+        self._sorted = ids[self._order]
+
+    def lookup(self, ids: np.ndarray) -> np.ndarray:
+        """
+        :param ids: Object IDs.
+
+        :return: The row of each ID, or -1 if it isn't in the index.
+        """
+
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if self.num_ids == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        # With a stable sort, the rightmost match of an ID is its last row.
+        pos = np.searchsorted(self._sorted, ids, side="right") - 1
+        found = (pos >= 0) & (self._sorted[np.maximum(pos, 0)] == ids)
+        return np.where(found, self._order[np.maximum(pos, 0)], -1)
+
+
+class ObjectArrays:
+    """
+    Per-object arrays parsed from one type of output data.
+    Rows are in the order the build sent them; `index` maps an object ID to its row.
+    """
+
+    def __init__(self, ids: np.ndarray, **arrays: np.ndarray):
+        """
+        :param ids: The object IDs, one per row.
+        :param arrays: The named per-object arrays, each with `len(ids)` rows.
+        """
+
+        self.ids = ids
+        self.arrays = arrays
+        self._index: Optional[Dict[int, int]] = None
+        self._row_index: Optional[ObjectIndex] = None
+
+    @property
+    def index(self) -> Dict[int, int]:
+        """
+        :return: A dictionary of object ID: row. If an object appears more than once, the last row wins.
+        """
+
+        if self._index is None:
+            self._index = {int(o_id): i for i, o_id in enumerate(self.ids)}
+        return self._index
+
+    def get_rows(self, ids: np.ndarray) -> np.ndarray:
+        """
+        :param ids: Object IDs.
+
+        :return: The row of each object, or -1 if the object isn't in this output data.
+        """
+
+        if self._row_index is None:
+            self._row_index = ObjectIndex(self.ids)
+        return self._row_index.lookup(ids)
+
+    def scatter(self, object_index: ObjectIndex, key: str, out: np.ndarray) -> np.ndarray:
+        """
+        Copy the rows of array `key` to the rows of `out` of the same objects, with one fancy-index assignment.
+
+        :param object_index: The index of the rows of `out`, e.g. of `self.object_ids`.
+        :param key: The name of the array.
+        :param out: The array to copy to; rows of objects that aren't in this output data aren't changed.
+
+        :return: A boolean mask of the rows of `out` that were copied to.
+        """
+
+        rows = object_index.lookup(self.ids)
+        found = rows >= 0
+        out[rows[found]] = self.arrays[key][found]
+        copied = np.zeros(object_index.num_ids, dtype=bool)
+        copied[rows[found]] = True
+        return copied
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.arrays[key]
+
+    def __contains__(self, o_id: int) -> bool:
+        return int(o_id) in self.index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, o_id: int, key: str, default=None):
+        """
+        :param o_id: The object ID.
+        :param key: The name of the array.
+        :param default: Returned if the object isn't in this output data.
+
+        :return: The row of array `key` for object `o_id`.
+        """
+
+        row = self.index.get(int(o_id))
+        if row is None:
+            return default
+        return self.arrays[key][row]
+
+
+class CollisionArrays:
+    """
+    Collisions parsed from `Collision` or `EnvironmentCollision` output data.
+    Contacts of all collisions are stacked in one array; `offsets[i]:offsets[i+1]` are the contacts of collision `i`.
+    """
+
+    def __init__(self,
+                 ids: np.ndarray,
+                 states: np.ndarray,
+                 contacts: np.ndarray,
+                 offsets: np.ndarray,
+                 relative_velocities: Optional[np.ndarray] = None):
+        """
+        :param ids: `(N, 2)` collider and collidee IDs, or `(N,)` object IDs for environment collisions.
+        :param states: `(N,)` collision states ("enter", "stay", "exit").
+        :param contacts: `(M, 2, 3)` contact (normal, point) pairs.
+        :param offsets: `(N + 1,)` start of each collision's contacts in `contacts`.
+        :param relative_velocities: `(N, 3)` relative velocities; None for environment collisions.
+        """
+
+        self.ids = ids
+        self.states = states
+        self.contacts = contacts
+        self.offsets = offsets
+        self.relative_velocities = relative_velocities
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def get_contacts(self, index: int) -> np.ndarray:
+        """
+        :param index: The index of the collision.
+
+        :return: `(num_contacts, 2, 3)` contact (normal, point) pairs of that collision.
+        """
+
+        return self.contacts[self.offsets[index]:self.offsets[index + 1]]
+
+
+class CollisionBuffer:
+    """
+    Preallocated, growable columns that collisions are parsed into, reused from frame to frame.
+    `reset()` sizes the per-collision columns from the number of `coll` or `enco` entries in the response; contacts
+    grow by doubling as they're added. Capacity is kept between frames, so after the first few frames of a trial
+    parsing doesn't allocate anything but the output arrays.
+    """
+
+    def __init__(self, env: bool = False, capacity: int = 16, contact_capacity: int = 64):
+        """
+        :param env: If True, this buffer is for `EnvironmentCollision` data: one object ID and no relative velocity per collision.
+        :param capacity: The initial number of collisions.
+        :param contact_capacity: The initial number of contacts.
+        """
+
+        self.env = env
+        self.num_collisions = 0
+        self.num_contacts = 0
+        self.ids = np.empty((capacity,) if env else (capacity, 2), dtype=np.int64)
+        self.states = np.empty(capacity, dtype="<U16")
+        self.relative_velocities = None if env else np.empty((capacity, 3), dtype=np.float64)
+        self.offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.contacts = np.empty((contact_capacity, 2, 3), dtype=np.float64)
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int, keep: int) -> np.ndarray:
+        if array.shape[0] >= size:
+            return array
+        grown = np.empty((max(size, 2 * array.shape[0]),) + array.shape[1:], dtype=array.dtype)
+        grown[:keep] = array[:keep]
+        return grown
+
+    def reset(self, num_collisions: int) -> None:
+        """
+        Start a new frame.
+
+        :param num_collisions: The number of collisions in the frame.
+        """
+
+        self.num_collisions = 0
+        self.num_contacts = 0
+        self.ids = self._grow(self.ids, num_collisions, 0)
+        self.states = self._grow(self.states, num_collisions, 0)
+        if self.relative_velocities is not None:
+            self.relative_velocities = self._grow(self.relative_velocities, num_collisions, 0)
+        self.offsets = self._grow(self.offsets, num_collisions + 1, 0)
+        self.offsets[0] = 0
+
+    def add(self, num_contacts: int) -> Tuple[int, int]:
+        """
+        Add a collision. Fill in its row of `ids`, `states` and `relative_velocities`, and its contacts.
+
+        :param num_contacts: The number of contacts of the collision.
+
+        :return: Tuple: The collision's row, and the row of its first contact in `contacts`.
+        """
+
+        row = self.num_collisions
+        start = self.num_contacts
+        self.contacts = self._grow(self.contacts, start + num_contacts, start)
+        self.num_collisions += 1
+        self.num_contacts += num_contacts
+        self.offsets[row + 1] = self.num_contacts
+        return row, start
+
+    def get_arrays(self) -> CollisionArrays:
+        """
+        :return: Copies of the filled rows, which stay valid after the buffer is reused.
+        """
+
+        n = self.num_collisions
+        states = self.states[:n]
+        # Match the dtype of `np.array(states, dtype=str)`.
+        states = states.astype("<U%d" % (max(1, int(np.char.str_len(states).max())) if n > 0 else 1))
+        return CollisionArrays(ids=self.ids[:n].copy(),
+                               states=states,
+                               contacts=self.contacts[:self.num_contacts].copy(),
+                               offsets=self.offsets[:n + 1].copy(),
+                               relative_velocities=None if self.env else self.relative_velocities[:n].copy())
+
+
+class FrameResponse:
+    """
+    The response from the build for one frame, parsed once per output data type.
+
+    Each type of output data is parsed the first time it's requested and cached, so every per-frame consumer
+    (frame writers, labels, `is_done()`, `get_per_frame_commands()`) shares the same arrays.
+
+    For backwards compatibility this also behaves like the raw `resp` list (`len()`, iteration, indexing).
+    """
+
+    def __init__(self,
+                 resp: List[bytes],
+                 frame_num: Optional[int] = None,
+                 timer: Optional[StageTimer] = None,
+                 collision_buffer: Optional[CollisionBuffer] = None,
+                 env_collision_buffer: Optional[CollisionBuffer] = None):
+        """
+        :param resp: The raw response from `communicate()`.
+        :param frame_num: The frame number.
+        :param timer: If not None, parsing is timed as the "parse" stage.
+        :param collision_buffer: The buffer to parse `Collision` data into, reused across frames. If None, a new one is used.
+        :param env_collision_buffer: The buffer to parse `EnvironmentCollision` data into. If None, a new one is used.
+        """
+
+        self.resp = resp
+        self.frame_num = frame_num
+        self.timer = timer if timer is not None else _NO_TIMER
+        self.collision_buffer = collision_buffer
+        self.env_collision_buffer = env_collision_buffer
+
+        # Group the raw output data by type. The last element of the response is the frame count.
+        self._raw: Dict[str, List[bytes]] = OrderedDict()
+        with self.timer.time("parse"):
+            for r in resp[:-1]:
+                r_id = OutputData.get_data_type_id(r)
+                if r_id not in self._raw:
+                    self._raw[r_id] = []
+                self._raw[r_id].append(r)
+
+        self._parsed = dict()
+
+    def __len__(self) -> int:
+        return len(self.resp)
+
+    def __iter__(self):
+        return iter(self.resp)
+
+    def __getitem__(self, item):
+        return self.resp[item]
+
+    @property
+    def r_ids(self) -> List[str]:
+        """
+        :return: The output data type IDs in this response.
+        """
+
+        return list(self._raw.keys())
+
+    def has(self, r_id: str) -> bool:
+        """
+        :param r_id: An output data type ID, e.g. "tran".
+
+        :return: True if the response contains this type of output data.
+        """
+
+        return r_id in self._raw
+
+    def get_raw(self, r_id: str) -> List[bytes]:
+        """
+        :param r_id: An output data type ID, e.g. "flex".
+
+        :return: The raw output data of this type, for output data that isn't parsed here.
+        """
+
+        return self._raw.get(r_id, [])
+
+    def _cached(self, key: str, parse):
+        if key not in self._parsed:
+            with self.timer.time("parse"):
+                self._parsed[key] = parse()
+        return self._parsed[key]
+
+    @property
+    def transforms(self) -> ObjectArrays:
+        """
+        :return: `Transforms` data: "positions", "forwards", "rotations".
+        """
+
+        return self._cached("tran", self._parse_transforms)
+
+    @property
+    def rigidbodies(self) -> ObjectArrays:
+        """
+        :return: `Rigidbodies` data: "velocities", "angular_velocities", "sleeping".
+        """
+
+        return self._cached("rigi", self._parse_rigidbodies)
+
+    @property
+    def bounds(self) -> ObjectArrays:
+        """
+        :return: `Bounds` data, one array per bound type in `BOUND_TYPES`.
+        """
+
+        return self._cached("boun", self._parse_bounds)
+
+    @property
+    def collisions(self) -> CollisionArrays:
+        """
+        :return: Object-object `Collision` data.
+        """
+
+        return self._cached("coll", self._parse_collisions)
+
+    @property
+    def env_collisions(self) -> CollisionArrays:
+        """
+        :return: `EnvironmentCollision` data.
+        """
+
+        return self._cached("enco", self._parse_env_collisions)
+
+    @property
+    def images(self) -> Dict[str, Tuple[Images, int]]:
+        """
+        :return: A dictionary of pass mask: (the `Images` output data, the index of the pass).
+        """
+
+        return self._cached("imag", self._parse_images)
+
+    @property
+    def camera_matrices(self) -> Optional[Dict[str, np.ndarray]]:
+        """
+        :return: A dictionary with the "projection_matrix" and "camera_matrix", or None if there aren't any.
+        """
+
+        return self._cached("cama", self._parse_camera_matrices)
+
+    def get_image(self, pass_mask: str) -> Optional[np.ndarray]:
+        """
+        :param pass_mask: The pass, e.g. "_id".
+
+        :return: The encoded image bytes of this pass, or None if the pass isn't in the response.
+        """
+
+        if pass_mask not in self.images:
+            return None
+        im, i = self.images[pass_mask]
+        return im.get_image(i)
+
+    def get_image_data(self, pass_mask: str) -> Optional[np.ndarray]:
+        """
+        :param pass_mask: The pass, e.g. "_img".
+
+        :return: The image data as it is written to disk: the reshaped array for `_depth`, otherwise the encoded bytes.
+        """
+
+        if pass_mask not in self.images:
+            return None
+        im, i = self.images[pass_mask]
+        if pass_mask == "_depth":
+            return TDWUtils.get_shaped_depth_pass(images=im, index=i)
+        return im.get_image(i)
+
+    def get_image_extension(self, pass_mask: str) -> Optional[str]:
+        """
+        :param pass_mask: The pass, e.g. "_img".
+
+        :return: The file extension of this pass ("png" or "jpg").
+        """
+
+        if pass_mask not in self.images:
+            return None
+        im, i = self.images[pass_mask]
+        return im.get_extension(i)
+
+    def _parse_transforms(self) -> ObjectArrays:
+        chunks = []
+        for r in self.get_raw("tran"):
+            tr = Transforms(r)
+            structs = read_structs(tr, TRANSFORMS_DTYPE)
+            if structs is None:
+                structs = np.zeros(tr.get_num(), dtype=TRANSFORMS_DTYPE)
+                for i in range(tr.get_num()):
+                    structs[i] = (tr.get_id(i), tr.get_position(i), tr.get_rotation(i), tr.get_forward(i))
+            chunks.append(structs)
+        structs = _concatenate(chunks, TRANSFORMS_DTYPE)
+        return ObjectArrays(np.array(structs["id"], dtype=np.int32),
+                            positions=np.array(structs["positions"], dtype=np.float32),
+                            forwards=np.array(structs["forwards"], dtype=np.float32),
+                            rotations=np.array(structs["rotations"], dtype=np.float32))
+
+    def _parse_rigidbodies(self) -> ObjectArrays:
+        chunks = []
+        for r in self.get_raw("rigi"):
+            ri = Rigidbodies(r)
+            structs = read_structs(ri, RIGIDBODIES_DTYPE)
+            if structs is None:
+                structs = np.zeros(ri.get_num(), dtype=RIGIDBODIES_DTYPE)
+                for i in range(ri.get_num()):
+                    structs[i] = (ri.get_id(i), ri.get_velocity(i), ri.get_angular_velocity(i),
+                                  ri.get_sleeping(i), b"")
+            chunks.append(structs)
+        structs = _concatenate(chunks, RIGIDBODIES_DTYPE)
+        return ObjectArrays(np.array(structs["id"], dtype=np.int32),
+                            velocities=np.array(structs["velocities"], dtype=np.float32),
+                            angular_velocities=np.array(structs["angular_velocities"], dtype=np.float32),
+                            sleeping=np.array(structs["sleeping"], dtype=bool))
+
+    def _parse_bounds(self) -> ObjectArrays:
+        chunks = []
+        for r in self.get_raw("boun"):
+            bo = Bounds(r)
+            structs = read_structs(bo, BOUNDS_DTYPE)
+            if structs is None:
+                structs = np.zeros(bo.get_num(), dtype=BOUNDS_DTYPE)
+                for i in range(bo.get_num()):
+                    structs[i] = (bo.get_id(i), bo.get_front(i), bo.get_back(i), bo.get_right(i), bo.get_left(i),
+                                  bo.get_top(i), bo.get_bottom(i), bo.get_center(i))
+            chunks.append(structs)
+        structs = _concatenate(chunks, BOUNDS_DTYPE)
+        return ObjectArrays(np.array(structs["id"], dtype=np.int32),
+                            **{bound_type: np.array(structs[bound_type], dtype=np.float32)
+                               for bound_type in BOUND_TYPES})
+
+    def _parse_collisions(self) -> CollisionArrays:
+        raw = self.get_raw("coll")
+        buffer = self.collision_buffer if self.collision_buffer is not None else CollisionBuffer()
+        buffer.reset(len(raw))
+        for r in raw:
+            co = Collision(r)
+            num_contacts = co.get_num_contacts()
+            row, start = buffer.add(num_contacts)
+            buffer.ids[row] = (co.get_collider_id(), co.get_collidee_id())
+            buffer.states[row] = co.get_state()
+            buffer.relative_velocities[row] = co.get_relative_velocity()
+            for i in range(num_contacts):
+                buffer.contacts[start + i, 0] = co.get_contact_normal(i)
+                buffer.contacts[start + i, 1] = co.get_contact_point(i)
+        return buffer.get_arrays()
+
+    def _parse_env_collisions(self) -> CollisionArrays:
+        raw = self.get_raw("enco")
+        buffer = self.env_collision_buffer if self.env_collision_buffer is not None else CollisionBuffer(env=True)
+        buffer.reset(len(raw))
+        for r in raw:
+            en = EnvironmentCollision(r)
+            num_contacts = en.get_num_contacts()
+            row, start = buffer.add(num_contacts)
+            buffer.ids[row] = en.get_object_id()
+            buffer.states[row] = en.get_state()
+            for i in range(num_contacts):
+                buffer.contacts[start + i, 0] = en.get_contact_normal(i)
+                buffer.contacts[start + i, 1] = en.get_contact_point(i)
+        return buffer.get_arrays()
+
+    def _parse_images(self) -> Dict[str, Tuple[Images, int]]:
+        images = OrderedDict()
+        for r in self.get_raw("imag"):
+            im = Images(r)
+            for i in range(im.get_num_passes()):
+                images[im.get_pass_mask(i)] = (im, i)
+        return images
+
+    def _parse_camera_matrices(self) -> Optional[Dict[str, np.ndarray]]:
+        matrices = None
+        for r in self.get_raw("cama"):
+            cama = CameraMatrices(r)
+            matrices = {"projection_matrix": cama.get_projection_matrix(),
+                        "camera_matrix": cama.get_camera_matrix()}
+        return matrices
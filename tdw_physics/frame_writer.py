@@ -0,0 +1,140 @@
+import copy
+import queue
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+import h5py
+import numpy as np
+
+
+class FrameWriterError(Exception):
+    """
+    Raised in the frame loop when the background writer failed to write a frame.
+    """
+
+    pass
+
+
+class BufferedGroup:
+    """
+    An in-memory stand-in for an `h5py.Group`.
+
+    `_write_frame()` and `_write_frame_labels()` only call `create_group()` and `create_dataset()`,
+    so they can fill a `BufferedGroup` on the frame loop's thread; `flush()` later replays it onto a real hdf5 group.
+    """
+
+    def __init__(self, name: str = ""):
+        """
+        :param name: The name of the group.
+        """
+
+        self.name = name
+        # name: BufferedGroup or (data, create_dataset kwargs)
+        self._items = OrderedDict()
+
+    def create_group(self, name: str) -> "BufferedGroup":
+        group = BufferedGroup(name)
+        self._items[name] = group
+        return group
+
+    def create_dataset(self, name: str, data=None, **kwargs) -> None:
+        # Controllers may keep mutating their arrays after writing them (e.g. `target_delta_position += ...`),
+        # so copy anything writeable. Read-only views into the build's response bytes can't change.
+        if isinstance(data, np.ndarray):
+            if data.flags.writeable:
+                data = data.copy()
+        else:
+            data = copy.deepcopy(data)
+        self._items[name] = (data, kwargs)
+
+    def __getitem__(self, name: str) -> Union["BufferedGroup", np.ndarray]:
+        item = self._items[name]
+        return item if isinstance(item, BufferedGroup) else item[0]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._items
+
+    def keys(self):
+        return self._items.keys()
+
+    def flush(self, group: h5py.Group) -> None:
+        """
+        Write the buffered groups and datasets into an hdf5 group.
+
+        :param group: The hdf5 group that corresponds to this buffer.
+        """
+
+        for name, item in self._items.items():
+            if isinstance(item, BufferedGroup):
+                item.flush(group.create_group(name))
+            else:
+                data, kwargs = item
+                group.create_dataset(name, data=data, **kwargs)
+
+
+class FrameWriter:
+    """
+    Owns the trial's hdf5 `frames` group and writes buffered frames to it on a background thread,
+    so that compression and disk I/O overlap with the build rendering the next frame.
+
+    The queue is bounded: if the writer falls behind, `put()` blocks the frame loop (back-pressure).
+    If a write fails, the next `put()` or `close()` raises a `FrameWriterError`.
+    """
+
+    def __init__(self, frames_grp: h5py.Group, max_queue_size: int = 8):
+        """
+        :param frames_grp: The hdf5 group that frames are written to.
+        :param max_queue_size: The maximum number of frames waiting to be written.
+        """
+
+        self.frames_grp = frames_grp
+        self._queue = queue.Queue(maxsize=max(1, max_queue_size))
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="FrameWriter", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            frames = self._queue.get()
+            if frames is None:
+                return
+            # Keep draining the queue after a failure so that the frame loop never blocks on a dead writer.
+            if self._error is not None:
+                continue
+            try:
+                frames.flush(self.frames_grp)
+            except BaseException as e:
+                self._error = e
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise FrameWriterError("Failed to write frame data: %s" % repr(self._error)) from self._error
+
+    def put(self, frames: BufferedGroup) -> None:
+        """
+        Queue buffered frame data to be written.
+
+        :param frames: A buffer standing in for the `frames` group.
+        """
+
+        self._raise_if_failed()
+        self._queue.put(frames)
+
+    def close(self) -> None:
+        """
+        Wait for every queued frame to be written.
+        """
+
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_if_failed()
+
+    def abort(self) -> None:
+        """
+        Stop the writer without raising; used when the trial is aborted.
+        """
+
+        if self._thread.is_alive():
+            self._error = self._error or FrameWriterError("Trial aborted")
+            self._queue.put(None)
+            self._thread.join()
@@ -0,0 +1,75 @@
+import io
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+
+
+def decode_image(data: np.ndarray) -> np.ndarray:
+    """
+    :param data: The encoded bytes of a PNG or JPG pass.
+
+    :return: The decoded image, shape `(height, width, channels)`.
+    """
+
+    return np.array(Image.open(io.BytesIO(np.array(data))))
+
+
+class DecodedImageCache:
+    """
+    Decoded images of the frames of a trial, keyed by (frame, pass), so that a pass is PNG-decoded at most once
+    however many times it's read (`_is_object_in_view()`, `_max_optical_flow()`, the `_map.png` overlay, labels).
+
+    Images are decoded lazily on the first `get()`, and evicted once their frame is written to disk.
+    Cached images are read-only, because every reader shares the same array.
+    """
+
+    def __init__(self):
+        self._images: Dict[Tuple[int, str], np.ndarray] = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, frame: Optional[int], pass_mask: str, data: Callable[[], np.ndarray]) -> Optional[np.ndarray]:
+        """
+        :param frame: The frame number. If None, the image is decoded but not cached.
+        :param pass_mask: The pass, e.g. "_id".
+        :param data: A function that returns the encoded bytes of the pass (or None), called only if the image isn't cached.
+
+        :return: The decoded image, or None if there's no data.
+        """
+
+        key = (frame, pass_mask)
+        image = self._images.get(key)
+        if image is not None:
+            self.hits += 1
+            return image
+        encoded = data()
+        if encoded is None:
+            return None
+        self.misses += 1
+        image = decode_image(encoded)
+        image.setflags(write=False)
+        if frame is not None:
+            self._images[key] = image
+        return image
+
+    def evict(self, frame: int, keep: Optional[List[str]] = None) -> None:
+        """
+        Evict the images of a frame.
+
+        :param frame: The frame number.
+        :param keep: Passes of this frame to keep until `clear()`, e.g. the frame 0 `_id` pass that the `_map.png` overlay reads at the end of the trial.
+        """
+
+        for key in [k for k in self._images.keys() if k[0] == frame]:
+            if keep is None or key[1] not in keep:
+                del self._images[key]
+
+    def clear(self) -> None:
+        """
+        Evict every image.
+        """
+
+        self._images.clear()
+
+    def __len__(self) -> int:
+        return len(self._images)
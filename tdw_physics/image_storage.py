@@ -0,0 +1,125 @@
+import json
+from typing import Dict, Optional, Tuple, Union
+import numpy as np
+
+# Passes that the build sends as raw RGB arrays instead of encoded PNG or JPG bytes.
+DEPTH_PASSES = ["_depth", "_depth_simple"]
+
+# How an encoded pass can be stored. It's already entropy-coded, so gzip only costs time.
+ENCODED_STORAGES = ["raw", "gzip"]
+# How a depth pass can be stored. "uint16" and "float16" are lossy; see `encode_pass()`.
+DEPTH_STORAGES = ["raw", "gzip", "lzf", "uint16", "float16"]
+
+# Passes that aren't listed in a storage policy are stored like this.
+DEFAULT_STORAGE = {"_depth": "gzip", "_depth_simple": "gzip"}
+
+
+def get_storage_policy(image_storage: Union[str, Dict[str, str], None] = None) -> Dict[str, str]:
+    """
+    :param image_storage: A storage per pass, either as a dictionary or as a comma-separated string, e.g. `"_depth:uint16,_img:gzip"`. If None, use the default storage of each pass.
+
+    :return: The storage of every pass that doesn't use the default ("raw" for encoded passes, `DEFAULT_STORAGE` for depth passes).
+    """
+
+    policy = dict(DEFAULT_STORAGE)
+    if image_storage is None:
+        return policy
+    if isinstance(image_storage, str):
+        image_storage = dict(s.split(":") for s in image_storage.split(",") if len(s) > 0)
+    for pass_mask, storage in image_storage.items():
+        storages = DEPTH_STORAGES if pass_mask in DEPTH_PASSES else ENCODED_STORAGES
+        if storage not in storages:
+            raise ValueError("Can't store %s as %s; expected one of %s" % (pass_mask, storage, storages))
+        policy[pass_mask] = storage
+    return policy
+
+
+def get_pass_storage(policy: Dict[str, str], pass_mask: str) -> str:
+    """
+    :param policy: The storage policy from `get_storage_policy()`.
+    :param pass_mask: The pass, e.g. "_img".
+
+    :return: How the pass is stored.
+    """
+
+    return policy.get(pass_mask, "raw")
+
+
+def encode_pass(pass_mask: str, data: np.ndarray, storage: str) -> Tuple[np.ndarray, dict]:
+    """
+    Prepare image data to be written to an hdf5 file.
+
+    - "raw": the data as-is, without a filter.
+    - "gzip" and "lzf": the data as-is, with that compression filter.
+    - "uint16": the top 16 of the 24 bits of the depth (the red and green channels), shape `(height, width)`.
+    - "float16": the normalized depth `r + g / 256 + b / 65536` as a half float, shape `(height, width)`.
+
+    :param pass_mask: The pass, e.g. "_img".
+    :param data: The image data from `FrameResponse.get_image_data()`.
+    :param storage: How to store the pass.
+
+    :return: Tuple: The data to write, and the keyword arguments of `create_dataset()`.
+    """
+
+    if storage == "raw":
+        return data, dict()
+    elif storage in ["gzip", "lzf"]:
+        return data, {"compression": storage}
+    elif storage == "uint16":
+        data = data.astype(np.uint16)
+        return (data[..., 0] << 8) | data[..., 1], dict()
+    elif storage == "float16":
+        data = data.astype(np.float32)
+        return (data[..., 0] + data[..., 1] / 256. + data[..., 2] / 65536.).astype(np.float16), dict()
+    raise ValueError("Unknown storage %s of %s" % (storage, pass_mask))
+
+
+def decode_pass(data: np.ndarray, storage: str) -> np.ndarray:
+    """
+    Undo `encode_pass()`. Quantized depth passes are returned as `(height, width, 3)` RGB arrays, like raw ones.
+
+    :param data: The data read from the hdf5 file.
+    :param storage: How the pass is stored.
+
+    :return: The image data.
+    """
+
+    data = np.asarray(data)
+    if storage == "uint16":
+        rgb = np.zeros(data.shape + (3,), dtype=np.uint8)
+        rgb[..., 0] = data >> 8
+        rgb[..., 1] = data & 0xff
+        return rgb
+    elif storage == "float16":
+        depth = data.astype(np.float64)
+        depth24 = np.clip(np.round(depth * 65536.), 0, (1 << 24) - 1).astype(np.uint32)
+        return np.stack([depth24 >> 16, (depth24 >> 8) & 0xff, depth24 & 0xff], axis=-1).astype(np.uint8)
+    return data
+
+
+def read_storage_policy(f) -> Dict[str, str]:
+    """
+    :param f: A trial file.
+
+    :return: The storage policy the trial's images were written with. Files written before there was a policy used gzip for every pass.
+    """
+
+    policy = f["static"].attrs.get("image_storage")
+    if policy is None:
+        return dict()
+    return json.loads(policy)
+
+
+def read_pass(f, data: np.ndarray, pass_mask: str, policy: Optional[Dict[str, str]] = None) -> np.ndarray:
+    """
+    :param f: A trial file.
+    :param data: The data of a pass of a frame, e.g. `f['frames']['0000']['images']['_depth'][:]`.
+    :param pass_mask: The pass.
+    :param policy: The trial's storage policy, if it was already read with `read_storage_policy()`.
+
+    :return: The image data, as it was before it was written.
+    """
+
+    if policy is None:
+        policy = read_storage_policy(f)
+    return decode_pass(data, policy.get(pass_mask, "raw"))
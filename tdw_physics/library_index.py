@@ -0,0 +1,192 @@
+import os
+import json
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Mapping, Optional
+import tdw.librarian
+from tdw.librarian import ModelLibrarian, MaterialLibrarian, SceneLibrarian
+
+# The index is cached in this directory, unless the TDW_PHYSICS_CACHE environment variable is set.
+DEFAULT_CACHE_DIR = Path.home().joinpath(".cache", "tdw_physics")
+# Bump this if the contents of the index change.
+INDEX_VERSION = 1
+
+
+def get_library_path(filename: str) -> Path:
+    """
+    :param filename: The filename of a library in the tdw module, e.g. "models_full.json".
+
+    :return: The path to the library, as the librarians resolve it.
+    """
+
+    return Path(tdw.librarian.__file__).parent.joinpath("metadata_libraries", filename)
+
+
+def _get_fingerprint(filenames: List[str]) -> Dict[str, list]:
+    fingerprint = dict()
+    for filename in filenames:
+        path = get_library_path(filename)
+        st = path.stat()
+        fingerprint[filename] = [str(path), st.st_mtime_ns, st.st_size]
+    return fingerprint
+
+
+def _read_records(filename: str) -> List[dict]:
+    with open(str(get_library_path(filename)), "rt") as f:
+        return list(json.load(f)["records"].values())
+
+
+class LibraryIndex:
+    """
+    A compact index of the model, material and scene libraries: the names, categories and flags of the models, the
+    materials of each type and the names of the scenes.
+
+    The index is built from the library .json files without creating any records, and cached on disk
+    (`library_index.json`). It's rebuilt when the modification time or size of a library file changes.
+    Records are only loaded (by a librarian) when they're asked for, e.g. with `get_model_record()`.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        :param cache_dir: The directory of the cached index. If None, `$TDW_PHYSICS_CACHE` or `~/.cache/tdw_physics`.
+        """
+
+        if cache_dir is None:
+            cache_dir = os.environ.get("TDW_PHYSICS_CACHE", str(DEFAULT_CACHE_DIR))
+        self.path = Path(cache_dir).joinpath("library_index.json")
+        self.filenames = ModelLibrarian.get_library_filenames() + \
+                         [MaterialLibrarian.get_library_filenames()[0], SceneLibrarian.get_library_filenames()[0]]
+        self._index: Optional[dict] = None
+
+    def _load(self) -> dict:
+        if self._index is not None:
+            return self._index
+        fingerprint = _get_fingerprint(self.filenames)
+        if self.path.exists():
+            try:
+                index = json.loads(self.path.read_text())
+                if index.get("version") == INDEX_VERSION and index.get("fingerprint") == fingerprint:
+                    self._index = index
+                    return index
+            except (OSError, ValueError):
+                pass
+        self._index = self._build(fingerprint)
+        self._write(self._index)
+        return self._index
+
+    def _build(self, fingerprint: Dict[str, list]) -> dict:
+        models = dict()
+        for filename in ModelLibrarian.get_library_filenames():
+            records = _read_records(filename)
+            models[filename] = {"names": [r["name"] for r in records],
+                                "unusable": [r["name"] for r in records if r.get("do_not_use", False)],
+                                "flex": [r["name"] for r in records if r.get("flex", False)],
+                                "categories": {r["name"]: r.get("wcategory", "") for r in records}}
+        materials = dict()
+        for r in _read_records(MaterialLibrarian.get_library_filenames()[0]):
+            materials.setdefault(r["type"], []).append(r["name"])
+        scenes = [r["name"] for r in _read_records(SceneLibrarian.get_library_filenames()[0])]
+        return {"version": INDEX_VERSION,
+                "fingerprint": fingerprint,
+                "models": models,
+                "materials": {mtype: materials[mtype] for mtype in sorted(materials.keys())},
+                "scenes": scenes}
+
+    def _write(self, index: dict) -> None:
+        # Write to a temp file and rename it, so that other processes never read a partial index.
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp = self.path.with_name(self.path.name + ".%d.tmp" % os.getpid())
+            temp.write_text(json.dumps(index))
+            os.replace(str(temp), str(self.path))
+        except OSError as e:
+            print("Couldn't cache the library index at %s: %s" % (self.path, e))
+
+    def get_model_names(self, library: str, usable: bool = False) -> List[str]:
+        """
+        :param library: The filename of a model library, e.g. "models_full.json".
+        :param usable: If True, leave out the models that are marked `do_not_use`.
+
+        :return: The names of the models in the library, in the library's order.
+        """
+
+        lib = self._load()["models"][library]
+        if not usable:
+            return list(lib["names"])
+        unusable = set(lib["unusable"])
+        return [name for name in lib["names"] if name not in unusable]
+
+    def get_flex_model_names(self, library: str) -> List[str]:
+        """
+        :return: The names of the models in the library that have Flex enabled.
+        """
+
+        return list(self._load()["models"][library]["flex"])
+
+    def get_model_categories(self, library: str = "models_full.json") -> Dict[str, str]:
+        """
+        :return: The `wcategory` of each model in the library.
+        """
+
+        return dict(self._load()["models"][library]["categories"])
+
+    def get_model_library(self, name: str) -> Optional[str]:
+        """
+        :param name: The name of a model.
+
+        :return: The first library (in `ModelLibrarian.get_library_filenames()` order) that has the model, or None.
+        """
+
+        for library, lib in self._load()["models"].items():
+            if name in lib["categories"]:
+                return library
+        return None
+
+    def get_material_names(self) -> Dict[str, List[str]]:
+        """
+        :return: The names of the materials of each type, with the types sorted alphabetically.
+        """
+
+        return {mtype: list(names) for mtype, names in self._load()["materials"].items()}
+
+    def get_scene_names(self) -> List[str]:
+        """
+        :return: The names of the scenes.
+        """
+
+        return list(self._load()["scenes"])
+
+
+class LazyDict(Mapping):
+    """
+    A read-only dictionary whose keys are known up front and whose values are created on first access.
+    """
+
+    def __init__(self, keys: List[str], factory: Callable[[str], object]):
+        """
+        :param keys: The keys.
+        :param factory: Creates the value of a key.
+        """
+
+        self._keys = list(keys)
+        self._factory = factory
+        self._values: Dict[str, object] = dict()
+
+    def __getitem__(self, key: str):
+        if key not in self._values:
+            if key not in self._keys:
+                raise KeyError(key)
+            self._values[key] = self._factory(key)
+        return self._values[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return "%s(%s)" % (self.__class__.__name__, self._keys)
+
+
+# The index shared by every module.
+LIBRARY_INDEX = LibraryIndex()
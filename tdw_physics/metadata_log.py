@@ -0,0 +1,172 @@
+import os
+import json
+from pathlib import Path
+from collections import OrderedDict
+from typing import List, Optional, Union
+
+# How far back from the end of the log `read_tail()` reads at a time.
+TAIL_BLOCK_SIZE = 1 << 16
+
+
+class MetadataLog:
+    """
+    An append-only JSON-lines log of the trial-level metadata (`metadata.jsonl`, next to `metadata.json`).
+
+    Each trial appends one line, `{"trial": <trial number>, "meta": <labels>}`, which is flushed and fsync'd,
+    so a crash can only ever lose the line being written. A trial whose files were deleted after it was logged is
+    dropped with a tombstone, `{"trial": <trial number>, "meta": null}`; see `remove()`. `consolidate()` writes the legacy `metadata.json`
+    (a list of the labels of each trial, in trial order) from the log once, at the end of a run.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        :param path: The path to the log.
+        """
+
+        self.path = Path(path)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def append(self, meta: dict, trial_num: Optional[int] = None) -> None:
+        """
+        Append a trial's metadata to the log.
+
+        :param meta: The trial's labels.
+        :param trial_num: The number of the trial. None for metadata from a legacy `metadata.json`.
+        """
+
+        self.extend([meta], [trial_num])
+
+    def remove(self, trial_num: int) -> None:
+        """
+        Append a tombstone for a trial, so that `consolidate()` leaves out its earlier records (e.g. a trial that was rejected and deleted).
+
+        :param trial_num: The number of the trial.
+        """
+
+        self.extend([None], [trial_num])
+
+    def extend(self, metas: List[dict], trial_nums: List[Optional[int]]) -> None:
+        """
+        Append the metadata of several trials to the log, with a single fsync.
+
+        :param metas: The labels of each trial.
+        :param trial_nums: The number of each trial.
+        """
+
+        lines = "".join(json.dumps({"trial": t, "meta": m}) + "\n" for m, t in zip(metas, trial_nums))
+        with open(str(self.path), "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def repair(self) -> None:
+        """
+        Truncate a partial last line, left behind if the process died while appending.
+        Only the end of the log is read.
+        """
+
+        if not self.path.exists():
+            return
+        with open(str(self.path), "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # Find the end of the last complete line.
+            end = size
+            while end > 0:
+                start = max(0, end - TAIL_BLOCK_SIZE)
+                f.seek(start)
+                block = f.read(end - start)
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    return
+                end = start
+            f.truncate(0)
+
+    def read_tail(self, n: int = 1) -> List[dict]:
+        """
+        :param n: The number of records to read.
+
+        :return: The last `n` records of the log, `{"trial": ..., "meta": ...}`, without reading the whole log.
+        """
+
+        if not self.path.exists() or n <= 0:
+            return []
+        with open(str(self.path), "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            data = b""
+            start = end
+            while start > 0 and data.count(b"\n") <= n:
+                start = max(0, start - TAIL_BLOCK_SIZE)
+                f.seek(start)
+                data = f.read(end - start)
+        # The last line is empty, or partial if the process died while appending it.
+        lines = data.split(b"\n")[:-1]
+        # The first line might be cut off, unless the whole log was read.
+        if start > 0:
+            lines = lines[1:]
+        return [json.loads(line) for line in lines[-n:] if len(line) > 0]
+
+    def read(self) -> List[dict]:
+        """
+        :return: Every record of the log, in the order they were appended. A partial last line is ignored.
+        """
+
+        records = []
+        if not self.path.exists():
+            return records
+        with open(str(self.path), "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                records.append(json.loads(line))
+        return records
+
+    def merge(self, paths: List[Path]) -> None:
+        """
+        Append the records of other logs (e.g. the per-worker logs of a `TrialScheduler`) to this one, then delete them.
+
+        :param paths: The paths to the other logs.
+        """
+
+        for path in paths:
+            other = MetadataLog(path)
+            records = other.read()
+            if len(records) > 0:
+                self.extend([r["meta"] for r in records], [r["trial"] for r in records])
+            path.unlink()
+
+    def consolidate(self, meta_file: Union[str, Path]) -> List[dict]:
+        """
+        Write the legacy `metadata.json`: the labels of every trial in trial order.
+        If a trial was logged more than once (e.g. it was re-run after a crash), its last record is used.
+        Trials whose last record is a tombstone are left out.
+        The file is written to a temporary path first and then moved, so it's never half-written.
+
+        :param meta_file: The path to `metadata.json`.
+
+        :return: The metadata that was written.
+        """
+
+        legacy = []
+        trials = OrderedDict()
+        for record in self.read():
+            if record["trial"] is None:
+                legacy.append(record["meta"])
+            elif record["meta"] is None:
+                trials.pop(record["trial"], None)
+            else:
+                trials[record["trial"]] = record["meta"]
+        metadata = legacy + [trials[t] for t in sorted(trials)]
+
+        meta_file = Path(meta_file)
+        temp_file = meta_file.parent.joinpath(meta_file.name + ".tmp")
+        temp_file.write_text(json.dumps(metadata, indent=4), encoding="utf-8")
+        os.replace(str(temp_file), str(meta_file))
+        return metadata
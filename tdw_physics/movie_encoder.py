@@ -0,0 +1,147 @@
+import os
+import subprocess
+import tempfile
+from collections import deque
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+from tdw_physics.postprocessing.stimuli import default_ffmpeg_args
+
+# The ffmpeg decoder of each image extension.
+IMAGE_CODECS = {"png": "png", "jpg": "mjpeg", "jpeg": "mjpeg"}
+
+
+class MP4Encoder:
+    """
+    Encode one pass of a trial to an MP4 while the trial runs, by piping each frame's encoded image (PNG or JPG bytes)
+    to ffmpeg's stdin (`-f image2pipe`), instead of writing a PNG per frame and converting the directory afterwards.
+
+    ffmpeg is started on the first frame and writes to a temporary file next to the MP4. `close()` waits for it to
+    finish and only then renames the file to the MP4, so a partial MP4 is never left at `filename`.
+    The bytes of one frame (`save_frame`) are kept, so that it can be saved as a still image.
+    """
+
+    def __init__(self, filename: Union[str, Path], framerate: int = 30, executable: str = 'ffmpeg',
+                 ffmpeg_args: List[str] = None, save_frame: Optional[int] = None):
+        """
+        :param filename: The path to the MP4.
+        :param framerate: The framerate of the MP4.
+        :param executable: The ffmpeg executable.
+        :param ffmpeg_args: Output options, e.g. the codec. Defaults to the same options as `pngs_to_mp4()`.
+        :param save_frame: If not None, keep the bytes of this frame (negative numbers count from the last frame).
+        """
+
+        self.filename = str(filename)
+        if not self.filename.endswith('.mp4'):
+            self.filename += '.mp4'
+        self.temp_filename = self.filename + '.tmp'
+        self.framerate = framerate
+        self.executable = executable
+        self.ffmpeg_args = default_ffmpeg_args if ffmpeg_args is None else ffmpeg_args
+        self.save_frame = save_frame
+        self.cmd: List[str] = []
+        self.num_frames = 0
+        self.extension: Optional[str] = None
+        self._process: Optional[subprocess.Popen] = None
+        self._stderr = None
+        self._failed = False
+        self._still: Optional[bytes] = None
+        self._last = deque(maxlen=-save_frame) if save_frame is not None and save_frame < 0 else None
+
+    def _start(self, extension: str) -> None:
+        self.extension = extension
+        self.cmd = [self.executable, '-y', '-loglevel', 'error',
+                    '-r', str(self.framerate),
+                    '-f', 'image2pipe']
+        if extension in IMAGE_CODECS:
+            self.cmd += ['-vcodec', IMAGE_CODECS[extension]]
+        # The format is given explicitly because the temporary file doesn't end with .mp4.
+        self.cmd += ['-i', '-'] + self.ffmpeg_args + ['-f', 'mp4', self.temp_filename]
+        # ffmpeg's log goes to a file, so that a full stderr pipe can't block it.
+        self._stderr = tempfile.TemporaryFile()
+        try:
+            self._process = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                             stderr=self._stderr)
+        except OSError as e:
+            print("Couldn't start %s: %s" % (self.executable, e))
+            self._failed = True
+
+    def write(self, data: bytes, extension: str = "png") -> None:
+        """
+        :param data: The encoded image of the next frame.
+        :param extension: The image format, e.g. "png" or "jpg".
+        """
+
+        if self.save_frame is not None:
+            if self._last is not None:
+                self._last.append(data)
+            elif self.num_frames == self.save_frame:
+                self._still = bytes(data)
+        self.num_frames += 1
+        if self._process is None and not self._failed:
+            self._start(extension)
+        if self._failed:
+            return
+        try:
+            self._process.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            # ffmpeg exited; close() reports why.
+            self._failed = True
+
+    def close(self) -> Tuple[List[str], bytes, bytes]:
+        """
+        Finish the MP4. If there were no frames, no MP4 is written.
+
+        :return: The ffmpeg command, stdout and stderr, like `pngs_to_mp4()`. Raises a `RuntimeError` if ffmpeg couldn't be started or failed; then there's no MP4.
+        """
+
+        if self._last is not None and len(self._last) == self._last.maxlen:
+            self._still = bytes(self._last[0])
+        if self._failed and self._process is None:
+            raise RuntimeError("Couldn't start %s to write %s" % (self.executable, self.filename))
+        stderr = b''
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            self._process.wait()
+            self._stderr.seek(0)
+            stderr = self._stderr.read()
+            self._stderr.close()
+            returncode = self._process.returncode
+            self._process = None
+            if returncode != 0 or self._failed:
+                if os.path.exists(self.temp_filename):
+                    os.remove(self.temp_filename)
+                raise RuntimeError("%s failed to write %s: %s" %
+                                   (self.executable, self.filename, stderr.decode(errors="replace")))
+            os.replace(self.temp_filename, self.filename)
+        return self.cmd, b'', stderr
+
+    def abort(self) -> None:
+        """
+        Stop ffmpeg and delete the partial file, e.g. if the trial failed.
+        """
+
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._stderr.close()
+            self._process = None
+        if os.path.exists(self.temp_filename):
+            os.remove(self.temp_filename)
+
+    def save_still(self, path: Union[str, Path]) -> Optional[Path]:
+        """
+        Save the `save_frame` frame as an image.
+
+        :param path: The path to the image, without its extension.
+
+        :return: The path to the image, or None if there's no such frame.
+        """
+
+        if self._still is None:
+            return None
+        path = Path(str(path) + "." + (self.extension if self.extension is not None else "png"))
+        path.write_bytes(self._still)
+        return path
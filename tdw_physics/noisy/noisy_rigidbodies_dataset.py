@@ -3,7 +3,7 @@ import numpy as np
 import random
 from tdw.librarian import ModelRecord
 from tdw_physics.rigidbodies_dataset import RigidbodiesDataset
-from tdw.output_data import OutputData, Rigidbodies, Collision, EnvironmentCollision
+from tdw_physics.frame_response import FrameResponse
 from dataclasses import dataclass
 from typing import List, Tuple, Dict, Optional
 import copy
@@ -177,7 +177,7 @@ class NoisyRigidbodiesDataset(RigidbodiesDataset, ABC):
             bounciness, o_id, add_data
         )
 
-    def get_per_frame_commands(self, resp: List[bytes], frame: int) -> List[dict]:
+    def get_per_frame_commands(self, resp: FrameResponse, frame: int) -> List[dict]:
         """
         Overwrites abstract method to add collision noise commands
 
@@ -197,16 +197,8 @@ class NoisyRigidbodiesDataset(RigidbodiesDataset, ABC):
                     pid = max(cd['agent_id'], cd['patient_id'])
                     nm_ap = str(aid) + '_' + str(pid)
 
-                    """ This seems inefficient... """
-                    for r in resp[:-1]:
-                        r_id = OutputData.get_data_type_id(r)
-                        if r_id == "rigi":
-                            ri = Rigidbodies(r)
-                            for i in range(ri.get_num()):
-                                if ri.get_id(i) == aid:
-                                    va = ri.get_velocity(i)
-                                elif ri.get_id(i) == pid:
-                                    vp = ri.get_velocity(i)
+                    va = resp.rigidbodies.get(aid, "velocities")
+                    vp = resp.rigidbodies.get(pid, "velocities")
 
                     if cd['state'] == 'enter':
                         print('start rvel: ' + nm_ap + ' : '
@@ -313,37 +305,33 @@ class NoisyRigidbodiesDataset(RigidbodiesDataset, ABC):
 
         return commands
 
-    def _get_collision_data(self, resp: List[bytes]):
+    def _get_collision_data(self, resp: FrameResponse):
         coll_data = []
-        r_ids = [OutputData.get_data_type_id(r) for r in resp[:-1]]
-        for i, r_id in enumerate(r_ids):
-            if r_id == 'coll':
-                co = Collision(resp[i])
-                state = co.get_state()
-                agent_id = co.get_collider_id()
-                patient_id = co.get_collidee_id()
-                relative_velocity = co.get_relative_velocity()
-                num_contacts = co.get_num_contacts()
-                contact_points = [co.get_contact_point(i)
-                                  for i in range(num_contacts)]
-                contact_normals = [co.get_contact_normal(i)
-                                   for i in range(num_contacts)]
-
-                coll_data.append({
-                    'agent_id': agent_id,
-                    'patient_id': patient_id,
-                    'relative_velocity': relative_velocity,
-                    'num_contacts': num_contacts,
-                    'contact_points': contact_points,
-                    'contact_normals': contact_normals,
-                    'state': state
-                })
-                #if self.PRINT:
-                if False:
-                    print("agent: %d ---> patient %d" % (agent_id, patient_id))
-                    print("relative velocity", relative_velocity)
-                    print("contact points", contact_points)
-                    print("contact normals", contact_normals)
-                    print("state", state)
+        co = resp.collisions
+        for i in range(len(co)):
+            state = str(co.states[i])
+            agent_id, patient_id = [int(o_id) for o_id in co.ids[i]]
+            relative_velocity = co.relative_velocities[i]
+            contacts = co.get_contacts(i)
+            num_contacts = len(contacts)
+            contact_points = list(contacts[:, 1])
+            contact_normals = list(contacts[:, 0])
+
+            coll_data.append({
+                'agent_id': agent_id,
+                'patient_id': patient_id,
+                'relative_velocity': relative_velocity,
+                'num_contacts': num_contacts,
+                'contact_points': contact_points,
+                'contact_normals': contact_normals,
+                'state': state
+            })
+            #if self.PRINT:
+            if False:
+                print("agent: %d ---> patient %d" % (agent_id, patient_id))
+                print("relative velocity", relative_velocity)
+                print("contact points", contact_points)
+                print("contact normals", contact_normals)
+                print("state", state)
 
         return coll_data
@@ -0,0 +1,220 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+import h5py
+import numpy as np
+from tdw_physics.metadata_log import MetadataLog
+
+
+def parse_balance(balance: str) -> Tuple[str, float]:
+    """
+    :param balance: The label to balance and, optionally, the fraction of trials for which it should be true, e.g. "does_target_contact_zone" or "does_target_contact_zone:0.5".
+
+    :return: Tuple: The label and the fraction.
+    """
+
+    label, _, ratio = balance.partition(":")
+    ratio = float(ratio) if len(ratio) > 0 else 0.5
+    if not 0 <= ratio <= 1:
+        raise ValueError("Can't balance %s to a fraction of %s" % (label, ratio))
+    return label, ratio
+
+
+class OutcomeSampler:
+    """
+    Choose the scenario parameters of each trial so that a run ends up with a given fraction of positive outcomes
+    (e.g. `does_target_contact_zone` true for half the trials), instead of generating extra trials and filtering them.
+
+    Each parameter range (e.g. `force_scale_range` of `Dominoes`, see `get_balance_ranges()`) is split into bins.
+    Per stratum (e.g. room and probe type), the sampler counts the outcomes of the trials that were run with a value
+    from each bin. Before a trial, it picks the class that's furthest below its quota and, for each parameter, the bin
+    most likely to give that class (Thompson sampling, with the strata weighted by how under-represented the class
+    is in them), and draws a value from that bin.
+
+    After a trial, `observe()` accepts it if its class is still below quota; otherwise the trial should be discarded
+    and run again. The run is done as soon as both quotas are met.
+    """
+
+    def __init__(self, label: str, num: int, ranges: Dict[str, Tuple[float, float]], ratio: float = 0.5,
+                 strata: List[str] = ["room", "probe_type"], num_bins: int = 4, seed: int = 0,
+                 max_attempts: Optional[int] = None):
+        """
+        :param label: The trial-level label of the outcome, e.g. "does_target_contact_zone".
+        :param num: The number of trials to accept.
+        :param ranges: The range of each parameter that the sampler chooses, e.g. `{"force_scale_range": (0, 8)}`.
+        :param ratio: The fraction of accepted trials whose outcome should be true.
+        :param strata: The labels (or static data) whose values split trials into strata, e.g. `["room", "probe_type"]`.
+        :param num_bins: The number of bins of each parameter range.
+        :param seed: The random seed of the sampler.
+        :param max_attempts: Stop after this many trials, even if the quotas aren't met. Defaults to 10 times `num`.
+        """
+
+        self.label = label
+        self.ranges = {name: (float(lo), float(hi)) for name, (lo, hi) in ranges.items()}
+        self.strata = strata
+        self.num_bins = num_bins
+        num_true = int(round(num * ratio))
+        self.quotas = {True: num_true, False: num - num_true}
+        self.ratios = {True: ratio, False: 1 - ratio}
+        self.max_attempts = 10 * num if max_attempts is None else max_attempts
+        self.rng = np.random.RandomState(seed)
+        self.attempts = 0
+        # The accepted trials of each class, per stratum.
+        self.counts: Dict[str, Dict[bool, int]] = dict()
+        # The outcomes of all trials (accepted or not) of each bin of each parameter, per stratum: [false, true]
+        self.outcomes: Dict[str, Dict[str, np.ndarray]] = dict()
+
+    def get_accepted(self, outcome: bool) -> int:
+        """
+        :return: The number of accepted trials with this outcome.
+        """
+
+        return sum(counts[outcome] for counts in self.counts.values())
+
+    def is_done(self) -> bool:
+        """
+        :return: True if both quotas are met.
+        """
+
+        return all(self.get_accepted(outcome) >= quota for outcome, quota in self.quotas.items())
+
+    def is_exhausted(self) -> bool:
+        """
+        :return: True if the quotas are met or there have been `max_attempts` trials.
+        """
+
+        return self.is_done() or self.attempts >= self.max_attempts
+
+    def get_target(self) -> bool:
+        """
+        :return: The class that the next trial should have: the one with the larger fraction of its quota left.
+        """
+
+        left = {outcome: (quota - self.get_accepted(outcome)) / max(quota, 1)
+                for outcome, quota in self.quotas.items()}
+        return left[True] >= left[False]
+
+    def _get_bin_range(self, name: str, b: int) -> Tuple[float, float]:
+        lo, hi = self.ranges[name]
+        step = (hi - lo) / self.num_bins
+        return lo + b * step, lo + (b + 1) * step
+
+    def sample(self) -> Tuple[Dict[str, int], Dict[str, float]]:
+        """
+        :return: Tuple: The bin of each parameter and the value of each parameter for the next trial.
+        """
+
+        target = self.get_target()
+        # Weight the strata by how often they come up and how far below the target ratio the class is in them.
+        weights = dict()
+        for stratum, counts in self.counts.items():
+            total = counts[True] + counts[False]
+            share = counts[target] / total if total > 0 else 0.
+            seen = sum(self.outcomes[stratum][name].sum() for name in self.ranges) / max(len(self.ranges), 1)
+            weights[stratum] = seen * (1 + max(0., self.ratios[target] - share))
+        bins = dict()
+        params = dict()
+        for name in self.ranges:
+            scores = np.zeros(self.num_bins)
+            for stratum, weight in weights.items():
+                outcomes = self.outcomes[stratum][name]
+                scores += weight * self.rng.beta(1 + outcomes[:, int(target)], 1 + outcomes[:, int(not target)])
+            if scores.sum() == 0:
+                bins[name] = int(self.rng.randint(self.num_bins))
+            else:
+                bins[name] = int(np.argmax(scores))
+            params[name] = float(self.rng.uniform(*self._get_bin_range(name, bins[name])))
+        return bins, params
+
+    def observe(self, outcome: bool, stratum: str, bins: Dict[str, int], accepted: Optional[bool] = None) -> bool:
+        """
+        Count the outcome of a trial.
+
+        :param outcome: The trial's outcome.
+        :param stratum: The trial's stratum; see `get_stratum()`.
+        :param bins: The bin of each parameter of the trial, from `sample()`.
+        :param accepted: Whether the trial was accepted. If None, it's accepted if its class is below quota.
+
+        :return: Whether the trial was accepted.
+        """
+
+        outcome = bool(outcome)
+        if accepted is None:
+            accepted = self.get_accepted(outcome) < self.quotas[outcome]
+        self.attempts += 1
+        if stratum not in self.counts:
+            self.counts[stratum] = {True: 0, False: 0}
+            self.outcomes[stratum] = {name: np.zeros((self.num_bins, 2), dtype=int) for name in self.ranges}
+        if accepted:
+            self.counts[stratum][outcome] += 1
+        for name, b in bins.items():
+            if name in self.outcomes[stratum]:
+                self.outcomes[stratum][name][b, int(outcome)] += 1
+        return accepted
+
+    def get_outcome(self, labels: dict) -> bool:
+        """
+        :param labels: The trial-level labels of a trial.
+
+        :return: The trial's outcome.
+        """
+
+        if self.label not in labels:
+            raise KeyError("The trial has no label %s to balance; it has %s" % (self.label, list(labels.keys())))
+        return bool(labels[self.label])
+
+    def get_stratum(self, f: h5py.File, labels: dict) -> str:
+        """
+        :param f: The trial's hdf5 file.
+        :param labels: The trial-level labels of the trial.
+
+        :return: The trial's stratum, e.g. "room=box,probe_type=cube". Each value is taken from the labels if there's a label with that name, or else from the static data.
+        """
+
+        values = []
+        for name in self.strata:
+            if name in labels:
+                value = labels[name]
+            elif name in f["static"]:
+                value = f["static"][name][()]
+                if isinstance(value, bytes):
+                    value = value.decode("utf-8")
+                elif isinstance(value, np.ndarray):
+                    value = value.tolist()
+            else:
+                value = None
+            values.append("%s=%s" % (name, value))
+        return ",".join(values)
+
+    def restore(self, log: MetadataLog) -> None:
+        """
+        Count the trials in the balance log of a run that's being resumed.
+
+        :param log: The balance log.
+        """
+
+        for record in log.read():
+            meta = record["meta"]
+            self.observe(meta["outcome"], meta["stratum"], meta["bins"], accepted=meta["accepted"])
+
+    def summary(self) -> str:
+        """
+        :return: The accepted trials of each class, overall and per stratum.
+        """
+
+        lines = ["%s: %d/%d true, %d/%d false after %d trials" %
+                 (self.label, self.get_accepted(True), self.quotas[True], self.get_accepted(False),
+                  self.quotas[False], self.attempts)]
+        for stratum in sorted(self.counts):
+            lines.append("    %s: %d true, %d false" %
+                         (stratum, self.counts[stratum][True], self.counts[stratum][False]))
+        return "\n".join(lines)
+
+    @staticmethod
+    def get_path(output_dir: Union[str, Path]) -> Path:
+        """
+        :param output_dir: The output directory of the run.
+
+        :return: The path to the balance log: one line per trial that was run, `{"trial": <trial number>, "meta": {"outcome": ..., "stratum": ..., "bins": ..., "params": ..., "accepted": ...}}`.
+        """
+
+        return Path(output_dir).joinpath("balance.jsonl")
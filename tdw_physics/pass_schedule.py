@@ -0,0 +1,167 @@
+from typing import Dict, List, Optional
+import h5py
+import numpy as np
+
+# The last frame of a trial, in a schedule.
+LAST_FRAME = -1
+
+
+class PassSchedule:
+    """
+    Which frames of a trial each pass is rendered on, e.g. `"_img:every2,_id:0|-1,_depth:every5"`: `_img` on every
+    other frame, `_id` on the first and last frames, `_depth` on every fifth frame. A rule is `|`-separated terms, each
+    either `everyN` (frames 0, N, 2N, ...) or a frame number, where -1 is the last frame. Passes without a rule are
+    rendered on every frame.
+
+    Images are never sent by default (`send_images` is "never"). Before each frame that has passes to render,
+    `get_commands()` sets the pass masks (if they changed) and asks for images once, so the physics still steps once per
+    frame while only the scheduled passes are rendered. The trial only knows it's at its last frame once it's done, so
+    the passes of the last frame are rendered afterwards with physics paused; see `get_last_frame_commands()`.
+    """
+
+    def __init__(self, passes: List[str], schedule: str):
+        """
+        :param passes: The passes that are written, e.g. `["_img", "_id"]`.
+        :param schedule: The schedule.
+        """
+
+        self.passes = list(passes)
+        self.every: Dict[str, int] = {p: 1 for p in self.passes}
+        self.frames: Dict[str, List[int]] = {p: [] for p in self.passes}
+        for rule in schedule.split(","):
+            if len(rule) == 0:
+                continue
+            pass_mask, _, terms = rule.partition(":")
+            if pass_mask not in self.passes:
+                print("%s isn't in the written passes; not scheduling it" % pass_mask)
+                continue
+            self.every[pass_mask] = 0
+            for term in terms.split("|"):
+                if term.startswith("every"):
+                    self.every[pass_mask] = int(term[len("every"):])
+                    if self.every[pass_mask] < 1:
+                        raise ValueError("Can't render %s every %s frames" % (pass_mask, term))
+                else:
+                    frame = int(term)
+                    if frame < LAST_FRAME:
+                        raise ValueError("Can't schedule %s at frame %d; the only negative frame is -1 (the last)" %
+                                         (pass_mask, frame))
+                    self.frames[pass_mask].append(frame)
+        # The pass masks the build has.
+        self.pass_masks: Optional[List[str]] = None
+
+    def get_passes(self, frame: int) -> List[str]:
+        """
+        :param frame: The frame number.
+
+        :return: The passes that are rendered on this frame, not counting the last frame's.
+        """
+
+        return [p for p in self.passes if (self.every[p] > 0 and frame % self.every[p] == 0) or frame in self.frames[p]]
+
+    def get_last_frame_passes(self, frame: int) -> List[str]:
+        """
+        :param frame: The last frame of the trial.
+
+        :return: The passes of the last frame that weren't rendered on it.
+        """
+
+        rendered = self.get_passes(frame)
+        return [p for p in self.passes if LAST_FRAME in self.frames[p] and p not in rendered]
+
+    def renders_last_frame(self) -> bool:
+        """
+        :return: True if any pass is scheduled for the last frame.
+        """
+
+        return any(LAST_FRAME in frames for frames in self.frames.values())
+
+    def _get_image_commands(self, passes: List[str]) -> List[dict]:
+        commands = []
+        if passes != self.pass_masks:
+            commands.append({"$type": "set_pass_masks",
+                             "pass_masks": passes})
+            self.pass_masks = passes
+        commands.append({"$type": "send_images",
+                         "frequency": "once"})
+        return commands
+
+    def get_commands(self, frame: int) -> List[dict]:
+        """
+        :param frame: The frame number.
+
+        :return: The commands to render this frame's passes, to send with the frame's other commands.
+        """
+
+        passes = self.get_passes(frame)
+        if len(passes) == 0:
+            return []
+        return self._get_image_commands(passes)
+
+    def get_last_frame_commands(self, frame: int) -> List[dict]:
+        """
+        :param frame: The last frame of the trial.
+
+        :return: The commands to render the passes of the last frame that it didn't have, without stepping physics; physics has to be turned back on afterwards with `{"$type": "simulate_physics", "value": True}`. Empty if there aren't any.
+        """
+
+        passes = self.get_last_frame_passes(frame)
+        if len(passes) == 0:
+            return []
+        return [{"$type": "simulate_physics",
+                 "value": False}] + self._get_image_commands(passes)
+
+    def reset(self, pass_masks: List[str]) -> None:
+        """
+        :param pass_masks: The pass masks that were set on the build outside of the schedule.
+        """
+
+        self.pass_masks = list(pass_masks)
+
+
+def write_pass_frames(f: h5py.File, pass_frames: Dict[str, List[int]]) -> None:
+    """
+    Record which frames of a trial have each pass, as `passes/<pass>` (the frame numbers).
+
+    :param f: The trial file.
+    :param pass_frames: The frames with each pass.
+    """
+
+    grp = f.create_group("passes")
+    for pass_mask, frames in pass_frames.items():
+        grp.create_dataset(pass_mask, data=np.array(frames, dtype=np.int32))
+
+
+def get_pass_frames(f: h5py.File, pass_mask: str) -> Optional[np.ndarray]:
+    """
+    :param f: A trial file.
+    :param pass_mask: The pass.
+
+    :return: The frames that have the pass, or None if the file doesn't record them (every frame written with the pass has it).
+    """
+
+    if "passes" not in f:
+        return None
+    if pass_mask not in f["passes"]:
+        return np.zeros(0, dtype=np.int32)
+    return f["passes"][pass_mask][:]
+
+
+def get_frames_with_passes(f: h5py.File, passes: List[str], num_frames: int) -> np.ndarray:
+    """
+    :param f: A trial file.
+    :param passes: The passes, e.g. `["_img", "_id"]`.
+    :param num_frames: The number of frames of the trial.
+
+    :return: Whether each frame has all of the passes, shape `[num_frames]`. Passes that the file doesn't record the frames of (see `get_pass_frames()`) are on every frame.
+    """
+
+    has_passes = np.ones(num_frames, dtype=bool)
+    for pass_mask in passes:
+        frames = get_pass_frames(f, pass_mask)
+        if frames is None:
+            continue
+        has_pass = np.zeros(num_frames, dtype=bool)
+        has_pass[frames[(frames >= 0) & (frames < num_frames)]] = True
+        has_passes &= has_pass
+    return has_passes
@@ -0,0 +1,123 @@
+import argparse
+import time
+from collections import OrderedDict
+from typing import List
+import numpy as np
+from tdw.output_data import OutputData, Collision, EnvironmentCollision
+from tdw_physics.frame_response import FrameResponse, CollisionBuffer
+from tdw_physics.response_log import ResponseReplayer, ReplayError
+
+
+def get_high_contact_frames(path: str, num_frames: int = 100) -> List[List[bytes]]:
+    """
+    :param path: A tdw_responses.hdf5 file recorded with `--record_responses`, or the directory with one.
+    :param num_frames: The number of frames to return.
+
+    :return: The recorded responses with the most `coll` and `enco` output data, most first.
+    """
+
+    replayer = ResponseReplayer(path)
+    frames = []
+    for trial_num in replayer.trials:
+        replayer.start_trial(trial_num)
+        while True:
+            try:
+                resp = replayer.next()
+            except ReplayError:
+                break
+            count = sum(1 for r in resp[:-1] if OutputData.get_data_type_id(r) in ["coll", "enco"])
+            if count > 0:
+                frames.append((count, resp))
+        replayer.end_trial()
+    replayer.close()
+    frames.sort(key=lambda f: -f[0])
+    return [resp for _, resp in frames[:num_frames]]
+
+
+def parse_with_np_append(resp: List[bytes]) -> None:
+    """
+    Parse collisions the way `RigidbodiesDataset._write_frame()` used to, with an `np.append` per collision and contact.
+    This is the baseline of the benchmark.
+
+    :param resp: The response.
+    """
+
+    collision_ids = np.empty(dtype=np.int32, shape=(0, 2))
+    collision_relative_velocities = np.empty(dtype=np.float32, shape=(0, 3))
+    collision_contacts = np.empty(dtype=np.float32, shape=(0, 2, 3))
+    collision_states = np.empty(dtype=str, shape=(0, 1))
+    env_collision_ids = np.empty(dtype=np.int32, shape=(0, 1))
+    env_collision_contacts = np.empty(dtype=np.float32, shape=(0, 2, 3))
+    for r in resp[:-1]:
+        r_id = OutputData.get_data_type_id(r)
+        if r_id == "coll":
+            co = Collision(r)
+            collision_states = np.append(collision_states, co.get_state())
+            collision_ids = np.append(collision_ids, [co.get_collider_id(), co.get_collidee_id()])
+            collision_relative_velocities = np.append(collision_relative_velocities, co.get_relative_velocity())
+            for i in range(co.get_num_contacts()):
+                collision_contacts = np.append(collision_contacts, (co.get_contact_normal(i),
+                                                                    co.get_contact_point(i)))
+        elif r_id == "enco":
+            en = EnvironmentCollision(r)
+            env_collision_ids = np.append(env_collision_ids, en.get_object_id())
+            for i in range(en.get_num_contacts()):
+                env_collision_contacts = np.append(env_collision_contacts, (en.get_contact_normal(i),
+                                                                            en.get_contact_point(i)))
+
+
+def main(path: str, num_frames: int = 100, repeats: int = 5) -> dict:
+    """
+    Time parsing the collisions of the recorded frames with the most collisions.
+
+    :param path: A tdw_responses.hdf5 file, or the directory with one.
+    :param num_frames: The number of frames to parse.
+    :param repeats: The number of times to parse each frame.
+
+    :return: The milliseconds per frame of each method.
+    """
+
+    frames = get_high_contact_frames(path, num_frames)
+    if len(frames) == 0:
+        print("No recorded frames with collisions in %s" % path)
+        return dict()
+    buffers = (CollisionBuffer(), CollisionBuffer(env=True))
+
+    def reused_buffers(resp):
+        fr = FrameResponse(resp, collision_buffer=buffers[0], env_collision_buffer=buffers[1])
+        return fr.collisions, fr.env_collisions
+
+    def new_buffers(resp):
+        fr = FrameResponse(resp)
+        return fr.collisions, fr.env_collisions
+
+    methods = OrderedDict([("np.append", parse_with_np_append),
+                           ("new buffers", new_buffers),
+                           ("reused buffers", reused_buffers)])
+    num_collisions = 0
+    num_contacts = 0
+    for collisions, env_collisions in map(new_buffers, frames):
+        num_collisions += len(collisions) + len(env_collisions)
+        num_contacts += len(collisions.contacts) + len(env_collisions.contacts)
+    print("%d frames, %.1f collisions and %.1f contacts per frame" %
+          (len(frames), num_collisions / len(frames), num_contacts / len(frames)))
+
+    results = OrderedDict()
+    for name, method in methods.items():
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            for resp in frames:
+                method(resp)
+        results[name] = 1000. * (time.perf_counter() - t0) / (repeats * len(frames))
+        print("    %-16s %8.3f ms/frame" % (name, results[name]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--responses", type=str, help="A tdw_responses.hdf5 file recorded with --record_responses, or the directory with one")
+    parser.add_argument("--frames", type=int, default=100, help="The number of frames with the most collisions to parse")
+    parser.add_argument("--repeats", type=int, default=5, help="The number of times to parse each frame")
+
+    args = parser.parse_args()
+    main(path=args.responses, num_frames=args.frames, repeats=args.repeats)
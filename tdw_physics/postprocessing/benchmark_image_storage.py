@@ -0,0 +1,95 @@
+import argparse
+import glob
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, List
+import h5py
+import numpy as np
+from tdw_physics.columnar_layout import legacy_view
+from tdw_physics.image_storage import DEPTH_PASSES, ENCODED_STORAGES, DEPTH_STORAGES, encode_pass, read_pass, \
+    read_storage_policy
+
+
+def get_pass_data(paths: List[str], max_frames: int = 100) -> Dict[str, List[np.ndarray]]:
+    """
+    :param paths: The paths to trial files.
+    :param max_frames: The maximum number of frames to read per pass.
+
+    :return: The image data of each pass, as it was before it was written.
+    """
+
+    data = OrderedDict()
+    for path in paths:
+        with h5py.File(path, "r") as f:
+            policy = read_storage_policy(f)
+            frames = legacy_view(f)["frames"]
+            for frame in frames.keys():
+                images = frames[frame]["images"]
+                for pass_mask in images.keys():
+                    if pass_mask not in data:
+                        data[pass_mask] = []
+                    if len(data[pass_mask]) < max_frames:
+                        data[pass_mask].append(read_pass(f, images[pass_mask][()], pass_mask, policy))
+            if len(data) > 0 and min(len(d) for d in data.values()) >= max_frames:
+                break
+    return data
+
+
+def benchmark_storage(pass_mask: str, frames: List[np.ndarray], storage: str) -> dict:
+    """
+    Write the frames of a pass to a temporary hdf5 file, one dataset per frame as in a trial file.
+
+    :param pass_mask: The pass.
+    :param frames: The image data of each frame.
+    :param storage: How to store the pass.
+
+    :return: The bytes and milliseconds per frame.
+    """
+
+    fd, path = tempfile.mkstemp(suffix=".hdf5")
+    os.close(fd)
+    try:
+        t0 = time.perf_counter()
+        with h5py.File(path, "w") as f:
+            for i, image_data in enumerate(frames):
+                stored_data, kwargs = encode_pass(pass_mask, image_data, storage)
+                f.create_dataset("%04d" % i, data=stored_data, **kwargs)
+        seconds = time.perf_counter() - t0
+        num_bytes = os.path.getsize(path)
+    finally:
+        os.remove(path)
+    return {"bytes_per_frame": num_bytes / len(frames),
+            "ms_per_frame": 1000. * seconds / len(frames)}
+
+
+def main(paths: List[str], max_frames: int = 100) -> Dict[str, Dict[str, dict]]:
+    """
+    Report the bytes and milliseconds per frame of each storage of each pass.
+
+    :param paths: The paths to trial files.
+    :param max_frames: The maximum number of frames to write per pass.
+
+    :return: The results of each storage of each pass.
+    """
+
+    results = OrderedDict()
+    for pass_mask, frames in get_pass_data(paths, max_frames).items():
+        storages = DEPTH_STORAGES if pass_mask in DEPTH_PASSES else ENCODED_STORAGES
+        results[pass_mask] = OrderedDict((storage, benchmark_storage(pass_mask, frames, storage))
+                                         for storage in storages)
+        print("%s (%d frames)" % (pass_mask, len(frames)))
+        for storage, r in results[pass_mask].items():
+            print("    %-8s %10.0f bytes/frame %8.3f ms/frame" % (storage, r["bytes_per_frame"], r["ms_per_frame"]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", type=str, help="The directory of HDF5s to read images from")
+    parser.add_argument("--files", type=str, default="*.hdf5", help="The pattern of files to read")
+    parser.add_argument("--frames", type=int, default=100, help="The maximum number of frames to write per pass")
+
+    args = parser.parse_args()
+    main(paths=sorted(glob.glob(os.path.join(args.dir, args.files))), max_frames=args.frames)
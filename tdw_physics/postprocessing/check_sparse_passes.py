@@ -0,0 +1,94 @@
+"""
+Label a columnar trial whose `_id` pass was only rendered on some frames (`--pass_schedule`), and check that the
+labels that read the frames without `_id` are None instead of raising.
+"""
+
+import io
+import os
+import tempfile
+import h5py
+import numpy as np
+from PIL import Image
+from tdw_physics.columnar_layout import ColumnarFrames
+from tdw_physics.image_cache import DecodedImageCache
+from tdw_physics.pass_schedule import write_pass_frames
+from tdw_physics.postprocessing.labels import (get_labels_from, target_mask_initial_centroid,
+                                               target_mask_final_centroid, is_any_object_fully_occluded)
+from tdw_physics.postprocessing.trial_reader import TrialReader
+
+NUM_FRAMES = 4
+SEGMENTATION_COLORS = np.array([[255, 0, 0], [0, 255, 0]], dtype=np.uint8)
+
+
+def get_id_pass() -> np.ndarray:
+    """
+    :return: An encoded `_id` pass: the left half is the target, the right half is the zone.
+    """
+
+    image = np.zeros((8, 8, 3), dtype=np.uint8)
+    image[:, :4] = SEGMENTATION_COLORS[0]
+    image[:, 4:] = SEGMENTATION_COLORS[1]
+    png = io.BytesIO()
+    Image.fromarray(image).save(png, format="PNG")
+    return np.frombuffer(png.getvalue(), dtype=np.uint8)
+
+
+def write_trial(path: str, id_frames: list) -> None:
+    """
+    :param path: The path to the trial file.
+    :param id_frames: The frames with the `_id` pass.
+    """
+
+    with h5py.File(path, "w") as f:
+        static = f.create_group("static")
+        static.create_dataset("object_ids", data=np.array([1, 2], dtype=np.int32))
+        static.create_dataset("target_id", data=1)
+        static.create_dataset("zone_id", data=2)
+        static.create_dataset("object_segmentation_colors", data=SEGMENTATION_COLORS)
+        f.attrs["layout"] = "columnar"
+        frames = ColumnarFrames(f.create_group("frames"))
+        for frame in range(NUM_FRAMES):
+            grp = frames.create_group("%04d" % frame)
+            images = grp.create_group("images")
+            if frame in id_frames:
+                images.create_dataset("_id", data=get_id_pass())
+            objects = grp.create_group("objects")
+            objects.create_dataset("positions", data=np.zeros((2, 3), dtype=np.float32))
+        frames.close()
+        write_pass_frames(f, {"_id": id_frames})
+
+
+def check(id_frames: list, expected: dict) -> None:
+    """
+    :param id_frames: The frames with the `_id` pass.
+    :param expected: Whether each label function should return a value (True) or None (False).
+    """
+
+    path = os.path.join(tempfile.mkdtemp(), "0000.hdf5")
+    write_trial(path, id_frames)
+    with h5py.File(path, "r") as f:
+        reader = TrialReader(f, image_cache=DecodedImageCache())
+        for frame in range(NUM_FRAMES):
+            try:
+                reader.pass_mask(frame, "_id")
+                assert frame in id_frames, "Frame %d has no _id pass, but it was read" % frame
+            except KeyError:
+                assert frame not in id_frames, "Frame %d has an _id pass, but it couldn't be read" % frame
+        labels = get_labels_from(f, label_funcs=[target_mask_initial_centroid, target_mask_final_centroid,
+                                                 is_any_object_fully_occluded])
+    for name, has_value in expected.items():
+        assert (labels[name] is not None) == has_value, "_id on frames %s: %s = %s" % (id_frames, name, labels[name])
+    print("_id on frames %s: %s" % (id_frames, dict(labels)))
+
+
+if __name__ == "__main__":
+    check([0], {"target_mask_initial_centroid": True,
+                "target_mask_final_centroid": False,
+                "is_any_object_fully_occluded": True})
+    check([NUM_FRAMES - 1], {"target_mask_initial_centroid": False,
+                             "target_mask_final_centroid": True,
+                             "is_any_object_fully_occluded": False})
+    check([2], {"target_mask_initial_centroid": False,
+                "target_mask_final_centroid": False,
+                "is_any_object_fully_occluded": False})
+    print("Labels of columnar trials with a sparse pass schedule are OK")
@@ -10,6 +10,8 @@ import argparse
 from tqdm import tqdm
 
 from tdw_physics.postprocessing.labels import *
+from tdw_physics.postprocessing.trial_stats import run_in_pool
+from tdw_physics.postprocessing.label_cache import LabelCache
 import tdw_physics.target_controllers as controllers
 
 def list_controllers():
@@ -31,6 +33,16 @@ def get_controller_label_funcs_by_class(cls: str = 'MultiDominoes'):
 
 
 
+def _trial_metadata_worker(label_funcs, item):
+    stimpath, names = item
+    if names is not None:
+        label_funcs = [func for func in label_funcs if func.__name__ in names]
+    f = h5py.File(stimpath, 'r')
+    trial_meta = OrderedDict()
+    trial_meta = get_labels_from(f, label_funcs, res=trial_meta)
+    f.close()
+    return stimpath, trial_meta
+
 def compute_metadata_from_stimuli(
         stimulus_dir : str,
         file_pattern : str = "*.hdf5",
@@ -38,7 +50,10 @@ def compute_metadata_from_stimuli(
         label_funcs: List[type(list_controllers)] = [],
         add_controller_funcs: bool = True,
         overwrite: bool = False,
-        outfile: str = 'metadata') -> None:
+        outfile: str = 'metadata',
+        num_workers: int = None,
+        use_cache: bool = True,
+        write_csv: bool = False) -> None:
 
     # get the hdf5s in the directory
     stims = sorted(glob.glob(stimulus_dir + file_pattern))
@@ -56,19 +71,29 @@ def compute_metadata_from_stimuli(
     if add_controller_funcs:
         label_funcs += get_controller_label_funcs_by_class(controller_class)
 
-    # iterate over stims
-    metadata = []
-    for stimpath in tqdm(stims):
-        f = h5py.File(stimpath, 'r')
-        trial_meta = OrderedDict()
-        trial_meta = get_labels_from(f, label_funcs, res=trial_meta)
-        metadata.append(trial_meta)
-        f.close()
-
-    # write out new metadata
-    json_str = json.dumps(metadata, indent=4)
     meta_file = Path(stimulus_dir).joinpath(outfile + ('' if overwrite else '_post') + '.json')
-    meta_file.write_text(json_str, encoding='utf-8')
+    if not use_cache:
+        # label the stims in parallel, keeping them in order
+        items = [(stimpath, None) for stimpath in stims]
+        metadata = [trial_meta for _, trial_meta in
+                    tqdm(run_in_pool(_trial_metadata_worker, items, label_funcs, num_workers=num_workers, ordered=True),
+                         total=len(stims))]
+        json_str = json.dumps(metadata, indent=4)
+        meta_file.write_text(json_str, encoding='utf-8')
+    else:
+        # only compute the labels that aren't in the stimulus dir's label cache, or are stale
+        cache = LabelCache(stimulus_dir)
+        missing = cache.get_missing(stims, label_funcs)
+        print("Computing %d labels of %d trials" % (sum(len(names) for names in missing.values()), len(missing)))
+        for stimpath, trial_meta in tqdm(run_in_pool(_trial_metadata_worker, list(missing.items()), label_funcs,
+                                                     num_workers=num_workers),
+                                         total=len(missing)):
+            cache.put(stimpath, trial_meta, label_funcs, computed=missing[stimpath])
+        metadata = cache.export_json(meta_file, stims, label_funcs)
+        if write_csv:
+            cache.export_csv(meta_file.with_suffix('.csv'), stims, label_funcs)
+        cache.close()
+
     print("Wrote new metadata: %s\nfor %d trials" % (str(meta_file), len(metadata)))
     return
 
@@ -0,0 +1,184 @@
+import os
+import io
+import csv
+import json
+import hashlib
+import inspect
+import sqlite3
+from pathlib import Path
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+
+# The label cache of a stimulus directory.
+LABEL_CACHE_FILE = "labels.sqlite"
+
+
+def get_func_hash(func: Callable) -> str:
+    """
+    :param func: A label function.
+
+    :return: The md5 hash of the function's source code, so that a cached label is stale once its function changes.
+    """
+
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        code = func.__code__
+        source = repr((code.co_code, code.co_consts, code.co_names))
+    return hashlib.md5(source.encode("utf-8")).hexdigest()
+
+
+def get_fingerprint(path: Union[str, Path]) -> Tuple[int, int]:
+    """
+    :param path: The path to a trial file.
+
+    :return: The size and modification time (ns) of the file. If either changes, its cached labels are stale.
+    """
+
+    st = os.stat(str(path))
+    return st.st_size, st.st_mtime_ns
+
+
+def _to_json(value) -> str:
+    return json.dumps(value, default=lambda v: v.tolist() if isinstance(v, (np.ndarray, np.generic)) else str(v))
+
+
+class LabelCache:
+    """
+    A persistent cache of the labels of each trial file of a stimulus directory (`labels.sqlite`), one row per
+    (file, label function). A row is stale if the file's size or modification time, or the function's source, changed.
+
+    `get_missing()` returns the (file, label) pairs that need to be computed, so adding a label function to a labeled
+    directory only computes that label. A label function that doesn't apply to a file (it raised an AttributeError, so
+    `get_labels_from()` left it out) is cached too, with a NULL value, so it isn't computed again; `read()` leaves it
+    out, as `get_labels_from()` does. Only one process should write to the cache at a time.
+    """
+
+    def __init__(self, stimulus_dir: Union[str, Path]):
+        """
+        :param stimulus_dir: The stimulus directory. Files are keyed by their path relative to it.
+        """
+
+        self.stimulus_dir = Path(stimulus_dir)
+        self.path = self.stimulus_dir.joinpath(LABEL_CACHE_FILE)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("CREATE TABLE IF NOT EXISTS labels ("
+                        "file TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, "
+                        "mtime INTEGER NOT NULL, "
+                        "func TEXT NOT NULL, "
+                        "func_hash TEXT NOT NULL, "
+                        "value TEXT, "
+                        "PRIMARY KEY (file, func))")
+        self.db.commit()
+
+    def _key(self, path: Union[str, Path]) -> str:
+        path = Path(path)
+        try:
+            return str(path.resolve().relative_to(self.stimulus_dir.resolve()))
+        except ValueError:
+            return str(path.resolve())
+
+    def get_missing(self, paths: List[Union[str, Path]], funcs: List[Callable]) -> Dict[str, List[str]]:
+        """
+        :param paths: The paths to the trial files.
+        :param funcs: The label functions.
+
+        :return: A dictionary of path: the names of the label functions that aren't cached, or are stale. Paths with every label cached aren't included.
+        """
+
+        hashes = {func.__name__: get_func_hash(func) for func in funcs}
+        cached = dict()
+        for file, size, mtime, func, func_hash in self.db.execute(
+                "SELECT file, size, mtime, func, func_hash FROM labels"):
+            cached[(file, func)] = (size, mtime, func_hash)
+        missing = OrderedDict()
+        for path in paths:
+            key = self._key(path)
+            size, mtime = get_fingerprint(path)
+            names = [name for name, func_hash in hashes.items() if cached.get((key, name)) != (size, mtime, func_hash)]
+            if len(names) > 0:
+                missing[str(path)] = names
+        return missing
+
+    def put(self, path: Union[str, Path], labels: Dict[str, object], funcs: List[Callable],
+            computed: Optional[List[str]] = None) -> None:
+        """
+        Cache the labels of a trial file.
+
+        :param path: The path to the trial file.
+        :param labels: A dictionary of label function name: label.
+        :param funcs: The label functions.
+        :param computed: The names of the label functions that were run on the file. Those without a label in `labels` are cached as not applying to the file. If None, only the labels in `labels` are cached.
+        """
+
+        hashes = {func.__name__: get_func_hash(func) for func in funcs}
+        key = self._key(path)
+        size, mtime = get_fingerprint(path)
+        rows = [(key, size, mtime, name, hashes[name], _to_json(value))
+                for name, value in labels.items() if name in hashes]
+        if computed is not None:
+            rows.extend((key, size, mtime, name, hashes[name], None)
+                        for name in computed if name in hashes and name not in labels)
+        self.db.executemany("INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.db.commit()
+
+    def read(self, paths: List[Union[str, Path]], funcs: List[Callable]) -> List[Dict[str, object]]:
+        """
+        :param paths: The paths to the trial files.
+        :param funcs: The label functions.
+
+        :return: The cached labels of each file, in the order of `funcs`. Labels that aren't cached, or don't apply to the file, are omitted.
+        """
+
+        names = [func.__name__ for func in funcs]
+        rows = dict()
+        for file, func, value in self.db.execute("SELECT file, func, value FROM labels WHERE value IS NOT NULL"):
+            rows[(file, func)] = value
+        metadata = []
+        for path in paths:
+            key = self._key(path)
+            metadata.append(OrderedDict((name, json.loads(rows[(key, name)]))
+                                        for name in names if (key, name) in rows))
+        return metadata
+
+    def export_json(self, outfile: Union[str, Path], paths: List[Union[str, Path]], funcs: List[Callable]) -> List[dict]:
+        """
+        Write the cached labels as a list with one dictionary per file, like `metadata.json`.
+
+        :param outfile: The path to the JSON file.
+        :param paths: The paths to the trial files.
+        :param funcs: The label functions.
+
+        :return: The labels.
+        """
+
+        metadata = self.read(paths, funcs)
+        Path(outfile).write_text(json.dumps(metadata, indent=4), encoding="utf-8")
+        return metadata
+
+    def export_csv(self, outfile: Union[str, Path], paths: List[Union[str, Path]], funcs: List[Callable]) -> None:
+        """
+        Write the cached labels as a CSV file with one row per file and one column per label.
+        Labels that aren't scalars are written as JSON.
+
+        :param outfile: The path to the CSV file.
+        :param paths: The paths to the trial files.
+        :param funcs: The label functions.
+        """
+
+        names = [func.__name__ for func in funcs]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["file"] + names)
+        for path, labels in zip(paths, self.read(paths, funcs)):
+            row = [self._key(path)]
+            for name in names:
+                value = labels.get(name)
+                row.append(json.dumps(value) if isinstance(value, (list, dict)) else value)
+            writer.writerow(row)
+        Path(outfile).write_text(buffer.getvalue(), encoding="utf-8")
+
+    def close(self) -> None:
+        self.db.close()
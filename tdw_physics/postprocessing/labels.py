@@ -8,6 +8,9 @@ from PIL import Image
 
 
 from tdw_physics.util import arr_to_xyz
+from tdw_physics.image_cache import DecodedImageCache
+from tdw_physics.postprocessing.trial_reader import TrialReader, as_trial_reader
+from tdw_physics.postprocessing.trial_stats import get_trial_stats, LabelAggregator, LabelCollector
 
 def round_float(x, places=3):
     return round(float(x), places)
@@ -19,16 +22,13 @@ def strip(s): return s[2:-1]
 #################
 
 def get_static_val(d, key='object_ids'):
-    try:
-        return np.array(d['static'][key])
-    except KeyError:
-        return None
+    return as_trial_reader(d).static(key)
 
 def trial_num(d):
     return int(get_static_val(d, 'trial_num'))
 
 def get_object_ids(d):
-    return list(d['static']['object_ids'])
+    return as_trial_reader(d).object_ids()
 
 def avg_label(label_list):
     if len(label_list) == 0:
@@ -62,16 +62,10 @@ def avg_label(label_list):
 #################
 
 def get_collisions(d, frame_num=0, env_collisions=False):
-    fkeys = [k for k in d['frames'].keys()]
-    return d['frames'][fkeys[frame_num]]['collisions' if not env_collisions else 'env_collisions']
+    return as_trial_reader(d).collisions(frame_num, env_collisions)
 
 def find_collisions_frames(d, cdata='contacts', env_collisions=False):
-    n_frames = len([k for k in d['frames'].keys()])
-    collisions = []
-    for n in range(n_frames):
-        contacts = get_collisions(d, n, env_collisions)[cdata]
-        collisions.append(bool(len(contacts)))
-    return np.where(collisions)[0]
+    return np.where(as_trial_reader(d).num_collisions(cdata, env_collisions) > 0)[0]
 
 
 #################
@@ -80,14 +74,10 @@ def find_collisions_frames(d, cdata='contacts', env_collisions=False):
 
 def get_pass_mask(d, frame_num=0, img_key='_img'):
     assert img_key in ['_id', '_img', '_depth', '_normal', '_flow'], img_key
-    frames = list(d['frames'].keys())
-    frames.sort()
-    img = d['frames'][frames[frame_num]]['images'][img_key][:]
-    img = Image.open(io.BytesIO(img))
-    return np.array(img)
+    return as_trial_reader(d).pass_mask(frame_num, img_key)
 
 def get_segment_map(d, frame_num=0):
-    return get_pass_mask(d, frame_num=frame_num, img_key='_id')
+    return as_trial_reader(d).seg_map(frame_num)
 
 def get_hashed_segment_map(d, val=256):
     segmap = get_segment_map(d) # [H,W,3]
@@ -104,11 +94,10 @@ def get_object_masks(d, exclude_background=True):
     return masks[...,1:] if exclude_background else masks
 
 def get_object_binary_mask(d, obj_id, frame_num=0):
-    obj_ids = get_object_ids(d)
-    inds = [i for i,oid in enumerate(obj_ids) if obj_id == oid]
-    if len(inds) == 0:
+    d = as_trial_reader(d)
+    ind = d.object_index(obj_id)
+    if ind is None:
         return None
-    ind = inds[0]
     seg_colors = get_static_val(d, key='object_segmentation_colors')
     color = seg_colors[ind,:] # [3]
 
@@ -165,28 +154,20 @@ def get_mask_centroid(d, object_key='target_id', frame_num=0):
 #################
 
 def get_collisions(d, idx, env_collisions=False):
-    fkeys = [k for k in d['frames'].keys()]
-    return d['frames'][fkeys[idx]]['collisions' if not env_collisions else 'env_collisions']
+    return as_trial_reader(d).collisions(idx, env_collisions)
 
 def find_collisions_frames(d, cdata='contacts', env_collisions=False):
-    n_frames = len([k for k in d['frames'].keys()])
-    collisions = []
-    for n in range(n_frames):
-        contacts = get_collisions(d, n, env_collisions)[cdata]
-        collisions.append(bool(len(contacts)))
-    return np.where(collisions)[0]
+    return np.where(as_trial_reader(d).num_collisions(cdata, env_collisions) > 0)[0]
 
 def get_frames(d):
-    frames = list(d['frames'].keys())
-    frames.sort()
-    return frames
+    return as_trial_reader(d).frames
 
 def num_frames(d):
-    return len(get_frames(d))
+    return as_trial_reader(d).num_frames
 
 def get_labels(d, label_key='trial_end'):
     try:
-        return list([np.array(d['frames'][fr]['labels'][label_key]) for fr in get_frames(d)])
+        return list(as_trial_reader(d).labels(label_key))
     except KeyError:
         return None
 
@@ -463,10 +444,13 @@ TRIAL_LABELS = [
 def get_all_label_funcs():
     return TRIAL_LABELS
 
-def get_labels_from(d, label_funcs, res=None):
+def get_labels_from(d, label_funcs, res=None, image_cache=None):
     if res is None:
         res = OrderedDict()
 
+    # read the trial once for every label function, whichever layout it was written in,
+    # and share decoded images across label functions (and with the controller, if it passes its cache)
+    d = TrialReader(d, image_cache=image_cache if image_cache is not None else DecodedImageCache())
     for func in label_funcs:
         try:
             res[func.__name__] = func(d)
@@ -480,27 +464,18 @@ def get_labels_from(d, label_funcs, res=None):
 def get_all_labels(d, res=None):
     return get_labels_from(d, label_funcs=get_all_label_funcs(), res=res)
 
-def get_across_trial_stats_from(paths, funcs, agg_func=avg_label):
+def get_across_trial_stats_from(paths, funcs, agg_func=avg_label, num_workers=None):
 
-    res = []
-    for i,path in enumerate(tqdm(paths)):
-        f = h5py.File(path)
-        res_f = OrderedDict()
-        for func in funcs:
-            try:
-                res_f[func.__name__ + '/' + agg_func.__name__] = func(f)
-            except Exception as e:
-                print("Error occured during trials stats collection:",e)
-        res.append(res_f)
-        f.close()
+    # the trials are read in parallel; with avg_label, each worker returns running means that are merged as they arrive
+    aggregator_class = LabelAggregator if agg_func is avg_label else LabelCollector
+    res = get_trial_stats(paths, funcs, aggregator_class=aggregator_class, num_workers=num_workers).result()
 
-    try:
-        keys = res[0].keys()
-    except IndexError:
-        keys = []
-    stats = {
-        k: agg_func([res[i][k] for i in range(len(res))])
-        for k in keys}
+    stats = OrderedDict()
+    for func in funcs:
+        if func.__name__ not in res:
+            continue
+        k = func.__name__ + '/' + agg_func.__name__
+        stats[k] = res[func.__name__] if agg_func is avg_label else agg_func(res[func.__name__])
 
     return stats
 
@@ -3,10 +3,15 @@ import h5py
 import numpy as np
 from subprocess import PIPE, STDOUT, DEVNULL
 import subprocess
-from typing import List, Dict, Tuple
+import io
+from typing import List, Dict, Tuple, Optional
 from pathlib import Path
 import argparse
 from tdw_physics.postprocessing.labels import get_pass_mask
+from tdw_physics.postprocessing.trial_stats import run_in_pool
+from tdw_physics.columnar_layout import legacy_view
+from tdw_physics.image_storage import DEPTH_PASSES, read_storage_policy, read_pass
+from tdw_physics.pass_schedule import get_pass_frames
 from PIL import Image
 from tqdm import tqdm
 
@@ -101,71 +106,173 @@ def pngs_from_hdf5(filepath, pass_mask="_img"):
 
     ## read the HDF5 and save out pngs one by one
     fh = h5py.File(str(filepath), 'r')
-    frames = sorted(list(fh['frames'].keys()))
+    frames_grp = legacy_view(fh)['frames']
+    frames = sorted(list(frames_grp.keys()))
     num_pngs = len(frames)
     for n in range(num_pngs):
         pngname = pass_mask[1:] + ("_%04d.png" % n)
         png = pngdir.joinpath(pngname)
         with open(png, 'wb') as p:
-            p.write(fh['frames'][frames[n]]['images'][pass_mask][:])
+            p.write(frames_grp[frames[n]]['images'][pass_mask][:])
 
     fh.close()
 
     return pngdir
 
-def main(stimulus_dir: str,
-         file_pattern: str = "*.hdf5",
-         save_dir: str = None,
-         add_prefix: bool = False,
-         pass_mask: str = "_img",
-         size: List[int] = [256,256],
-         overwrite: bool = False):
+def get_image_extension(data: bytes) -> str:
+    """
+    :param data: An encoded image.
+
+    :return: "jpg" if the image is a JPG, otherwise "png".
+    """
+
+    return "jpg" if bytes(data[:2]) == b'\xff\xd8' else "png"
+
+def mp4_from_hdf5(filepath: str,
+                  mp4name: str,
+                  pass_mask: str = "_img",
+                  framerate: int = 30,
+                  ffmpeg_args: List[str] = default_ffmpeg_args) -> Tuple[List[str], bytes, bytes]:
+    """
+    Encode a pass of an hdf5 file to an MP4 by piping each frame's image straight to ffmpeg, without writing PNGs.
+
+    :return: The ffmpeg command, stdout and stderr, like `pngs_to_mp4()`. Raises a `RuntimeError` if ffmpeg failed; see `MP4Encoder.close()`.
+    """
+
+    # Imported here so that `movie_encoder` can import `default_ffmpeg_args` from this module.
+    from tdw_physics.movie_encoder import MP4Encoder
+
+    encoder = MP4Encoder(filename=mp4name, framerate=framerate, ffmpeg_args=ffmpeg_args)
+    fh = h5py.File(str(filepath), 'r')
+    try:
+        policy = read_storage_policy(fh)
+        pass_frames = get_pass_frames(fh, pass_mask)
+        frames_grp = legacy_view(fh)['frames']
+        for frame in sorted(list(frames_grp.keys())):
+            images = frames_grp[frame]['images']
+            if pass_mask not in images.keys() or (pass_frames is not None and int(frame) not in pass_frames):
+                continue
+            data = images[pass_mask][:]
+            if pass_mask in DEPTH_PASSES:
+                png = io.BytesIO()
+                Image.fromarray(read_pass(fh, data, pass_mask, policy)).save(png, format="PNG")
+                encoder.write(png.getvalue(), "png")
+            else:
+                encoder.write(data.tobytes(), get_image_extension(data))
+    except BaseException:
+        encoder.abort()
+        raise
+    finally:
+        fh.close()
+    return encoder.close()
+
+def get_mp4_name(filepath: str,
+                 pass_mask: str = "_img",
+                 save_dir: Optional[str] = None,
+                 add_prefix: bool = False) -> Path:
+    """
+    :return: The path of the MP4 of a pass of an hdf5 file.
+    """
+
+    filepath = Path(filepath)
+    name = filepath.name.split('.')[0] + pass_mask + ".mp4"
+    if add_prefix:
+        name = filepath.parent.name + '_' + name
+    return Path(save_dir if save_dir is not None else filepath.parent).joinpath(name)
+
+def is_up_to_date(filepath: str, mp4name: str) -> bool:
+    """
+    :return: True if the MP4 exists and is newer than the hdf5 file it was made from. MP4s are only moved into place once ffmpeg succeeded, so one that exists is complete.
+    """
+
+    return os.path.exists(mp4name) and os.path.getmtime(mp4name) >= os.path.getmtime(filepath)
+
+def _render_worker(state, task):
+    framerate, ffmpeg_args = state
+    filepath, mp4name, pass_mask = task
+    try:
+        mp4_from_hdf5(filepath, mp4name, pass_mask=pass_mask, framerate=framerate, ffmpeg_args=ffmpeg_args)
+    except RuntimeError as e:
+        print(e)
+        return mp4name, False
+    return mp4name, os.path.exists(mp4name)
+
+def render_movies(stimulus_dirs: List[str],
+                  passes: List[str] = ["_img"],
+                  file_pattern: str = "*.hdf5",
+                  save_dir: str = None,
+                  add_prefix: bool = False,
+                  overwrite: bool = False,
+                  framerate: int = 30,
+                  ffmpeg_args: List[str] = default_ffmpeg_args,
+                  num_workers: Optional[int] = None) -> List[str]:
+    """
+    Make an MP4 of each pass of each hdf5 file in the stimulus directories, in a pool of worker processes.
+    Each worker streams a file's images to ffmpeg, so no PNGs are written.
+    MP4s that are newer than their hdf5 file are skipped, unless `overwrite` is True.
+
+    :param num_workers: The number of worker processes. If None, one per CPU.
 
-    filepaths = glob.glob(os.path.join(stimulus_dir, file_pattern))
-    print("files", filepaths)
+    :return: The MP4s that were written.
+    """
 
     if save_dir is not None:
         save_dir = Path(save_dir)
         if not save_dir.exists():
             save_dir.mkdir(parents=True)
 
-    for fpath in tqdm(filepaths):
-        mp4name = fpath.split('.')[0] + pass_mask + ".mp4"
-        if save_dir is not None:
-            save_nm = Path(save_dir).joinpath(Path(mp4name).name)
-        else:
-            save_nm = mp4name
+    tasks = []
+    for stimulus_dir in stimulus_dirs:
+        for fpath in sorted(glob.glob(os.path.join(stimulus_dir, file_pattern))):
+            for pass_mask in passes:
+                mp4name = str(get_mp4_name(fpath, pass_mask, save_dir=save_dir, add_prefix=add_prefix))
+                if overwrite or not is_up_to_date(fpath, mp4name):
+                    tasks.append((fpath, mp4name, pass_mask))
+    print("rendering %d movies" % len(tasks))
 
-        if Path(save_nm).exists() and not overwrite:
-            continue
+    written = []
+    pbar = tqdm(total=len(tasks))
+    for mp4name, ok in run_in_pool(_render_worker, tasks, (framerate, ffmpeg_args), num_workers):
+        if ok:
+            written.append(mp4name)
+        pbar.update(1)
+    pbar.close()
+    return written
 
-        pngdir = pngs_from_hdf5(fpath, pass_mask=pass_mask)
-        pngs_to_mp4(filename=mp4name,
-                    image_stem=pass_mask[1:] + "_",
-                    png_dir=pngdir,
-                    use_parent_dir=add_prefix,
-                    size=size,
-                    remove_pngs=True,
-                    rename_movies=False)
-        rm = subprocess.run('rm -rf ' + str(pngdir), shell=True)
+def main(stimulus_dir: str,
+         file_pattern: str = "*.hdf5",
+         save_dir: str = None,
+         add_prefix: bool = False,
+         pass_mask: str = "_img",
+         overwrite: bool = False,
+         num_workers: Optional[int] = None):
 
-        if save_dir is not None:
-            save_nm = Path(save_dir).joinpath(Path(mp4name).name)
-            mv = subprocess.run('mv ' + mp4name + ' ' + str(save_nm), shell=True)
+    render_movies(stimulus_dirs=[stimulus_dir],
+                  passes=[pass_mask],
+                  file_pattern=file_pattern,
+                  save_dir=save_dir,
+                  add_prefix=add_prefix,
+                  overwrite=overwrite,
+                  num_workers=num_workers)
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--dir", type=str, help="The directory of HDF5s to create MP4s from")
+    parser.add_argument("--dir", type=str, nargs="+", help="The directories of HDF5s to create MP4s from")
     parser.add_argument("--save_dir", type=str, default=None, help="The directory where to save resulting MP4s")
     parser.add_argument("--files", type=str, default="*.hdf5", help="The pattern of files to rename")
+    parser.add_argument("--passes", type=str, default="_img", help="Comma-separated passes to make MP4s of")
     parser.add_argument("--add_prefix", action="store_true", help="Add the name of the dir as prefix to MP4s")
-    parser.add_argument("--height", type=int, default=256, help="Height of movies in pixels")
-    parser.add_argument("--width", type=int, default=256, help="Width of movies in pixels")
+    parser.add_argument("--overwrite", action="store_true", help="Re-render MP4s that are already up to date")
+    parser.add_argument("--framerate", type=int, default=30, help="Framerate of movies")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of worker processes; one per CPU by default")
 
     args = parser.parse_args()
-    main(stimulus_dir=args.dir,
-         file_pattern=args.files,
-         save_dir=args.save_dir,
-         add_prefix=args.add_prefix,
-         size=[args.height, args.width])
+    render_movies(stimulus_dirs=args.dir,
+                  passes=[p for p in args.passes.split(',') if len(p) > 0],
+                  file_pattern=args.files,
+                  save_dir=args.save_dir,
+                  add_prefix=args.add_prefix,
+                  overwrite=args.overwrite,
+                  framerate=args.framerate,
+                  num_workers=args.num_workers)
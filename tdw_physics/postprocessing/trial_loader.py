@@ -0,0 +1,253 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+import h5py
+import numpy as np
+from tdw_physics.image_cache import decode_image
+from tdw_physics.image_storage import DEPTH_PASSES, read_storage_policy, read_pass
+from tdw_physics.pass_schedule import get_frames_with_passes
+from tdw_physics.postprocessing.trial_reader import TrialReader
+
+
+class _OpenTrial:
+    """
+    An open trial file in a `TrialFilePool`.
+    """
+
+    def __init__(self, path: str):
+        self.reader = TrialReader(h5py.File(path, "r"))
+        self.policy = read_storage_policy(self.reader.file)
+        self.users = 0
+
+
+class TrialFilePool:
+    """
+    An LRU pool of open trial files, shared by the threads of a `TrialLoader`.
+
+    A file is opened on its first `acquire()` and stays open (with its `TrialReader`'s cached columns) until it's the
+    least recently used of more than `max_open` files. Files that a thread is still reading aren't closed.
+    """
+
+    def __init__(self, max_open: int = 32):
+        """
+        :param max_open: The most files to keep open.
+        """
+
+        self.max_open = max_open
+        self._files: "OrderedDict[str, _OpenTrial]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.opens = 0
+
+    def acquire(self, path: str) -> _OpenTrial:
+        """
+        :param path: The path to a trial file.
+
+        :return: The open trial. Call `release()` when done with it.
+        """
+
+        with self._lock:
+            trial = self._files.get(path)
+            if trial is None:
+                trial = _OpenTrial(path)
+                self._files[path] = trial
+                self.opens += 1
+            self._files.move_to_end(path)
+            trial.users += 1
+            self._evict()
+            return trial
+
+    def release(self, path: str) -> None:
+        with self._lock:
+            self._files[path].users -= 1
+            self._evict()
+
+    def _evict(self) -> None:
+        for path in list(self._files.keys()):
+            if len(self._files) <= self.max_open:
+                break
+            if self._files[path].users == 0:
+                self._files.pop(path).reader.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for trial in self._files.values():
+                trial.reader.close()
+            self._files.clear()
+
+
+class TrialLoader:
+    """
+    Load batches of frame windows from trial files for training.
+
+    The trials are indexed once into windows of `window` frames (`(trial, start_frame)`). If a trial was rendered with a
+    pass schedule, only the windows whose every frame has all of `passes` are indexed. Every epoch, the windows are
+    shuffled with a seed that only depends on `seed` and the epoch, and grouped into batches. Batches are loaded by a
+    pool of threads, up to `prefetch` batches ahead; each thread reads from an LRU pool of open files and decodes the
+    selected passes.
+
+    Each batch is a dictionary of numpy arrays (B is the batch size, W the window, N the most objects in the batch):
+
+    - `"trial"` `[B]` and `"start"` `[B]`: the index of the trial in `paths` and the first frame of each window.
+    - `"frames"` `[B, W]`: the frame numbers.
+    - `"images"`: `{pass: [B, W, H, W, C]}` for each pass in `passes`.
+    - `"objects"`: `{key: [B, W, N, ...]}` for each key in `objects`, e.g. "positions". Trials with fewer than N objects are padded with NaN.
+    - `"num_objects"` `[B]`.
+    - `"labels"`: `{key: [B, W, ...]}` for each key in `labels`, e.g. "trial_end".
+    """
+
+    def __init__(self, paths: List[str], passes: List[str] = ["_img"],
+                 objects: List[str] = ["positions", "velocities"], labels: List[str] = [],
+                 window: int = 1, frame_step: int = 1, window_step: int = 1, batch_size: int = 8,
+                 shuffle: bool = True, seed: int = 0, drop_last: bool = False,
+                 num_workers: int = 4, prefetch: int = 2, max_open_files: int = 32):
+        """
+        :param paths: The trial files.
+        :param passes: The image passes to load, e.g. `["_img", "_id"]`.
+        :param objects: The per-object datasets to load.
+        :param labels: The per-frame labels to load.
+        :param window: The number of frames in each window.
+        :param frame_step: The step between the frames of a window.
+        :param window_step: The step between the first frames of consecutive windows of a trial.
+        :param batch_size: The number of windows per batch.
+        :param shuffle: If True, shuffle the windows every epoch.
+        :param seed: The random seed of the shuffle.
+        :param drop_last: If True, drop the last batch of an epoch if it's smaller than `batch_size`.
+        :param num_workers: The number of loading threads.
+        :param prefetch: The number of batches to load ahead, per thread.
+        :param max_open_files: The most trial files to keep open.
+        """
+
+        self.paths = [str(p) for p in paths]
+        self.passes = passes
+        self.objects = objects
+        self.labels = labels
+        self.window = window
+        self.frame_step = frame_step
+        self.window_step = window_step
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.files = TrialFilePool(max_open_files)
+        self.epoch = 0
+        self.num_frames, self.windows = self._index()
+
+    def _index(self) -> Tuple[List[int], np.ndarray]:
+        span = (self.window - 1) * self.frame_step + 1
+        num_frames = []
+        windows = []
+        for i, path in enumerate(self.paths):
+            trial = self.files.acquire(path)
+            try:
+                n = trial.reader.num_frames
+                rendered = get_frames_with_passes(trial.reader.file, self.passes, n)
+            finally:
+                self.files.release(path)
+            num_frames.append(n)
+            for start in range(0, n - span + 1, self.window_step):
+                if rendered[start: start + span: self.frame_step].all():
+                    windows.append((i, start))
+        return num_frames, np.array(windows, dtype=int).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        """
+        :return: The number of batches per epoch.
+        """
+
+        if self.drop_last:
+            return len(self.windows) // self.batch_size
+        return -(-len(self.windows) // self.batch_size)
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        :param epoch: The epoch of the next iteration; it seeds the shuffle.
+        """
+
+        self.epoch = epoch
+
+    def get_order(self, epoch: Optional[int] = None) -> np.ndarray:
+        """
+        :param epoch: The epoch. If None, the current epoch.
+
+        :return: The order of the windows in the epoch.
+        """
+
+        if not self.shuffle:
+            return np.arange(len(self.windows))
+        return np.random.RandomState([self.seed, self.epoch if epoch is None else epoch]).permutation(len(self.windows))
+
+    def __iter__(self) -> Iterator[Dict[str, object]]:
+        order = self.get_order()
+        batches = [order[i: i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        self.epoch += 1
+        with ThreadPoolExecutor(self.num_workers) as pool:
+            pending = []
+            for batch in batches:
+                pending.append(pool.submit(self.load_batch, self.windows[batch]))
+                if len(pending) > self.num_workers * self.prefetch:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def load_window(self, trial_index: int, start: int) -> Dict[str, object]:
+        """
+        :param trial_index: The index of the trial in `paths`.
+        :param start: The first frame of the window.
+
+        :return: The window, as in a batch but without the batch dimension.
+        """
+
+        frames = np.arange(start, start + self.window * self.frame_step, self.frame_step)
+        path = self.paths[trial_index]
+        trial = self.files.acquire(path)
+        try:
+            reader = trial.reader
+            images = dict()
+            for pass_mask in self.passes:
+                if pass_mask in DEPTH_PASSES:
+                    images[pass_mask] = np.stack([read_pass(reader.file, reader.frame(fr)["images"][pass_mask][:],
+                                                            pass_mask, trial.policy) for fr in frames], 0)
+                else:
+                    images[pass_mask] = np.stack([decode_image(reader.frame(fr)["images"][pass_mask][:])
+                                                  for fr in frames], 0)
+            objects = {key: reader.objects(key)[frames] for key in self.objects}
+            labels = {key: reader.labels(key)[frames] for key in self.labels}
+            num_objects = len(reader.object_ids())
+        finally:
+            self.files.release(path)
+        return {"trial": trial_index, "start": start, "frames": frames, "images": images,
+                "objects": objects, "num_objects": num_objects, "labels": labels}
+
+    def load_batch(self, windows: np.ndarray) -> Dict[str, object]:
+        """
+        :param windows: The `(trial, start_frame)` of each window of the batch.
+
+        :return: The batch.
+        """
+
+        loaded = [self.load_window(int(i), int(start)) for i, start in windows]
+        num_objects = np.array([w["num_objects"] for w in loaded], dtype=int)
+        max_objects = int(num_objects.max()) if len(loaded) > 0 else 0
+        objects = dict()
+        for key in self.objects:
+            first = loaded[0]["objects"][key]
+            batch = np.full((len(loaded), self.window, max_objects) + first.shape[2:], np.nan,
+                            dtype=np.result_type(first.dtype, np.float32))
+            for b, w in enumerate(loaded):
+                batch[b, :, :w["objects"][key].shape[1]] = w["objects"][key]
+            objects[key] = batch
+        return {"trial": np.array([w["trial"] for w in loaded], dtype=int),
+                "start": np.array([w["start"] for w in loaded], dtype=int),
+                "frames": np.stack([w["frames"] for w in loaded], 0),
+                "images": {p: np.stack([w["images"][p] for w in loaded], 0) for p in self.passes},
+                "objects": objects,
+                "num_objects": num_objects,
+                "labels": {k: np.stack([w["labels"][k] for w in loaded], 0) for k in self.labels}}
+
+    def close(self) -> None:
+        self.files.close()
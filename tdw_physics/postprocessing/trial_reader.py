@@ -0,0 +1,211 @@
+from typing import Dict, List, Optional, Union
+import h5py
+import numpy as np
+from tdw_physics.columnar_layout import legacy_view, is_columnar, ColumnarTrial, OFFSETS_SUFFIX
+from tdw_physics.image_cache import DecodedImageCache, decode_image
+from tdw_physics.pass_schedule import get_pass_frames
+
+
+class TrialReader:
+    """
+    Read a trial file once for all of its label functions.
+
+    The sorted frame list, the `static` datasets and whole per-frame columns (`labels(key)`, `positions()`) are read
+    at most once and cached, so label functions don't re-list `frames` or re-read `static/object_ids` every call.
+    With the columnar layout, a column is a single read.
+
+    A `TrialReader` can be read like a legacy trial file (`d['static']['object_ids']`, `d['frames']['0000']`),
+    so label functions written for h5py files work unchanged.
+    """
+
+    def __init__(self, f: Union[h5py.File, ColumnarTrial], image_cache: Optional[DecodedImageCache] = None):
+        """
+        :param f: The trial file, in either layout.
+        :param image_cache: Decoded images of the trial. If None, images are decoded every time they're read.
+        """
+
+        self.file = f.file if isinstance(f, (ColumnarTrial, TrialReader)) else f
+        self.columnar = is_columnar(self.file)
+        self.image_cache = image_cache
+        self._d = legacy_view(self.file)
+        self._frames_grp = None
+        self._frames: Optional[List[str]] = None
+        self._static: Dict[str, Optional[np.ndarray]] = dict()
+        self._object_ids: Optional[List[int]] = None
+        self._labels: Dict[str, np.ndarray] = dict()
+        self._objects: Dict[str, np.ndarray] = dict()
+        self._pass_frames: Dict[str, Optional[np.ndarray]] = dict()
+
+    def __getitem__(self, key: str):
+        if key == "frames":
+            if self._frames_grp is None:
+                self._frames_grp = self._d["frames"]
+            return self._frames_grp
+        return self._d[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._d
+
+    def keys(self):
+        return self._d.keys()
+
+    @property
+    def attrs(self):
+        return self.file.attrs
+
+    def close(self) -> None:
+        self.file.close()
+
+    @property
+    def frames(self) -> List[str]:
+        """
+        :return: The sorted zero-padded frame numbers.
+        """
+
+        if self._frames is None:
+            self._frames = sorted(self["frames"].keys())
+        return self._frames
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.frames)
+
+    def frame(self, frame_num: int):
+        """
+        :param frame_num: The index of the frame in `frames`; negative numbers count from the last frame.
+
+        :return: The frame's group.
+        """
+
+        return self["frames"][self.frames[frame_num]]
+
+    def static(self, key: str) -> Optional[np.ndarray]:
+        """
+        :param key: The name of a dataset in the `static` group.
+
+        :return: The dataset, or None if there isn't one.
+        """
+
+        if key not in self._static:
+            try:
+                self._static[key] = np.array(self._d["static"][key])
+            except KeyError:
+                self._static[key] = None
+        return self._static[key]
+
+    def object_ids(self) -> List[int]:
+        """
+        :return: The IDs of the objects in the trial.
+        """
+
+        if self._object_ids is None:
+            self._object_ids = list(self._d["static"]["object_ids"])
+        return self._object_ids
+
+    def labels(self, key: str) -> np.ndarray:
+        """
+        :param key: The name of a per-frame label, e.g. "trial_end".
+
+        :return: The label of every frame, shape `[T, ...]`. Raises a KeyError if the trial doesn't have this label.
+        """
+
+        if key not in self._labels:
+            self._labels[key] = self._read_column("labels", key)
+        return self._labels[key]
+
+    def objects(self, key: str) -> np.ndarray:
+        """
+        :param key: The name of a per-object dataset in each frame's `objects` group, e.g. "velocities".
+
+        :return: The dataset of every frame, shape `[T, N, ...]`.
+        """
+
+        if key not in self._objects:
+            self._objects[key] = self._read_column("objects", key)
+        return self._objects[key]
+
+    def positions(self) -> np.ndarray:
+        """
+        :return: The positions of every object in every frame, shape `[T, N, 3]`.
+        """
+
+        return self.objects("positions")
+
+    def _read_column(self, group: str, key: str) -> np.ndarray:
+        if self.columnar:
+            return self.file["frames"][group][key][:]
+        frames_grp = self.file["frames"]
+        return np.stack([np.array(frames_grp[fr][group][key]) for fr in self.frames], 0)
+
+    def collisions(self, frame_num: int, env_collisions: bool = False):
+        """
+        :param frame_num: The index of the frame.
+        :param env_collisions: If True, return the environment collisions.
+
+        :return: The frame's `collisions` or `env_collisions` group.
+        """
+
+        return self.frame(frame_num)["collisions" if not env_collisions else "env_collisions"]
+
+    def num_collisions(self, cdata: str = "contacts", env_collisions: bool = False) -> np.ndarray:
+        """
+        :param cdata: The collision dataset to count the rows of, e.g. "contacts".
+        :param env_collisions: If True, count the environment collisions.
+
+        :return: The number of rows of the dataset in each frame, shape `[T]`. No collision data is read.
+        """
+
+        group = "collisions" if not env_collisions else "env_collisions"
+        if self.columnar:
+            return np.diff(self.file["frames"][group][cdata + OFFSETS_SUFFIX][:])
+        frames_grp = self.file["frames"]
+        return np.array([frames_grp[fr][group][cdata].shape[0] for fr in self.frames], dtype=int)
+
+    def pass_mask(self, frame_num: int = 0, img_key: str = "_img") -> np.ndarray:
+        """
+        :param frame_num: The index of the frame.
+        :param img_key: The pass, e.g. "_id".
+
+        :return: The decoded image. Raises a KeyError if the frame doesn't have the pass (e.g. with a pass schedule).
+        """
+
+        if img_key not in self._pass_frames:
+            self._pass_frames[img_key] = get_pass_frames(self.file, img_key)
+        pass_frames = self._pass_frames[img_key]
+        if pass_frames is not None and int(self.frames[frame_num]) not in pass_frames:
+            raise KeyError("Frame %s doesn't have %s" % (self.frames[frame_num], img_key))
+        load = lambda: self.frame(frame_num)["images"][img_key][:]
+        if self.image_cache is None:
+            return decode_image(load())
+        return self.image_cache.get(int(self.frames[frame_num]), img_key, load)
+
+    def seg_map(self, frame_num: int = 0) -> np.ndarray:
+        """
+        :param frame_num: The index of the frame.
+
+        :return: The `_id` pass of the frame, shape `[H, W, 3]`.
+        """
+
+        return self.pass_mask(frame_num, "_id")
+
+    def object_index(self, o_id: int) -> Optional[int]:
+        """
+        :param o_id: An object ID.
+
+        :return: The index of the object in `object_ids()`, or None if it isn't in the trial.
+        """
+
+        for i, oid in enumerate(self.object_ids()):
+            if oid == o_id:
+                return i
+        return None
+
+
+def as_trial_reader(d) -> TrialReader:
+    """
+    :param d: A trial file, or a `TrialReader`.
+
+    :return: `d` if it's already a `TrialReader`, otherwise a new one (that doesn't outlive the call).
+    """
+
+    return d if isinstance(d, TrialReader) else TrialReader(d)
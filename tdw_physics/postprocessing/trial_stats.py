@@ -0,0 +1,313 @@
+import os
+import pickle
+import multiprocessing
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import h5py
+import numpy as np
+from tqdm import tqdm
+from tdw_physics.postprocessing.trial_reader import TrialReader
+from tdw_physics.image_cache import DecodedImageCache
+
+# How many chunks of trials each worker gets, so that the workers stay busy until the end.
+CHUNKS_PER_WORKER = 4
+
+_NUMERIC = "numeric"
+_LIST = "list"
+_DICT = "dict"
+_STR = "str"
+_OTHER = "other"
+
+
+def _round_float(x, places=3):
+    return round(float(x), places)
+
+
+def _get_kind(value) -> str:
+    if isinstance(value, (bool, int, float)):
+        return _NUMERIC
+    elif isinstance(value, list):
+        return _LIST
+    elif isinstance(value, dict):
+        return _DICT
+    elif isinstance(value, str):
+        return _STR
+    return _OTHER
+
+
+def _nan_sum(value) -> Tuple[np.ndarray, np.ndarray]:
+    value = np.asarray(value, dtype=np.float64)
+    nan = np.isnan(value)
+    return np.where(nan, 0., value), (~nan).astype(np.int64)
+
+
+def _mean(total: np.ndarray, count: np.ndarray) -> np.ndarray:
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+class _LabelStat:
+    """
+    The partial aggregate of one label over some of the trials.
+    """
+
+    def __init__(self):
+        # The kind of the label is that of the first trial (the lowest trial index) with a value.
+        self.kind: Optional[str] = None
+        self.first = -1
+        self.valid = True
+        # Numbers and lists: the sum and count of the values that aren't NaN.
+        self.total: Optional[np.ndarray] = None
+        self.count: Optional[np.ndarray] = None
+        # Dicts: the same, per key, and the keys of the first dict.
+        self.keys: List[str] = []
+        self.totals: Dict[str, np.ndarray] = dict()
+        self.counts: Dict[str, np.ndarray] = dict()
+        # Strings: the first and last in sort order.
+        self.lo: Optional[str] = None
+        self.hi: Optional[str] = None
+
+    def add(self, value, index: int) -> None:
+        if value is None:
+            return
+        kind = _get_kind(value)
+        other = _LabelStat()
+        other.kind = kind
+        other.first = index
+        try:
+            if kind == _NUMERIC or kind == _LIST:
+                other.total, other.count = _nan_sum(value)
+            elif kind == _DICT:
+                other.keys = list(value.keys())
+                for k, v in value.items():
+                    other.totals[k], other.counts[k] = _nan_sum(v)
+            elif kind == _STR:
+                other.lo = other.hi = str(value)
+        except (TypeError, ValueError):
+            other.valid = False
+        self.merge(other)
+
+    def merge(self, other: "_LabelStat") -> None:
+        if other.kind is None:
+            return
+        if self.kind is None:
+            self.__dict__.update(other.__dict__)
+            return
+        self.valid = self.valid and other.valid and self.kind == other.kind
+        if other.first < self.first:
+            self.first = other.first
+            self.keys = other.keys
+        if not self.valid:
+            return
+        try:
+            if self.kind == _NUMERIC or self.kind == _LIST:
+                self.total = self.total + other.total
+                self.count = self.count + other.count
+            elif self.kind == _DICT:
+                for k in other.totals:
+                    if k in self.totals:
+                        self.totals[k] = self.totals[k] + other.totals[k]
+                        self.counts[k] = self.counts[k] + other.counts[k]
+                    else:
+                        self.totals[k] = other.totals[k]
+                        self.counts[k] = other.counts[k]
+            elif self.kind == _STR:
+                self.lo = min(self.lo, other.lo)
+                self.hi = max(self.hi, other.hi)
+        except ValueError:
+            # Lists of different lengths.
+            self.valid = False
+
+    def result(self):
+        if self.kind is None or not self.valid:
+            return None
+        if self.kind == _NUMERIC:
+            return _round_float(_mean(self.total, self.count))
+        elif self.kind == _LIST:
+            return list(map(_round_float, list(_mean(self.total, self.count))))
+        elif self.kind == _DICT:
+            return {k: _round_float(_mean(self.totals[k], self.counts[k])) for k in self.keys}
+        elif self.kind == _STR:
+            return self.lo if self.lo == self.hi else self.lo + '-' + self.hi
+        return None
+
+
+class LabelAggregator:
+    """
+    Streaming `avg_label()`: the across-trial mean of each label, without keeping every trial's labels in memory.
+
+    Each label's partial aggregate is a running sum and count of the values that aren't NaN (element-wise for lists
+    and dicts), or the first and last string in sort order. Partial aggregates merge associatively, so the trials can
+    be split across workers and merged in any order; memory is O(number of labels).
+
+    As with `avg_label()`, a None is a NaN, the kind of the label (number, list, dict or string) is that of the
+    first trial with a value, and the mean of a dict label is over the keys of the first trial's dict.
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, _LabelStat] = OrderedDict()
+
+    def add(self, key: str, value, index: int) -> None:
+        """
+        :param key: The name of the label.
+        :param value: The label of a trial.
+        :param index: The index of the trial.
+        """
+
+        if key not in self._stats:
+            self._stats[key] = _LabelStat()
+        self._stats[key].add(value, index)
+
+    def merge(self, other: "LabelAggregator") -> None:
+        """
+        :param other: The partial aggregate of other trials.
+        """
+
+        for key, stat in other._stats.items():
+            if key not in self._stats:
+                self._stats[key] = _LabelStat()
+            self._stats[key].merge(stat)
+
+    def result(self) -> Dict[str, object]:
+        """
+        :return: The mean of each label.
+        """
+
+        return OrderedDict((key, stat.result()) for key, stat in self._stats.items())
+
+
+class LabelCollector:
+    """
+    Collects the label of every trial, for aggregate functions other than `avg_label()`.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, List[Tuple[int, object]]] = OrderedDict()
+
+    def add(self, key: str, value, index: int) -> None:
+        if key not in self._values:
+            self._values[key] = []
+        self._values[key].append((index, value))
+
+    def merge(self, other: "LabelCollector") -> None:
+        for key, values in other._values.items():
+            if key not in self._values:
+                self._values[key] = []
+            self._values[key].extend(values)
+
+    def result(self) -> Dict[str, list]:
+        """
+        :return: The values of each label, in trial order.
+        """
+
+        return OrderedDict((key, [v for _, v in sorted(values, key=lambda iv: iv[0])])
+                           for key, values in self._values.items())
+
+
+_worker_state = None
+
+
+def _init_worker(state) -> None:
+    global _worker_state
+    _worker_state = state
+
+
+def _call_worker(task):
+    worker, item = task
+    return worker(_worker_state, item)
+
+
+def get_num_workers(num_workers: Optional[int], num_tasks: int) -> int:
+    """
+    :param num_workers: The requested number of worker processes. If None, one per CPU.
+    :param num_tasks: The number of tasks.
+
+    :return: The number of worker processes to start; 1 means the tasks run in this process.
+    """
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    # Daemon processes (e.g. the workers of a TrialScheduler) can't start their own.
+    if multiprocessing.current_process().daemon:
+        return 1
+    return max(1, min(num_workers, num_tasks))
+
+
+def run_in_pool(worker: Callable, items: List, state, num_workers: Optional[int] = None,
+                ordered: bool = False) -> Iterator:
+    """
+    Call `worker(state, item)` for each item in a pool of worker processes.
+
+    The workers are forked where possible, so `state` (e.g. label functions defined inside
+    `get_controller_label_funcs()`) doesn't need to be picklable; otherwise, if it can't be pickled,
+    the items are processed in this process.
+
+    :param worker: A module-level function.
+    :param items: The items.
+    :param state: Passed to every call of `worker`.
+    :param num_workers: The number of worker processes. If None, one per CPU. If 1, the items are processed in this process.
+    :param ordered: If True, yield the results in the order of `items`. Otherwise, as they finish.
+
+    :return: The result of each call.
+    """
+
+    num_workers = get_num_workers(num_workers, len(items))
+    ctx = None
+    if num_workers > 1:
+        if "fork" in multiprocessing.get_all_start_methods():
+            ctx = multiprocessing.get_context("fork")
+        else:
+            try:
+                pickle.dumps(state)
+                ctx = multiprocessing.get_context()
+            except (pickle.PicklingError, AttributeError, TypeError):
+                print("Can't send the label functions to worker processes; computing them in this process.")
+    if ctx is None:
+        for item in items:
+            yield worker(state, item)
+        return
+    with ctx.Pool(num_workers, initializer=_init_worker, initargs=(state,)) as pool:
+        tasks = [(worker, item) for item in items]
+        results = pool.imap(_call_worker, tasks) if ordered else pool.imap_unordered(_call_worker, tasks)
+        for result in results:
+            yield result
+
+
+def _trial_stats_worker(state, chunk: List[Tuple[int, str]]):
+    funcs, aggregator_class = state
+    aggregator = aggregator_class()
+    for index, path in chunk:
+        f = h5py.File(path, 'r')
+        d = TrialReader(f, image_cache=DecodedImageCache())
+        for func in funcs:
+            try:
+                aggregator.add(func.__name__, func(d), index)
+            except Exception as e:
+                print("Error occured during trials stats collection:", e)
+        f.close()
+    return aggregator, len(chunk)
+
+
+def get_trial_stats(paths: Iterable[str], funcs: List[Callable], aggregator_class=LabelAggregator,
+                    num_workers: Optional[int] = None):
+    """
+    Compute the label functions of each trial in a pool of worker processes, and aggregate them.
+    Each worker reads a chunk of the trials and returns a partial aggregate, which is merged as soon as it arrives.
+
+    :param paths: The paths to the trial files.
+    :param funcs: The label functions.
+    :param aggregator_class: `LabelAggregator` or `LabelCollector`.
+    :param num_workers: The number of worker processes. If None, one per CPU. If 1, the trials are read in this process.
+
+    :return: The aggregate of every trial's labels, keyed by the name of the label function.
+    """
+
+    paths = [(i, str(p)) for i, p in enumerate(paths)]
+    num_chunks = get_num_workers(num_workers, len(paths)) * CHUNKS_PER_WORKER
+    chunks = [paths[i::num_chunks] for i in range(num_chunks) if len(paths[i::num_chunks]) > 0]
+    total = aggregator_class()
+    pbar = tqdm(total=len(paths))
+    for aggregator, num in run_in_pool(_trial_stats_worker, chunks, (funcs, aggregator_class), num_workers):
+        total.merge(aggregator)
+        pbar.update(num)
+    pbar.close()
+    return total
@@ -0,0 +1,60 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+from tdw_physics.metadata_log import MetadataLog
+
+# Commands that turn image output off for the physics-only prescreen.
+PHYSICS_ONLY_COMMANDS = [{"$type": "set_pass_masks", "pass_masks": []},
+                         {"$type": "send_images", "frequency": "never"}]
+
+
+def get_commands_digest(commands: List[dict]) -> str:
+    """
+    :param commands: A list of commands, e.g. a trial's initialization commands.
+
+    :return: The md5 of the commands, to check that a re-simulated trial was initialized the same way.
+    """
+
+    return hashlib.md5(json.dumps(commands, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_prescreen_predicate(prescreen: Union[str, Callable[[dict], bool]]) -> Callable[[dict], bool]:
+    """
+    :param prescreen: A function of a trial's labels that returns True if the trial should be rendered, or a comma-separated list of labels that must all be true, e.g. "does_target_contact_zone".
+
+    :return: The acceptance predicate.
+    """
+
+    if callable(prescreen):
+        return prescreen
+    names = [name for name in prescreen.split(",") if len(name) > 0]
+
+    def accept(labels: dict) -> bool:
+        return all(bool(labels.get(name)) for name in names)
+
+    return accept
+
+
+class PrescreenLog(MetadataLog):
+    """
+    The results of the physics-only prescreen of a run (`prescreen/prescreen.jsonl`), one appended line per trial:
+    `{"trial": <trial number>, "meta": {"accepted": ..., "init_commands": <digest>, "labels": ...}}`.
+    """
+
+    def results(self) -> Dict[int, dict]:
+        """
+        :return: The last result of each trial that was prescreened, keyed by trial number.
+        """
+
+        return {record["trial"]: record["meta"] for record in self.read()}
+
+    @staticmethod
+    def get_path(output_dir: Union[str, Path]) -> Path:
+        """
+        :param output_dir: The output directory of the run.
+
+        :return: The path to the prescreen log.
+        """
+
+        return Path(output_dir).joinpath("prescreen", "prescreen.jsonl")
@@ -0,0 +1,177 @@
+from pathlib import Path
+from typing import List, Dict, Optional, Union
+import h5py
+import numpy as np
+from tdw.tdw_utils import TDWUtils
+
+# Each recorded response is a vlen dataset with one uint8 array per element of `resp`.
+RESPONSE_DTYPE = h5py.vlen_dtype(np.dtype('uint8'))
+# Responses are recorded in this subdirectory of the output directory, so that they aren't mistaken for trials.
+RESPONSES_DIR = "responses"
+
+
+def get_responses_path(output_dir: Union[str, Path]) -> Path:
+    """
+    :param output_dir: The output directory of a run.
+
+    :return: The path to the recorded responses of the run.
+    """
+
+    return Path(output_dir).joinpath(RESPONSES_DIR, "tdw_responses.hdf5")
+
+
+class ReplayError(Exception):
+    """
+    Raised when a replayed trial asks for a response that wasn't recorded.
+    """
+
+    pass
+
+
+class ResponseRecorder:
+    """
+    Record the exact responses the build sent during each trial, so that they can be replayed without a build.
+
+    Responses are written to `responses/tdw_responses.hdf5` in the output directory (not next to the trial files, so
+    that nothing that globs `*.hdf5` reads it as a trial): one group per trial, one dataset per message:
+
+    ```
+    responses/tdw_responses.hdf5
+    ....0000/          # trial 0
+    ........0000       # the response to the trial initialization commands
+    ........0001       # the response to the commands of frame 1
+    ........
+    ....0001/          # trial 1
+    ```
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        :param path: The path to the hdf5 file.
+        """
+
+        self.path = Path(path)
+        self._file: Optional[h5py.File] = None
+        self._trial_grp: Optional[h5py.Group] = None
+
+    def start_trial(self, trial_num: int) -> None:
+        """
+        Start recording a trial. If this trial was already recorded, its responses are replaced.
+
+        :param trial_num: The number of the trial.
+        """
+
+        if self._file is None:
+            if not self.path.parent.exists():
+                self.path.parent.mkdir(parents=True)
+            self._file = h5py.File(str(self.path.resolve()), "a")
+        key = TDWUtils.zero_padding(trial_num, 4)
+        if key in self._file:
+            del self._file[key]
+        self._trial_grp = self._file.create_group(key)
+
+    def record(self, resp: List[bytes]) -> None:
+        """
+        Record the next response of the current trial.
+
+        :param resp: The response from the build.
+        """
+
+        data = np.empty(len(resp), dtype=object)
+        for i, r in enumerate(resp):
+            data[i] = np.frombuffer(r, dtype=np.uint8)
+        self._trial_grp.create_dataset(TDWUtils.zero_padding(len(self._trial_grp), 4), data=data, dtype=RESPONSE_DTYPE)
+
+    def end_trial(self) -> None:
+        """
+        Stop recording the current trial and flush it to disk.
+        """
+
+        self._trial_grp = None
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ResponseReplayer:
+    """
+    Serve recorded responses back, in the order they were recorded, trial by trial.
+
+    Responses recorded by the workers of a `TrialScheduler` are in sibling files (`tdw_responses_worker1.hdf5`, etc.);
+    these are read as well, so a trial is replayed whichever worker recorded it.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        :param path: The path to the hdf5 file, or the dataset directory that contains `responses/tdw_responses.hdf5` (or, from older runs, `tdw_responses.hdf5`).
+        """
+
+        path = Path(path)
+        if path.is_dir():
+            legacy_path = path.joinpath("tdw_responses.hdf5")
+            path = get_responses_path(path)
+            if not path.exists() and legacy_path.exists():
+                path = legacy_path
+        if not path.exists():
+            raise FileNotFoundError("No recorded responses at %s" % path)
+        self.path = path
+        paths = [path] + sorted(path.parent.glob(path.stem + "_worker*" + path.suffix))
+
+        # Open every file and map each trial to the file it's in.
+        self._files: List[h5py.File] = [h5py.File(str(p.resolve()), "r") for p in paths]
+        self._trials: Dict[str, h5py.Group] = dict()
+        for f in self._files:
+            for key in f.keys():
+                self._trials[key] = f[key]
+
+        self._trial_grp: Optional[h5py.Group] = None
+        self._trial_num: Optional[int] = None
+        self._index = 0
+
+    @property
+    def trials(self) -> List[int]:
+        """
+        :return: The numbers of the recorded trials.
+        """
+
+        return sorted(int(key) for key in self._trials.keys())
+
+    def start_trial(self, trial_num: int) -> None:
+        """
+        Start replaying a trial from its first response.
+
+        :param trial_num: The number of the trial.
+        """
+
+        key = TDWUtils.zero_padding(trial_num, 4)
+        if key not in self._trials:
+            raise ReplayError("Trial %d wasn't recorded" % trial_num)
+        self._trial_grp = self._trials[key]
+        self._trial_num = trial_num
+        self._index = 0
+
+    def next(self) -> List[bytes]:
+        """
+        :return: The next recorded response of the current trial.
+        """
+
+        key = TDWUtils.zero_padding(self._index, 4)
+        if key not in self._trial_grp:
+            raise ReplayError("Trial %d only has %d recorded responses; "
+                              "the controller isn't sending the same commands as when it was recorded" %
+                              (self._trial_num, self._index))
+        self._index += 1
+        return [r.tobytes() for r in self._trial_grp[key][()]]
+
+    def end_trial(self) -> None:
+        self._trial_grp = None
+        self._trial_num = None
+
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+        self._files = []
@@ -6,10 +6,10 @@ import numpy as np
 import pkg_resources
 import io
 import json
-from tdw.output_data import OutputData, Rigidbodies, Collision, EnvironmentCollision
 from tdw.librarian import ModelRecord
 from tdw.tdw_utils import TDWUtils
 from tdw_physics.transforms_dataset import TransformsDataset
+from tdw_physics.frame_response import FrameResponse, ObjectArrays
 from tdw_physics.util import MODEL_LIBRARIES, str_to_xyz, xyz_to_arr, arr_to_xyz
 
 
@@ -55,25 +55,41 @@ class PhysicsInfo:
     """
 
     def __init__(self,
-                 record: ModelRecord,
+                 record: Optional[ModelRecord],
                  mass: float,
                  dynamic_friction: float,
                  static_friction: float,
-                 bounciness: float):
+                 bounciness: float,
+                 library: Optional[str] = None,
+                 name: Optional[str] = None):
         """
-        :param record: The model's metadata record.
+        :param record: The model's metadata record. If None, it's read from `library` the first time it's used.
         :param mass: The mass of the object.
         :param dynamic_friction: The dynamic friction.
         :param static_friction: The static friction.
         :param bounciness: The object's bounciness.
+        :param library: The model library of the record, if `record` is None.
+        :param name: The name of the model, if `record` is None.
         """
 
-        self.record = record
+        self._record = record
+        self.library = library
+        self.name = name if record is None else record.name
         self.mass = mass
         self.dynamic_friction = dynamic_friction
         self.static_friction = static_friction
         self.bounciness = bounciness
 
+    @property
+    def record(self) -> ModelRecord:
+        if self._record is None:
+            self._record = MODEL_LIBRARIES[self.library].get_record(self.name)
+        return self._record
+
+    @record.setter
+    def record(self, record: ModelRecord) -> None:
+        self._record = record
+
 
 def _get_default_physics_info() -> Dict[str, PhysicsInfo]:
     """
@@ -86,11 +102,13 @@ def _get_default_physics_info() -> Dict[str, PhysicsInfo]:
         _data = json.load(f)
         for key in _data:
             obj = _data[key]
-            info[key] = PhysicsInfo(record=MODEL_LIBRARIES[obj["library"]].get_record(obj["name"]),
+            info[key] = PhysicsInfo(record=None,
                                     mass=obj["mass"],
                                     bounciness=obj["bounciness"],
                                     dynamic_friction=obj["dynamic_friction"],
-                                    static_friction=obj["static_friction"])
+                                    static_friction=obj["static_friction"],
+                                    library=obj["library"],
+                                    name=obj["name"])
     return info
 
 
@@ -565,119 +583,86 @@ class RigidbodiesDataset(TransformsDataset, ABC):
                 mesh_group.create_dataset(f"faces_{idx}", data=faces)
                 mesh_group.create_dataset(f"vertices_{idx}", data=vertices)
 
-    def _write_frame(self, frames_grp: h5py.Group, resp: List[bytes], frame_num: int) -> \
-            Tuple[h5py.Group, h5py.Group, dict, bool]:
+    def _write_frame(self, frames_grp: h5py.Group, resp: FrameResponse, frame_num: int) -> \
+            Tuple[h5py.Group, h5py.Group, ObjectArrays, bool]:
         frame, objs, tr, done = super()._write_frame(
             frames_grp=frames_grp, resp=resp, frame_num=frame_num)
         num_objects = len(self.object_ids)
         # Physics data.
         velocities = np.empty(dtype=np.float32, shape=(num_objects, 3))
         angular_velocities = np.empty(dtype=np.float32, shape=(num_objects, 3))
-        # Collision data.
-        collision_ids = np.empty(dtype=np.int32, shape=(0, 2))
-        collision_relative_velocities = np.empty(
-            dtype=np.float32, shape=(0, 3))
-        collision_contacts = np.empty(dtype=np.float32, shape=(0, 2, 3))
-        collision_states = np.empty(dtype=str, shape=(0, 1))
-        # Environment Collision data.
-        env_collision_ids = np.empty(dtype=np.int32, shape=(0, 1))
-        env_collision_contacts = np.empty(dtype=np.float32, shape=(0, 2, 3))
 
         sleeping = True
 
-        # rtypes = [OutputData.get_data_type_id(r) for r in resp[:-1]]
-        # print(frame_num, "COLLISION" if 'coll' in rtypes else "")
-
-        for r in resp[:-1]:
-            r_id = OutputData.get_data_type_id(r)
-            if r_id == "rigi":
-                ri = Rigidbodies(r)
-                ri_dict = dict()
-                for i in range(ri.get_num()):
-                    ri_dict.update({ri.get_id(i): {"vel": ri.get_velocity(i),
-                                                   "ang": ri.get_angular_velocity(i)}})
-                    # Check if any objects are sleeping that aren't in the abyss.
-                    if not ri.get_sleeping(i) and tr[ri.get_id(i)]["pos"][1] >= -1:
-                        sleeping = False
-                # Add the Rigibodies data.
-                for o_id, i in zip(self.object_ids, range(num_objects)):
-                    try:
-                        velocities[i] = ri_dict[o_id]["vel"]
-                        angular_velocities[i] = ri_dict[o_id]["ang"]
-                    except KeyError:
-                        print("Couldn't store velocity data for object %d" % o_id)
-                        print("frame num", frame_num)
-                        print("ri_dict", ri_dict)
-                        print([OutputData.get_data_type_id(r) for r in resp])
-            elif r_id == "coll":
-                co = Collision(r)
-                collision_states = np.append(collision_states, co.get_state())
-                collision_ids = np.append(
-                    collision_ids, [co.get_collider_id(), co.get_collidee_id()])
-                collision_relative_velocities = np.append(
-                    collision_relative_velocities, co.get_relative_velocity())
-                for i in range(co.get_num_contacts()):
-                    collision_contacts = np.append(collision_contacts, (co.get_contact_normal(i),
-                                                                        co.get_contact_point(i)))
-            elif r_id == "enco":
-                en = EnvironmentCollision(r)
-                env_collision_ids = np.append(
-                    env_collision_ids, en.get_object_id())
-                for i in range(en.get_num_contacts()):
-                    env_collision_contacts = np.append(env_collision_contacts, (en.get_contact_normal(i),
-                                                                                en.get_contact_point(i)))
+        if resp.has("rigi"):
+            ri = resp.rigidbodies
+            # Check if any objects are sleeping that aren't in the abyss.
+            rows = tr.get_rows(ri.ids[~ri["sleeping"]])
+            rows = rows[rows >= 0]
+            if np.any(tr["positions"][rows, 1] >= -1):
+                sleeping = False
+            # Add the Rigibodies data.
+            object_index = self.get_object_index()
+            ri.scatter(object_index, "velocities", velocities)
+            copied = ri.scatter(object_index, "angular_velocities", angular_velocities)
+            for o_id in np.asarray(self.object_ids)[~copied]:
+                print("Couldn't store velocity data for object %d" % o_id)
+                print("frame num", frame_num)
+                print("rigidbody ids", ri.ids)
+                print(resp.r_ids)
+
+        # Collision data.
+        co = resp.collisions
+        en = resp.env_collisions
+
         objs.create_dataset("velocities", data=velocities.reshape(
             num_objects, 3), compression="gzip")
         objs.create_dataset("angular_velocities", data=angular_velocities.reshape(
             num_objects, 3), compression="gzip")
         collisions = frame.create_group("collisions")
         collisions.create_dataset(
-            "object_ids", data=collision_ids.reshape((-1, 2)), compression="gzip")
-        collisions.create_dataset("relative_velocities", data=collision_relative_velocities.reshape((-1, 3)),
+            "object_ids", data=co.ids, compression="gzip")
+        collisions.create_dataset("relative_velocities", data=co.relative_velocities,
                                   compression="gzip")
         collisions.create_dataset(
-            "contacts", data=collision_contacts.reshape((-1, 2, 3)), compression="gzip")
+            "contacts", data=co.contacts, compression="gzip")
         collisions.create_dataset(
-            "states", data=collision_states.astype('S'), compression="gzip")
+            "states", data=co.states.astype('S'), compression="gzip")
         env_collisions = frame.create_group("env_collisions")
         env_collisions.create_dataset(
-            "object_ids", data=env_collision_ids, compression="gzip")
-        env_collisions.create_dataset("contacts", data=env_collision_contacts.reshape((-1, 2, 3)),
+            "object_ids", data=en.ids, compression="gzip")
+        env_collisions.create_dataset("contacts", data=en.contacts,
                                       compression="gzip")
         return frame, objs, tr, sleeping
 
-    def _get_collision_data(self, resp: List[bytes]):
+    def _get_collision_data(self, resp: FrameResponse):
 
         coll_data = None
-        r_ids = [OutputData.get_data_type_id(r) for r in resp[:-1]]
-        for i, r_id in enumerate(r_ids):
-            if r_id == 'coll':
-                co = Collision(resp[i])
-                state = co.get_state()
-                if state != 'enter':
-                    break
-                agent_id = co.get_collider_id()
-                patient_id = co.get_collidee_id()
-                relative_velocity = co.get_relative_velocity()
-                num_contacts = co.get_num_contacts()
-                contact_points = [co.get_contact_point(i)
-                                  for i in range(num_contacts)]
-                contact_normals = [co.get_contact_normal(i)
-                                   for i in range(num_contacts)]
-
-                coll_data = {
-                    'agent_id': agent_id,
-                    'patient_id': patient_id,
-                    'relative_velocity': relative_velocity,
-                    'num_contacts': num_contacts,
-                    'contact_points': contact_points,
-                    'contact_normals': contact_normals
-                }
-                if self.PRINT:
-                    print("agent: %d ---> patient %d" % (agent_id, patient_id))
-                    print("relative velocity", relative_velocity)
-                    print("contact points", contact_points)
-                    print("contact normals", contact_normals)
+        co = resp.collisions
+        for i in range(len(co)):
+            state = co.states[i]
+            if state != 'enter':
+                break
+            agent_id, patient_id = [int(o_id) for o_id in co.ids[i]]
+            relative_velocity = co.relative_velocities[i]
+            contacts = co.get_contacts(i)
+            num_contacts = len(contacts)
+            contact_points = list(contacts[:, 1])
+            contact_normals = list(contacts[:, 0])
+
+            coll_data = {
+                'agent_id': agent_id,
+                'patient_id': patient_id,
+                'relative_velocity': relative_velocity,
+                'num_contacts': num_contacts,
+                'contact_points': contact_points,
+                'contact_normals': contact_normals
+            }
+            if self.PRINT:
+                print("agent: %d ---> patient %d" % (agent_id, patient_id))
+                print("relative velocity", relative_velocity)
+                print("contact points", contact_points)
+                print("contact normals", contact_normals)
 
         return coll_data
 
@@ -696,37 +681,31 @@ class RigidbodiesDataset(TransformsDataset, ABC):
         ]
         return cmds
 
-    def get_object_target_collision(self, obj_id: int, target_id: int, resp: List[bytes]):
+    def get_object_target_collision(self, obj_id: int, target_id: int, resp: FrameResponse):
 
         contact_points = []
         contact_normals = []
 
-        for r in resp[:-1]:
-            r_id = OutputData.get_data_type_id(r)
-            if r_id == "coll":
-                co = Collision(r)
-                coll_ids = [co.get_collider_id(), co.get_collidee_id()]
-                if [obj_id, target_id] == coll_ids or [target_id, obj_id] == coll_ids:
-                    contact_points = [co.get_contact_point(
-                        i) for i in range(co.get_num_contacts())]
-                    contact_normals = [co.get_contact_normal(
-                        i) for i in range(co.get_num_contacts())]
+        co = resp.collisions
+        for i in range(len(co)):
+            coll_ids = [int(o_id) for o_id in co.ids[i]]
+            if [obj_id, target_id] == coll_ids or [target_id, obj_id] == coll_ids:
+                contacts = co.get_contacts(i)
+                contact_points = list(contacts[:, 1])
+                contact_normals = list(contacts[:, 0])
 
         return (contact_points, contact_normals)
 
-    def get_object_environment_collision(self, obj_id: int, resp: List[bytes]):
+    def get_object_environment_collision(self, obj_id: int, resp: FrameResponse):
 
         contact_points = []
         contact_normals = []
 
-        for r in resp[:-1]:
-            r_id = OutputData.get_data_type_id(r)
-            if r_id == 'enco':
-                en = EnvironmentCollision(r)
-                if en.get_object_id() == obj_id:
-                    contact_points = [np.array(en.get_contact_point(
-                        i)) for i in range(en.get_num_contacts())]
-                    contact_normals = [np.array(en.get_contact_normal(
-                        i)) for i in range(en.get_num_contacts())]
+        en = resp.env_collisions
+        for i in range(len(en)):
+            if en.ids[i] == obj_id:
+                contacts = en.get_contacts(i)
+                contact_points = list(contacts[:, 1])
+                contact_normals = list(contacts[:, 0])
 
         return (contact_points, contact_normals)
@@ -0,0 +1,164 @@
+import csv
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Optional
+
+
+class _NullStage:
+    # `contextlib.nullcontext` needs Python 3.7.
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+# Returned by a disabled timer, so that timing costs nothing when it's off.
+_NULL_CONTEXT = _NullStage()
+
+
+class _Stage:
+    def __init__(self, timer: "StageTimer", name: str):
+        self.timer = timer
+        self.name = name
+        self.start = 0.
+        self.children = 0.
+
+    def __enter__(self):
+        self.timer._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        self.timer._stack.pop()
+        # Stages are exclusive: time spent in a nested stage isn't counted twice.
+        self.timer._add(self.name, elapsed - self.children)
+        if len(self.timer._stack) > 0:
+            self.timer._stack[-1].children += elapsed
+        return False
+
+
+class StageTimer:
+    """
+    Low-overhead timers around the stages of a trial (`communicate`, parsing the response, writing frames, etc.).
+
+    ```python
+    with timer.time("communicate"):
+        resp = self.communicate(commands)
+    ```
+
+    Nested stages are exclusive, so the stages of a trial add up to (at most) its wall time; the rest is "other".
+    Times are summed per trial and per run, and written to `timing.json` and `timing.csv`.
+    """
+
+    def __init__(self, enabled: bool = True):
+        """
+        :param enabled: If False, `time()` does nothing.
+        """
+
+        self.enabled = enabled
+        self.trials: List[dict] = []
+        self._stack: List[_Stage] = []
+        self._stages: Dict[str, List[float]] = OrderedDict()
+        self._trial_start: Optional[float] = None
+
+    def time(self, stage: str):
+        """
+        :param stage: The name of the stage.
+
+        :return: A context manager that times the stage.
+        """
+
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Stage(self, stage)
+
+    def _add(self, stage: str, seconds: float) -> None:
+        if stage not in self._stages:
+            self._stages[stage] = [0., 0]
+        self._stages[stage][0] += seconds
+        self._stages[stage][1] += 1
+
+    def start_trial(self) -> None:
+        """
+        Start timing a trial. Stages timed outside of a trial (e.g. scene initialization) aren't counted.
+        """
+
+        if self.enabled:
+            self._stages = OrderedDict()
+            self._trial_start = time.perf_counter()
+
+    def end_trial(self, trial_num: int) -> Optional[dict]:
+        """
+        Stop timing a trial.
+
+        :param trial_num: The number of the trial.
+
+        :return: The trial's record: its wall time and the total time and count of each stage.
+        """
+
+        if not self.enabled or self._trial_start is None:
+            return None
+        record = {"trial": trial_num,
+                  "total_seconds": time.perf_counter() - self._trial_start,
+                  "stages": {stage: {"seconds": seconds, "count": count}
+                             for stage, (seconds, count) in self._stages.items()}}
+        self.add_trial(record)
+        self._stages = OrderedDict()
+        self._trial_start = None
+        return record
+
+    def add_trial(self, record: dict) -> None:
+        """
+        :param record: A trial's record from `end_trial()`, e.g. from another process.
+        """
+
+        self.trials.append(record)
+
+    def get_summary(self) -> dict:
+        """
+        :return: The total, per-trial mean and fraction of the wall time of each stage, across all trials.
+        """
+
+        total = sum(t["total_seconds"] for t in self.trials)
+        stages = OrderedDict()
+        for t in self.trials:
+            for stage, s in t["stages"].items():
+                if stage not in stages:
+                    stages[stage] = {"seconds": 0., "count": 0}
+                stages[stage]["seconds"] += s["seconds"]
+                stages[stage]["count"] += s["count"]
+        stages["other"] = {"seconds": max(0., total - sum(s["seconds"] for s in stages.values())), "count": 0}
+        num_trials = len(self.trials)
+        for s in stages.values():
+            s["mean_seconds_per_trial"] = s["seconds"] / num_trials if num_trials else 0.
+            s["fraction"] = s["seconds"] / total if total > 0 else 0.
+        return {"num_trials": num_trials,
+                "total_seconds": total,
+                "stages": stages}
+
+    def write(self, output_dir: str) -> None:
+        """
+        Write the run summary and per-trial records to `timing.json`, and one row per trial to `timing.csv`.
+
+        :param output_dir: The dataset's output directory.
+        """
+
+        if not self.enabled:
+            return
+        output_dir = Path(output_dir)
+        trials = sorted(self.trials, key=lambda t: t["trial"])
+        summary = self.get_summary()
+        summary["trials"] = trials
+        output_dir.joinpath("timing.json").write_text(json.dumps(summary, indent=4), encoding='utf-8')
+
+        stages = [stage for stage in summary["stages"].keys() if stage != "other"]
+        with open(str(output_dir.joinpath("timing.csv")), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["trial", "total_seconds"] + stages)
+            for t in trials:
+                writer.writerow([t["trial"], t["total_seconds"]] +
+                                [t["stages"][stage]["seconds"] if stage in t["stages"] else 0. for stage in stages])
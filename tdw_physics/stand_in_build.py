@@ -0,0 +1,78 @@
+import sys
+import json
+import struct
+import argparse
+from subprocess import Popen
+from typing import List, Union
+import zmq
+
+
+class StandInBuild:
+    """
+    A local stand-in for the TDW build. It speaks the build's side of the socket protocol but doesn't render or
+    simulate anything: every message is answered with a response that only has the frame count.
+
+    This lets controllers, the trial loop and the trial scheduler run on a CPU-only machine without a display.
+    Override `respond()` to send back output data.
+    """
+
+    def __init__(self, port: int = 1071, address: str = "localhost"):
+        """
+        :param port: The port the controller is bound to.
+        :param address: The address of the controller.
+        """
+
+        self.port = port
+        self.address = address
+        self.frame = 0
+
+    def respond(self, commands: List[dict]) -> List[bytes]:
+        """
+        :param commands: The commands sent by the controller.
+
+        :return: The output data, not including the frame count.
+        """
+
+        return []
+
+    def run(self) -> None:
+        """
+        Connect to the controller and answer its messages until it sends `terminate`.
+        """
+
+        context = zmq.Context()
+        socket = context.socket(zmq.REQ)
+        socket.connect("tcp://%s:%d" % (self.address, self.port))
+        # The controller waits for the build to say hello before it sends any commands.
+        socket.send(b"0")
+        while True:
+            commands: Union[dict, List[dict]] = json.loads(socket.recv_multipart()[0])
+            if isinstance(commands, dict):
+                commands = [commands]
+            resp = self.respond(commands)
+            socket.send_multipart(resp + [struct.pack("<i", self.frame)])
+            self.frame += 1
+            if any(c.get("$type") == "terminate" for c in commands):
+                break
+        socket.close(linger=1000)
+        context.term()
+
+
+def launch_stand_in_build(port: int = 1071) -> Popen:
+    """
+    Launch a stand-in build in its own process, the way `Controller.launch_build()` launches a real build.
+
+    :param port: The port the controller is bound to.
+
+    :return: The stand-in build process.
+    """
+
+    return Popen([sys.executable, "-m", "tdw_physics.stand_in_build", "--port", str(port)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=1071, help="The port the controller is bound to")
+    parser.add_argument("--address", type=str, default="localhost", help="The address of the controller")
+    args = parser.parse_args()
+    StandInBuild(port=args.port, address=args.address).run()
@@ -10,21 +10,20 @@ from typing import List, Dict, Tuple
 from weighted_collection import WeightedCollection
 from tdw.tdw_utils import TDWUtils
 from tdw.librarian import ModelRecord, MaterialLibrarian
+from tdw_physics.library_index import LIBRARY_INDEX
 from tdw.output_data import OutputData, Transforms
 from tdw_physics.rigidbodies_dataset import (RigidbodiesDataset,
                                              get_random_xyz_transform,
                                              get_range,
                                              handle_random_transform_args)
-from tdw_physics.util import MODEL_LIBRARIES, get_parser, xyz_to_arr, arr_to_xyz, str_to_xyz
+from tdw_physics.util import MODEL_LIBRARIES, get_model_names, get_parser, xyz_to_arr, arr_to_xyz, str_to_xyz
 
 from tdw_physics.target_controllers.dominoes import Dominoes, MultiDominoes, get_args, none_or_str, none_or_int
 from tdw_physics.postprocessing.labels import is_trial_valid
 
-MODEL_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records]
-M = MaterialLibrarian()
-MATERIAL_TYPES = M.get_material_types()
-MATERIAL_NAMES = {mtype: [m.name for m in M.get_all_materials_of_type(mtype)] \
-                  for mtype in MATERIAL_TYPES}
+MODEL_NAMES = get_model_names('models_flex.json')
+MATERIAL_NAMES = LIBRARY_INDEX.get_material_names()
+MATERIAL_TYPES = list(MATERIAL_NAMES.keys())
 
 OCCLUDER_CATS = "coffee table,houseplant,vase,chair,dog,sofa,flowerpot,coffee maker,stool,laptop,laptop computer,globe,bookshelf,desktop computer,garden plant,garden plant,garden plant"
 DISTRACTOR_CATS = "coffee table,houseplant,vase,chair,dog,sofa,flowerpot,coffee maker,stool,laptop,laptop computer,globe,bookshelf,desktop computer,garden plant,garden plant,garden plant"
@@ -489,6 +488,21 @@ if __name__ == "__main__":
                  save_movies=args.save_movies,
                  save_labels=args.save_labels,
                  save_meshes=args.save_meshes,
+                 pipeline_writes=args.pipeline_writes,
+                 write_queue_size=args.write_queue_size,
+                 num_workers=args.num_workers,
+                 worker_ports=args.worker_ports,
+                 record_responses=args.record_responses,
+                 replay_responses=args.replay_responses,
+                 save_timing=args.save_timing,
+                 hdf5_layout=args.hdf5_layout,
+                 image_storage=args.image_storage,
+                 stats_workers=args.stats_workers,
+                 prescreen=args.prescreen,
+                 balance=args.balance,
+                 balance_strata=args.balance_strata,
+                 pass_schedule=args.pass_schedule,
+                 pipeline_commands=args.pipeline_commands,
                  write_passes=args.write_passes,
                  args_dict=vars(args)
         )
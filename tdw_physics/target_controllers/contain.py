@@ -11,12 +11,13 @@ from typing import List, Dict, Tuple
 from weighted_collection import WeightedCollection
 from tdw.tdw_utils import TDWUtils
 from tdw.librarian import ModelRecord, MaterialLibrarian
+from tdw_physics.library_index import LIBRARY_INDEX
 from tdw.output_data import OutputData, Transforms
 from tdw_physics.rigidbodies_dataset import (RigidbodiesDataset,
                                              get_random_xyz_transform,
                                              get_range,
                                              handle_random_transform_args)
-from tdw_physics.util import (MODEL_LIBRARIES,
+from tdw_physics.util import (MODEL_LIBRARIES, get_model_names,
                               get_parser,
                               xyz_to_arr, arr_to_xyz, str_to_xyz,
                               none_or_str, none_or_int, int_or_bool)
@@ -25,11 +26,9 @@ from tdw_physics.target_controllers.dominoes import Dominoes, MultiDominoes
 from tdw_physics.target_controllers.support import Tower, get_tower_args
 from tdw_physics.postprocessing.labels import is_trial_valid
 
-MODEL_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records]
-M = MaterialLibrarian()
-MATERIAL_TYPES = M.get_material_types()
-MATERIAL_NAMES = {mtype: [m.name for m in M.get_all_materials_of_type(mtype)] \
-                  for mtype in MATERIAL_TYPES}
+MODEL_NAMES = get_model_names('models_flex.json')
+MATERIAL_NAMES = LIBRARY_INDEX.get_material_names()
+MATERIAL_TYPES = list(MATERIAL_NAMES.keys())
 
 
 '''
@@ -354,6 +353,9 @@ class Containment(Tower):
 
         return cmds
 
+    def is_response_independent(self, frame: int) -> bool:
+        return Dominoes.is_response_independent(self, frame)
+
     def _build_intermediate_structure(self) -> List[dict]:
         if self.randomize_colors_across_trials:
             self.middle_color = self.random_color(exclude=self.target_color) if self.monochrome else None
@@ -707,6 +709,21 @@ if __name__ == "__main__":
                save_movies=args.save_movies,
                save_labels=args.save_labels,
                save_meshes=args.save_meshes,
+               pipeline_writes=args.pipeline_writes,
+               write_queue_size=args.write_queue_size,
+               num_workers=args.num_workers,
+               worker_ports=args.worker_ports,
+               record_responses=args.record_responses,
+               replay_responses=args.replay_responses,
+               save_timing=args.save_timing,
+               hdf5_layout=args.hdf5_layout,
+               image_storage=args.image_storage,
+               stats_workers=args.stats_workers,
+               prescreen=args.prescreen,
+               balance=args.balance,
+               balance_strata=args.balance_strata,
+               pass_schedule=args.pass_schedule,
+               pipeline_commands=args.pipeline_commands,
                args_dict=vars(args)
         )
     else:
@@ -13,20 +13,22 @@ from weighted_collection import WeightedCollection
 from tdw.tdw_utils import TDWUtils
 from tdw.librarian import ModelRecord, MaterialLibrarian
 from tdw.output_data import OutputData, Transforms, Images, CameraMatrices, Collision, EnvironmentCollision
+from tdw_physics.frame_response import FrameResponse
 from tdw_physics.rigidbodies_dataset import (RigidbodiesDataset,
                                              get_random_xyz_transform,
                                              get_range,
                                              handle_random_transform_args)
-from tdw_physics.util import (MODEL_LIBRARIES, FLEX_MODELS, MODEL_CATEGORIES,
-                              MATERIAL_TYPES, MATERIAL_NAMES, ROOMS,
+from tdw_physics.util import (MODEL_LIBRARIES, get_model_names, get_model_record, FLEX_MODELS,
+                              get_material_types, get_rooms,
                               get_parser,
                               xyz_to_arr, arr_to_xyz, str_to_xyz,
                               none_or_str, none_or_int, int_or_bool)
 
 from tdw_physics.postprocessing.labels import get_all_label_funcs
 
-PRIMITIVE_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records if not r.do_not_use]
-FULL_NAMES = [r.name for r in MODEL_LIBRARIES['models_full.json'].records if not r.do_not_use]
+PRIMITIVE_NAMES = get_model_names('models_flex.json', usable=True)
+FULL_NAMES = get_model_names('models_full.json', usable=True)
+MATERIAL_TYPES = get_material_types()
 
 def get_args(dataset_dir: str, parse=True):
     """
@@ -315,12 +317,12 @@ def get_args(dataset_dir: str, parse=True):
         # for correct occluder/distractor sampling
         if not (args.training_data_mode or args.readout_data_mode):
             global PRIMITIVE_NAMES
-            PRIMITIVE_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records]
+            PRIMITIVE_NAMES = get_model_names('models_flex.json')
             global FULL_NAMES
-            FULL_NAMES = [r.name for r in MODEL_LIBRARIES['models_full.json'].records]
+            FULL_NAMES = get_model_names('models_full.json')
 
         # choose a valid room
-        assert args.room in (['box', 'tdw', 'house'] + ROOMS), (args.room, ROOMS)
+        assert args.room in (['box', 'tdw', 'house'] + get_rooms()), (args.room, get_rooms())
         args.room_center = handle_random_transform_args(args.room_center)
 
         # parse the model libraries
@@ -437,7 +439,7 @@ def get_args(dataset_dir: str, parse=True):
         if args.distractor is None or args.distractor == 'full':
             args.distractor = FULL_NAMES
         elif args.distractor == 'core':
-            args.distractor = [r.name for r in MODEL_LIBRARIES['models_core.json'].records]
+            args.distractor = get_model_names('models_core.json')
         elif args.distractor in ['flex', 'primitives']:
             args.distractor = PRIMITIVE_NAMES
         else:
@@ -447,7 +449,7 @@ def get_args(dataset_dir: str, parse=True):
         if args.occluder is None or args.occluder == 'full':
             args.occluder = FULL_NAMES
         elif args.occluder == 'core':
-            args.occluder = [r.name for r in MODEL_LIBRARIES['models_core.json'].records]
+            args.occluder = get_model_names('models_core.json')
         elif args.occluder in ['flex', 'primitives']:
             args.occluder = PRIMITIVE_NAMES
         else:
@@ -538,10 +540,28 @@ class Dominoes(RigidbodiesDataset):
     """
 
     MAX_TRIALS = 1000
-    DEFAULT_RAMPS = [r for r in MODEL_LIBRARIES['models_full.json'].records if 'ramp_with_platform_30' in r.name]
-    CUBE = [r for r in MODEL_LIBRARIES['models_flex.json'].records if 'cube' in r.name][0]
     PRINT = True
 
+    # The ramp and cube records, looked up by name the first time they're used so that importing the module doesn't
+    # load the model libraries.
+    _DEFAULT_RAMPS = None
+    _CUBE = None
+
+    @property
+    def DEFAULT_RAMPS(self) -> List[ModelRecord]:
+        if Dominoes._DEFAULT_RAMPS is None:
+            Dominoes._DEFAULT_RAMPS = [get_model_record(name, 'models_full.json')
+                                       for name in get_model_names('models_full.json')
+                                       if 'ramp_with_platform_30' in name]
+        return Dominoes._DEFAULT_RAMPS
+
+    @property
+    def CUBE(self) -> ModelRecord:
+        if Dominoes._CUBE is None:
+            Dominoes._CUBE = get_model_record([name for name in get_model_names('models_flex.json')
+                                               if 'cube' in name][0], 'models_flex.json')
+        return Dominoes._CUBE
+
     def __init__(self,
                  port: int = None,
                  room='box',
@@ -786,6 +806,39 @@ class Dominoes(RigidbodiesDataset):
         assert len(tlist), "You're trying to choose objects from an empty list"
         return tlist
 
+    def get_balance_ranges(self) -> Dict[str, Tuple[float, float]]:
+        """
+        The parameters that an `OutcomeSampler` can choose to balance the outcomes of a run: the push force scale
+        (if it's a range), the distance between the probe and the target (within half of its configured value),
+        and, unless it's fixed, where the zone is along the collision axis (from its default place to half the axis
+        further away).
+        """
+
+        ranges = OrderedDict()
+        if not hasattr(self.force_scale_range, 'keys'):
+            fmin, fmax = get_range(self.force_scale_range)
+            if fmax > fmin:
+                ranges["force_scale_range"] = (fmin, fmax)
+        ranges["collision_axis_length"] = (0.5 * self.collision_axis_length, 1.5 * self.collision_axis_length)
+        if self.zone_location is None:
+            zx = self._get_zone_location(TDWUtils.VECTOR3_ZERO)["x"]
+            ranges["zone_location"] = (zx, zx + 0.5 * self.collision_axis_length)
+        return ranges
+
+    def update_controller_state(self, force_scale_range=None, collision_axis_length=None, zone_location=None,
+                                **kwargs) -> None:
+        """
+        Set the parameters that an `OutcomeSampler` chose for the next trial; see `get_balance_ranges()`.
+        """
+
+        if force_scale_range is not None:
+            self.force_scale_range = force_scale_range
+        if collision_axis_length is not None:
+            self.collision_axis_length = collision_axis_length
+        if zone_location is not None:
+            self.zone_location = zone_location if hasattr(zone_location, 'keys') else \
+                {"x": zone_location, "y": 0.0, "z": 0.0}
+
     def set_probe_types(self, olist):
         tlist = self.get_types(olist, flex_only=self.flex_only)
         self._probe_types = tlist
@@ -945,7 +998,7 @@ class Dominoes(RigidbodiesDataset):
 
         return commands
 
-    def get_per_frame_commands(self, resp: List[bytes], frame: int) -> List[dict]:
+    def get_per_frame_commands(self, resp: FrameResponse, frame: int) -> List[dict]:
         
         if (self.force_wait != 0) and frame == self.force_wait:
             if self.PRINT:
@@ -965,6 +1018,10 @@ class Dominoes(RigidbodiesDataset):
 
         return cmds
 
+    def is_response_independent(self, frame: int) -> bool:
+        # The push is computed when the trial starts; only collision noise reads the response.
+        return getattr(self, "collision_noise_generator", None) is None
+
     def _write_static_data(self, static_group: h5py.Group) -> None:
         super()._write_static_data(static_group)
 
@@ -1070,7 +1127,7 @@ class Dominoes(RigidbodiesDataset):
 
     def _write_frame(self,
                      frames_grp: h5py.Group,
-                     resp: List[bytes],
+                     resp: FrameResponse,
                      frame_num: int) -> \
             Tuple[h5py.Group, h5py.Group, dict, bool]:
         frame, objs, tr, sleeping = super()._write_frame(frames_grp=frames_grp,
@@ -1079,10 +1136,10 @@ class Dominoes(RigidbodiesDataset):
         # If this is a stable structure, disregard whether anything is actually moving.
         return frame, objs, tr, sleeping and not (frame_num < 150)
 
-    def _update_target_position(self, resp: List[bytes], frame_num: int) -> None:
+    def _update_target_position(self, resp: FrameResponse, frame_num: int) -> None:
         if frame_num <= 0:
             self.target_delta_position = xyz_to_arr(TDWUtils.VECTOR3_ZERO)
-        elif 'tran' in [OutputData.get_data_type_id(r) for r in resp[:-1]]:
+        elif resp.has('tran'):
             target_position_new = self.get_object_position(self.target_id, resp) or self.target_position
             try:
                 self.target_delta_position += (target_position_new - xyz_to_arr(self.target_position))
@@ -1092,9 +1149,9 @@ class Dominoes(RigidbodiesDataset):
 
     def _write_frame_labels(self,
                             frame_grp: h5py.Group,
-                            resp: List[bytes],
+                            resp: FrameResponse,
                             frame_num: int,
-                            sleeping: bool) -> Tuple[h5py.Group, List[bytes], int, bool]:
+                            sleeping: bool) -> Tuple[h5py.Group, FrameResponse, int, bool]:
 
         labels, resp, frame_num, done = super()._write_frame_labels(frame_grp, resp, frame_num, sleeping)
 
@@ -1139,7 +1196,7 @@ class Dominoes(RigidbodiesDataset):
 
         return labels, resp, frame_num, done
 
-    def is_done(self, resp: List[bytes], frame: int) -> bool:
+    def is_done(self, resp: FrameResponse, frame: int) -> bool:
         return frame > 300
 
     def get_rotation(self, rot_range):
@@ -2225,6 +2282,21 @@ if __name__ == "__main__":
                  save_movies=args.save_movies,
                  save_labels=args.save_labels,
                  save_meshes=args.save_meshes,
+                 pipeline_writes=args.pipeline_writes,
+                 write_queue_size=args.write_queue_size,
+                 num_workers=args.num_workers,
+                 worker_ports=args.worker_ports,
+                 record_responses=args.record_responses,
+                 replay_responses=args.replay_responses,
+                 save_timing=args.save_timing,
+                 hdf5_layout=args.hdf5_layout,
+                 image_storage=args.image_storage,
+                 stats_workers=args.stats_workers,
+                 prescreen=args.prescreen,
+                 balance=args.balance,
+                 balance_strata=args.balance_strata,
+                 pass_schedule=args.pass_schedule,
+                 pipeline_commands=args.pipeline_commands,
                  args_dict=vars(args))
     else:
         end = DomC.communicate({"$type": "terminate"})
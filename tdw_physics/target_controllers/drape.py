@@ -11,15 +11,15 @@ from tdw.tdw_utils import TDWUtils
 from tdw_physics.target_controllers.dominoes import Dominoes, get_args, ArgumentParser
 from tdw_physics.flex_dataset import FlexDataset, FlexParticles
 from tdw_physics.rigidbodies_dataset import RigidbodiesDataset
-from tdw_physics.util import MODEL_LIBRARIES, get_parser, none_or_str
+from tdw_physics.util import MODEL_LIBRARIES, get_model_names, get_parser, none_or_str
 
 from tdw_physics.postprocessing.labels import get_all_label_funcs
 
 # fluid
 from tdw.flex.fluid_types import FluidTypes
 
-MODEL_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records]
-MODEL_CORE = [r.name for r in MODEL_LIBRARIES['models_core.json'].records]
+MODEL_NAMES = get_model_names('models_flex.json')
+MODEL_CORE = get_model_names('models_core.json')
 
 def get_flex_args(dataset_dir: str, parse=True):
 
@@ -506,9 +506,8 @@ class ClothSagging(Dominoes, FlexDataset):
 
         print("frame num", frame_num)
         flex = None
-        for r in resp[:-1]:
-            if FlexParticles.get_data_type_id(r) == "flex":
-                flex = FlexParticles(r)
+        for r in resp.get_raw("flex"):
+            flex = FlexParticles(r)
 
         if has_target and has_zone and (flex is not None):
             min_dist, are_touching = self.get_flex_object_collision(flex,
@@ -655,6 +654,21 @@ if __name__ == '__main__':
              save_movies=args.save_movies,
              save_labels=args.save_labels,
               save_meshes=args.save_meshes,
+              pipeline_writes=args.pipeline_writes,
+              write_queue_size=args.write_queue_size,
+              num_workers=args.num_workers,
+              worker_ports=args.worker_ports,
+              record_responses=args.record_responses,
+              replay_responses=args.replay_responses,
+              save_timing=args.save_timing,
+              hdf5_layout=args.hdf5_layout,
+              image_storage=args.image_storage,
+              stats_workers=args.stats_workers,
+              prescreen=args.prescreen,
+              balance=args.balance,
+              balance_strata=args.balance_strata,
+              pass_schedule=args.pass_schedule,
+              pipeline_commands=args.pipeline_commands,
              args_dict=vars(args))
     else:
         end = C.communicate({"$type": "terminate"})
@@ -16,10 +16,10 @@ from tdw_physics.rigidbodies_dataset import (RigidbodiesDataset,
                                              get_random_xyz_transform,
                                              handle_random_transform_args,
                                              get_range)
-from tdw_physics.util import MODEL_LIBRARIES, get_parser, xyz_to_arr, arr_to_xyz
+from tdw_physics.util import MODEL_LIBRARIES, get_model_names, get_parser, xyz_to_arr, arr_to_xyz
 
 
-MODEL_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records]
+MODEL_NAMES = get_model_names('models_flex.json')
 OCCLUDER_CATS = "coffee table,houseplant,vase,chair,dog,sofa,flowerpot,coffee maker,stool,laptop,laptop computer,globe,bookshelf,desktop computer,garden plant,garden plant,garden plant"
 DISTRACTOR_CATS = "coffee table,houseplant,vase,chair,dog,sofa,flowerpot,coffee maker,stool,laptop,laptop computer,globe,bookshelf,desktop computer,garden plant,garden plant,garden plant"
 
@@ -302,6 +302,9 @@ class Drop(MultiDominoes):
     def get_per_frame_commands(self, resp: List[bytes], frame: int) -> List[dict]:
         return []
 
+    def is_response_independent(self, frame: int) -> bool:
+        return True
+
     def _write_static_data(self, static_group: h5py.Group) -> None:
         super()._write_static_data(static_group)
 
@@ -581,6 +584,21 @@ if __name__ == "__main__":
                 save_movies=args.save_movies,
                 save_labels=args.save_labels,
                 save_meshes=args.save_meshes,
+                pipeline_writes=args.pipeline_writes,
+                write_queue_size=args.write_queue_size,
+                num_workers=args.num_workers,
+                worker_ports=args.worker_ports,
+                record_responses=args.record_responses,
+                replay_responses=args.replay_responses,
+                save_timing=args.save_timing,
+                hdf5_layout=args.hdf5_layout,
+                image_storage=args.image_storage,
+                stats_workers=args.stats_workers,
+                prescreen=args.prescreen,
+                balance=args.balance,
+                balance_strata=args.balance_strata,
+                pass_schedule=args.pass_schedule,
+                pipeline_commands=args.pipeline_commands,
                 args_dict=vars(args))
     else:
         end = DC.communicate({"$type": "terminate"})
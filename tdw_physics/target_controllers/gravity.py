@@ -11,12 +11,13 @@ from typing import List, Dict, Tuple
 from weighted_collection import WeightedCollection
 from tdw.tdw_utils import TDWUtils
 from tdw.librarian import ModelRecord, MaterialLibrarian
+from tdw_physics.library_index import LIBRARY_INDEX
 from tdw.output_data import OutputData, Transforms
 from tdw_physics.rigidbodies_dataset import (RigidbodiesDataset,
                                              get_random_xyz_transform,
                                              get_range,
                                              handle_random_transform_args)
-from tdw_physics.util import (MODEL_LIBRARIES,
+from tdw_physics.util import (MODEL_LIBRARIES, get_model_names, get_model_record,
                               get_parser,
                               xyz_to_arr, arr_to_xyz, str_to_xyz,
                               none_or_str, none_or_int, int_or_bool)
@@ -24,11 +25,9 @@ from tdw_physics.util import (MODEL_LIBRARIES,
 from tdw_physics.target_controllers.dominoes import Dominoes, MultiDominoes, get_args
 from tdw_physics.postprocessing.labels import is_trial_valid
 
-MODEL_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records]
-M = MaterialLibrarian()
-MATERIAL_TYPES = M.get_material_types()
-MATERIAL_NAMES = {mtype: [m.name for m in M.get_all_materials_of_type(mtype)] \
-                  for mtype in MATERIAL_TYPES}
+MODEL_NAMES = get_model_names('models_flex.json')
+MATERIAL_NAMES = LIBRARY_INDEX.get_material_names()
+MATERIAL_TYPES = list(MATERIAL_NAMES.keys())
 
 def get_gravity_args(dataset_dir: str, parse=True):
 
@@ -177,7 +176,16 @@ class Gravity(Dominoes):
 
 class Ramp(Gravity):
 
-    RAMPS = [r for r in MODEL_LIBRARIES['models_full.json'].records if 'ramp' in r.name]
+    # The ramp records, looked up by name the first time they're used so that importing the module doesn't load the
+    # model libraries.
+    _RAMPS = None
+
+    @property
+    def RAMPS(self) -> List[ModelRecord]:
+        if Ramp._RAMPS is None:
+            Ramp._RAMPS = [get_model_record(name, 'models_full.json')
+                           for name in get_model_names('models_full.json') if 'ramp' in name]
+        return Ramp._RAMPS
 
     def __init__(self,
                  port: int = 1071,
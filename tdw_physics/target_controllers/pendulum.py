@@ -7,12 +7,13 @@ import stopit
 from typing import List, Dict, Tuple
 from tdw.tdw_utils import TDWUtils
 from tdw.librarian import ModelRecord, MaterialLibrarian
+from tdw_physics.library_index import LIBRARY_INDEX
 from tdw_physics.rigidbodies_dataset import (RigidbodiesDataset,
                                              get_random_xyz_transform,
                                              get_range,
                                              handle_random_transform_args)
-from tdw_physics.util import (MODEL_LIBRARIES,
-                              ROOMS,
+from tdw_physics.util import (MODEL_LIBRARIES, get_model_names,
+                              get_rooms,
                               get_parser,
                               xyz_to_arr,
                               arr_to_xyz,
@@ -30,15 +31,13 @@ from tdw_physics.postprocessing.labels import (stimulus_name,
                                                get_collisions)
 
 
-MODEL_NAMES = [r.name for r in MODEL_LIBRARIES['models_full.json'].records if not r.do_not_use]
-PRIMITIVE_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records if not r.do_not_use]
-SPECIAL_NAMES =[r.name for r in MODEL_LIBRARIES['models_special.json'].records if not r.do_not_use]
+MODEL_NAMES = get_model_names('models_full.json', usable=True)
+PRIMITIVE_NAMES = get_model_names('models_flex.json', usable=True)
+SPECIAL_NAMES = get_model_names('models_special.json', usable=True)
 ALL_NAMES = MODEL_NAMES + SPECIAL_NAMES + PRIMITIVE_NAMES
 
-M = MaterialLibrarian()
-MATERIAL_TYPES = M.get_material_types()
-MATERIAL_NAMES = {mtype: [m.name for m in M.get_all_materials_of_type(mtype)] \
-                  for mtype in MATERIAL_TYPES}
+MATERIAL_NAMES = LIBRARY_INDEX.get_material_names()
+MATERIAL_TYPES = list(MATERIAL_NAMES.keys())
 
 ## convenience
 XYZ = ['x', 'y', 'z']
@@ -321,7 +320,7 @@ def get_relational_args(dataset_dir: str, parse=True):
         args.frot = handle_random_transform_args(args.frot)
         args.fwait = handle_random_transform_args(args.fwait)
 
-        assert args.room in ['box', 'tdw'] + ROOMS, (args.room, ROOMS)
+        assert args.room in ['box', 'tdw'] + get_rooms(), (args.room, get_rooms())
         args.room_center = handle_random_transform_args(args.room_center)
 
         return args
@@ -1013,6 +1012,9 @@ class RelationArrangement(Playroom):
         else:
             return []
 
+    def is_response_independent(self, frame: int) -> bool:
+        return True
+
 if __name__ == '__main__':
 
     import platform, os
@@ -1112,6 +1114,21 @@ if __name__ == '__main__':
                  save_movies=args.save_movies,
                  save_labels=args.save_labels,
                  save_meshes=args.save_meshes,
+                 pipeline_writes=args.pipeline_writes,
+                 write_queue_size=args.write_queue_size,
+                 num_workers=args.num_workers,
+                 worker_ports=args.worker_ports,
+                 record_responses=args.record_responses,
+                 replay_responses=args.replay_responses,
+                 save_timing=args.save_timing,
+                 hdf5_layout=args.hdf5_layout,
+                 image_storage=args.image_storage,
+                 stats_workers=args.stats_workers,
+                 prescreen=args.prescreen,
+                 balance=args.balance,
+                 balance_strata=args.balance_strata,
+                 pass_schedule=args.pass_schedule,
+                 pipeline_commands=args.pipeline_commands,
                  write_passes=args.write_passes,
                  args_dict=vars(args)
         )
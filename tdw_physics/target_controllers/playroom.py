@@ -11,28 +11,27 @@ from typing import List, Dict, Tuple
 from weighted_collection import WeightedCollection
 from tdw.tdw_utils import TDWUtils
 from tdw.librarian import ModelRecord, MaterialLibrarian
+from tdw_physics.library_index import LIBRARY_INDEX
 from tdw.output_data import OutputData, Transforms
 from tdw_physics.rigidbodies_dataset import (RigidbodiesDataset,
                                              get_random_xyz_transform,
                                              get_range,
                                              handle_random_transform_args)
-from tdw_physics.util import MODEL_LIBRARIES, get_parser, xyz_to_arr, arr_to_xyz, str_to_xyz
+from tdw_physics.util import MODEL_LIBRARIES, get_model_names, get_parser, xyz_to_arr, arr_to_xyz, str_to_xyz
 
 from tdw_physics.target_controllers.dominoes import Dominoes, MultiDominoes, get_args, none_or_str, none_or_int
 from tdw_physics.target_controllers.collision import Collision
 from tdw_physics.postprocessing.labels import is_trial_valid
 
-MODEL_NAMES = [r.name for r in MODEL_LIBRARIES['models_full.json'].records if not r.do_not_use]
-PRIMITIVE_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records if not r.do_not_use]
-SPECIAL_NAMES =[r.name for r in MODEL_LIBRARIES['models_special.json'].records if not r.do_not_use]
+MODEL_NAMES = get_model_names('models_full.json', usable=True)
+PRIMITIVE_NAMES = get_model_names('models_flex.json', usable=True)
+SPECIAL_NAMES = get_model_names('models_special.json', usable=True)
 ALL_NAMES = MODEL_NAMES + SPECIAL_NAMES + PRIMITIVE_NAMES
 
-M = MaterialLibrarian()
-MATERIAL_TYPES = M.get_material_types()
-MATERIAL_NAMES = {mtype: [m.name for m in M.get_all_materials_of_type(mtype)] \
-                  for mtype in MATERIAL_TYPES}
+MATERIAL_NAMES = LIBRARY_INDEX.get_material_names()
+MATERIAL_TYPES = list(MATERIAL_NAMES.keys())
 
-ALL_CATEGORIES = list(set([r.wcategory for r in MODEL_LIBRARIES['models_full.json'].records]))
+ALL_CATEGORIES = list(set(LIBRARY_INDEX.get_model_categories('models_full.json').values()))
 MEDIUM_CATEGORIES = "toy,beetle,teakettle,radio,trumpet,globe,cup,elephant,spectacles,fan,orange,spider,garden plant,bat,whale,book,bottle,scissors,soda can,shoe,alligator,bird,sandwich,coffee,grape,toaster,bowl,coaster,microscope,turtle,vase,bee,dog,duck,raw vegetable,apple,bread,dice,rodent,box,rock,camera,golf ball,bear,hammer,gloves,towel,cow,canoe,bucket,coin,money,computer mouse,hairbrush,slipper,suitcase,comb,bookend,jug,hat,key,hourglass,banana,cat,violin,snake,basket,candle,fish,pot,beverage,crustacean,looking glass,flower,sheep,skate,croissant,horse,wineglass,saw,calculator,flowerpot,pencil,pan,surfboard,skateboard,donut,sculpture,giraffe,zebra,ice cream,umbrella"
 ANIMALS_TOYS_FRUIT = "toy,beetle,elephant,spider,bat,whale,alligator,bird,grape,turtle,bee,dog,duck,raw vegetable,apple,bread,rodent,bear,cow,computer mouse,banana,cat,snake,fish,crustacean,flower,sheep,croissant,horse,giraffe,zebra,sculpture,globe,houseplant,coffee maker,flowerpot,lamp"
 
@@ -350,6 +349,9 @@ class Playroom(Collision):
             self._fixed_target = True
         print("applying force to ---> %s" % self.apply_force_to)
 
+        # the parameters chosen by an outcome sampler
+        Dominoes.update_controller_state(self, **kwargs)
+
 
     def _place_target_object(self) -> List[dict]:
 
@@ -546,6 +548,21 @@ if __name__ == "__main__":
                  save_movies=args.save_movies,
                  save_labels=args.save_labels,
                  save_meshes=args.save_meshes,
+                 pipeline_writes=args.pipeline_writes,
+                 write_queue_size=args.write_queue_size,
+                 num_workers=args.num_workers,
+                 worker_ports=args.worker_ports,
+                 record_responses=args.record_responses,
+                 replay_responses=args.replay_responses,
+                 save_timing=args.save_timing,
+                 hdf5_layout=args.hdf5_layout,
+                 image_storage=args.image_storage,
+                 stats_workers=args.stats_workers,
+                 prescreen=args.prescreen,
+                 balance=args.balance,
+                 balance_strata=args.balance_strata,
+                 pass_schedule=args.pass_schedule,
+                 pipeline_commands=args.pipeline_commands,
                  write_passes=args.write_passes,
                  args_dict=vars(args)
         )
@@ -11,12 +11,13 @@ from typing import List, Dict, Tuple
 from weighted_collection import WeightedCollection
 from tdw.tdw_utils import TDWUtils
 from tdw.librarian import ModelRecord, MaterialLibrarian
-from tdw.output_data import OutputData, Transforms
+from tdw_physics.library_index import LIBRARY_INDEX
+from tdw_physics.frame_response import FrameResponse
 from tdw_physics.rigidbodies_dataset import (RigidbodiesDataset,
                                              get_random_xyz_transform,
                                              get_range,
                                              handle_random_transform_args)
-from tdw_physics.util import (MODEL_LIBRARIES,
+from tdw_physics.util import (MODEL_LIBRARIES, get_model_names,
                               get_parser,
                               xyz_to_arr, arr_to_xyz, str_to_xyz,
                               none_or_str, none_or_int, int_or_bool)
@@ -24,13 +25,11 @@ from tdw_physics.util import (MODEL_LIBRARIES,
 from tdw_physics.target_controllers.dominoes import Dominoes, MultiDominoes, get_args
 from tdw_physics.postprocessing.labels import is_trial_valid
 
-MODEL_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records]
-PRIMITIVE_NAMES = [r.name for r in MODEL_LIBRARIES['models_flex.json'].records]
-FULL_NAMES = [r.name for r in MODEL_LIBRARIES['models_full.json'].records if not r.do_not_use]
-M = MaterialLibrarian()
-MATERIAL_TYPES = M.get_material_types()
-MATERIAL_NAMES = {mtype: [m.name for m in M.get_all_materials_of_type(mtype)] \
-                  for mtype in MATERIAL_TYPES}
+MODEL_NAMES = get_model_names('models_flex.json')
+PRIMITIVE_NAMES = get_model_names('models_flex.json')
+FULL_NAMES = get_model_names('models_full.json', usable=True)
+MATERIAL_NAMES = LIBRARY_INDEX.get_material_names()
+MATERIAL_TYPES = list(MATERIAL_NAMES.keys())
 
 '''
 The tower controller generats stims in which the target object is
@@ -307,9 +306,9 @@ class Tower(MultiDominoes):
 
     def _write_frame_labels(self,
                             frame_grp: h5py.Group,
-                            resp: List[bytes],
+                            resp: FrameResponse,
                             frame_num: int,
-                            sleeping: bool) -> Tuple[h5py.Group, List[bytes], int, bool]:
+                            sleeping: bool) -> Tuple[h5py.Group, FrameResponse, int, bool]:
 
         labels, resp, frame_num, done = super()._write_frame_labels(
             frame_grp, resp, frame_num, sleeping)
@@ -334,17 +333,13 @@ class Tower(MultiDominoes):
     def _get_zone_location(self, scale):
         return {"x": 0.0, "y": 0.0, "z": 0.0}
 
-    def _set_tower_height_now(self, resp: List[bytes]) -> None:
+    def _set_tower_height_now(self, resp: FrameResponse) -> None:
         top_obj_id = self.object_ids[-1]
-        for r in resp[:-1]:
-            r_id = OutputData.get_data_type_id(r)
-            if r_id == "tran":
-                tr = Transforms(r)
-                for i in range(tr.get_num()):
-                    if tr.get_id(i) == top_obj_id:
-                        self.tower_height = tr.get_position(i)[1]
+        position = resp.transforms.get(top_obj_id, "positions")
+        if position is not None:
+            self.tower_height = float(position[1])
 
-    def get_per_frame_commands(self, resp: List[bytes], frame: int) -> List[dict]:
+    def get_per_frame_commands(self, resp: FrameResponse, frame: int) -> List[dict]:
 
         cmds = super().get_per_frame_commands(resp, frame)
 
@@ -361,6 +356,10 @@ class Tower(MultiDominoes):
 
         return cmds
 
+    def is_response_independent(self, frame: int) -> bool:
+        # The tower's height is read from the response after the push.
+        return False
+
     def _build_intermediate_structure(self) -> List[dict]:
         print("middle color", self.middle_color)
         if self.randomize_colors_across_trials:
@@ -680,6 +679,21 @@ if __name__ == "__main__":
                save_movies=args.save_movies,
                save_labels=args.save_labels,
                save_meshes=args.save_meshes,
+               pipeline_writes=args.pipeline_writes,
+               write_queue_size=args.write_queue_size,
+               num_workers=args.num_workers,
+               worker_ports=args.worker_ports,
+               record_responses=args.record_responses,
+               replay_responses=args.replay_responses,
+               save_timing=args.save_timing,
+               hdf5_layout=args.hdf5_layout,
+               image_storage=args.image_storage,
+               stats_workers=args.stats_workers,
+               prescreen=args.prescreen,
+               balance=args.balance,
+               balance_strata=args.balance_strata,
+               pass_schedule=args.pass_schedule,
+               pipeline_commands=args.pipeline_commands,
                args_dict=vars(args)
         )
     else:
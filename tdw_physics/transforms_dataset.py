@@ -1,14 +1,17 @@
 from typing import List, Tuple, Dict, Optional
 from abc import ABC
+import io
 import h5py
 import numpy as np
 import random
 from tdw.tdw_utils import TDWUtils
-from tdw.output_data import OutputData, Transforms, Images, CameraMatrices, Bounds
 from tdw.controller import Controller
 from tdw.librarian import ModelRecord
 from tdw_physics.dataset import Dataset
+from tdw_physics.frame_response import FrameResponse, ObjectArrays, BOUND_TYPES
 from tdw_physics.util import xyz_to_arr, arr_to_xyz, MODEL_LIBRARIES
+from tdw_physics.image_storage import get_pass_storage, encode_pass
+import json
 
 from PIL import Image
 
@@ -33,6 +36,9 @@ class TransformsDataset(Dataset, ABC):
         static_group.create_dataset("initial_rotation",
                                     data=np.stack([xyz_to_arr(r) for r in self.initial_rotations], 0))
 
+        # how each image pass is stored, so that it can be decoded
+        static_group.attrs["image_storage"] = json.dumps(self.image_storage)
+
     def random_model(self,
                      object_types: List[ModelRecord],
                      random_obj_id: bool = False,
@@ -101,8 +107,8 @@ class TransformsDataset(Dataset, ABC):
 
         return commands
 
-    def _write_frame(self, frames_grp: h5py.Group, resp: List[bytes], frame_num: int) -> \
-            Tuple[h5py.Group, h5py.Group, dict, bool]:
+    def _write_frame(self, frames_grp: h5py.Group, resp: FrameResponse, frame_num: int) -> \
+            Tuple[h5py.Group, h5py.Group, ObjectArrays, bool]:
         num_objects = len(self.object_ids)
 
         # Create a group for this frame.
@@ -118,81 +124,32 @@ class TransformsDataset(Dataset, ABC):
 
         # Bounds data.
         bounds = dict()
-        for bound_type in ['front', 'back', 'left', 'right', 'top', 'bottom', 'center']:
+        for bound_type in BOUND_TYPES:
             bounds[bound_type] = np.empty(dtype=np.float32, shape=(num_objects, 3))
 
         camera_matrices = frame.create_group("camera_matrices")
 
-        # Parse the data in an ordered manner so that it can be mapped back to the object IDs.
-        tr_dict = dict()
-
-        # r_types = [OutputData.get_data_type_id(r) for r in resp[:-1]]
-        # print(frame_num, r_types)
-
-        for r in resp[:-1]:
-            r_id = OutputData.get_data_type_id(r)
-            if r_id == "tran":
-                tr = Transforms(r)
-                for i in range(tr.get_num()):
-                    pos = tr.get_position(i)
-                    tr_dict.update({tr.get_id(i): {"pos": pos,
-                                                   "for": tr.get_forward(i),
-                                                   "rot": tr.get_rotation(i)}})
-                # Add the Transforms data.
-                for o_id, i in zip(self.object_ids, range(num_objects)):
-                    if o_id not in tr_dict:
-                        continue
-                    positions[i] = tr_dict[o_id]["pos"]
-                    forwards[i] = tr_dict[o_id]["for"]
-                    rotations[i] = tr_dict[o_id]["rot"]
-            elif r_id == "imag":
-                im = Images(r)
-                # Add each image.
-                for i in range(im.get_num_passes()):
-                    pass_mask = im.get_pass_mask(i)
-                    # Reshape the depth pass array.
-                    if pass_mask == "_depth":
-                        image_data = TDWUtils.get_shaped_depth_pass(images=im, index=i)
-                    else:
-                        image_data = im.get_image(i)
-                    images.create_dataset(pass_mask, data=image_data, compression="gzip")
-
-                    # Save PNGs
-                    if pass_mask in self.save_passes:
-                        filename = pass_mask[1:] + "_" + TDWUtils.zero_padding(frame_num, 4) + "." + im.get_extension(i)
-                        path = self.png_dir.joinpath(filename)
-                        if pass_mask in ["_depth", "_depth_simple"]:
-                            Image.fromarray(TDWUtils.get_shaped_depth_pass(images=im, index=i)).save(path)
-                        else:
-                            with open(path, "wb") as f:
-                                f.write(im.get_image(i))
-            elif r_id == "boun":
-                bo = Bounds(r)
-                bo_dict = dict()
-                for i in range(bo.get_num()):
-                    bo_dict.update({bo.get_id(i): {"front": bo.get_front(i),
-                                                   "back": bo.get_back(i),
-                                                   "left": bo.get_left(i),
-                                                   "right": bo.get_right(i),
-                                                   "top": bo.get_top(i),
-                                                   "bottom": bo.get_bottom(i),
-                                                   "center": bo.get_center(i)}})
-                for o_id, i in zip(self.object_ids, range(num_objects)):
-                    for bound_type in bounds.keys():
-                        try:
-                            bounds[bound_type][i] = bo_dict[o_id][bound_type]
-                        except KeyError:
-                            print("couldn't store bound data for object %d" % o_id)
-
-
-            # Add the camera matrices.
-            elif OutputData.get_data_type_id(r) == "cama":
-                matrices = CameraMatrices(r)
-                camera_matrices.create_dataset("projection_matrix", data=matrices.get_projection_matrix())
-                camera_matrices.create_dataset("camera_matrix", data=matrices.get_camera_matrix())
-
-
-    
+        # Map the parsed data back to the object IDs.
+        object_index = self.get_object_index()
+        tr = resp.transforms
+        if resp.has("tran"):
+            for key, out in [("positions", positions), ("forwards", forwards), ("rotations", rotations)]:
+                tr.scatter(object_index, key, out)
+
+        # Add each image.
+        self._write_frame_images(images, resp, frame_num)
+
+        if resp.has("boun"):
+            bo = resp.bounds
+            for bound_type in bounds.keys():
+                copied = bo.scatter(object_index, bound_type, bounds[bound_type])
+            for o_id in np.asarray(self.object_ids)[~copied]:
+                print("couldn't store bound data for object %d" % o_id)
+
+        # Add the camera matrices.
+        if resp.camera_matrices is not None:
+            for key, matrix in resp.camera_matrices.items():
+                camera_matrices.create_dataset(key, data=matrix)
 
         objs = frame.create_group("objects")
         objs.create_dataset("positions", data=positions.reshape(num_objects, 3), compression="gzip")
@@ -201,16 +158,38 @@ class TransformsDataset(Dataset, ABC):
         for bound_type in bounds.keys():
             objs.create_dataset(bound_type, data=bounds[bound_type], compression="gzip")
 
-        return frame, objs, tr_dict, False
-
-    def get_object_position(self, obj_id: int, resp: List[bytes]) -> None:
-        position = None
-        for r in resp:
-            r_id = OutputData.get_data_type_id(r)
-            if r_id == "tran":
-                tr = Transforms(r)
-                for i in range(tr.get_num()):
-                    if tr.get_id(i) == obj_id:
-                        position = tr.get_position(i)
-
-        return position
+        return frame, objs, tr, False
+
+    def _write_frame_images(self, images: h5py.Group, resp: FrameResponse, frame_num: int) -> None:
+        for pass_mask in resp.images.keys():
+            image_data = resp.get_image_data(pass_mask)
+            stored_data, storage_kwargs = encode_pass(pass_mask, image_data,
+                                                      get_pass_storage(self.image_storage, pass_mask))
+            images.create_dataset(pass_mask, data=stored_data, **storage_kwargs)
+
+            # Stream the frame to the pass's MP4
+            if pass_mask in self.movie_encoders:
+                with self.timer.time("write_mp4"):
+                    if pass_mask in ["_depth", "_depth_simple"]:
+                        png = io.BytesIO()
+                        Image.fromarray(image_data).save(png, format="PNG")
+                        self.movie_encoders[pass_mask].write(png.getvalue(), "png")
+                    else:
+                        self.movie_encoders[pass_mask].write(image_data, resp.get_image_extension(pass_mask))
+            # Save PNGs
+            elif pass_mask in self.save_passes:
+                filename = pass_mask[1:] + "_" + TDWUtils.zero_padding(frame_num, 4) + "." + \
+                           resp.get_image_extension(pass_mask)
+                path = self.png_dir.joinpath(filename)
+                with self.timer.time("save_png"):
+                    if pass_mask in ["_depth", "_depth_simple"]:
+                        Image.fromarray(image_data).save(path)
+                    else:
+                        with open(path, "wb") as f:
+                            f.write(image_data)
+
+    def get_object_position(self, obj_id: int, resp: FrameResponse) -> Optional[Tuple[float, float, float]]:
+        position = resp.transforms.get(obj_id, "positions")
+        if position is None:
+            return None
+        return tuple(float(p) for p in position)
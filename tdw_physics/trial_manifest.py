@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import socket
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from tdw.tdw_utils import TDWUtils
+from tdw_physics.metadata_log import MetadataLog
+
+# Trial states in the manifest.
+IN_PROGRESS = "in_progress"
+COMPLETE = "complete"
+FAILED = "failed"
+
+# How much of a trial file is hashed at a time.
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
+
+def get_checksum(path: Union[str, Path]) -> str:
+    """
+    :param path: The path to a file.
+
+    :return: The md5 checksum of the file.
+    """
+
+    md5 = hashlib.md5()
+    with open(str(path), "rb") as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class TrialManifest:
+    """
+    A per-run manifest (`manifest.jsonl`, in the output directory) of the state of each trial: in progress, complete
+    (with the size and checksum of its hdf5 file) or failed.
+
+    The manifest is append-only: every change of state is one line, written with a single `O_APPEND` write and
+    fsync'd, so the workers of a `TrialScheduler` can share it and a crash can't corrupt it. The last line of a trial
+    is its state. `trial_loop()` runs exactly the trials that aren't complete, without listing the output directory.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        :param path: The path to the manifest.
+        """
+
+        self.path = Path(path)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def repair(self) -> None:
+        """
+        Truncate a partial last line, left behind if the process died while appending; otherwise the next record
+        would be appended to it. Call this before the first append of a run. Only the end of the manifest is read.
+        """
+
+        MetadataLog(self.path).repair()
+
+    def _append(self, records: List[dict]) -> None:
+        data = "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+        fd = os.open(str(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _record(self, trial_num: int, status: str, **kwargs) -> dict:
+        record = {"trial": trial_num,
+                  "status": status,
+                  "time": time.time(),
+                  "host": socket.gethostname(),
+                  "pid": os.getpid()}
+        record.update(kwargs)
+        return record
+
+    def start(self, trial_num: int) -> None:
+        """
+        :param trial_num: The number of the trial that is starting.
+        """
+
+        self._append([self._record(trial_num, IN_PROGRESS)])
+
+    def complete(self, trial_num: int, filepath: Path) -> None:
+        """
+        Call this after the trial's hdf5 file has been moved to `filepath`.
+
+        :param trial_num: The number of the trial.
+        :param filepath: The path to the trial's hdf5 file.
+        """
+
+        self._append([self._record(trial_num, COMPLETE, file=filepath.name, size=filepath.stat().st_size,
+                                   md5=get_checksum(filepath))])
+
+    def fail(self, trial_num: int, error: str) -> None:
+        """
+        :param trial_num: The number of the trial.
+        :param error: Why the trial failed.
+        """
+
+        self._append([self._record(trial_num, FAILED, error=error)])
+
+    def add_existing(self, output_dir: Path) -> List[int]:
+        """
+        Mark the trial files that are already in the output directory (written before there was a manifest) as complete.
+        Their sizes are recorded but, to keep this fast, not their checksums.
+
+        :param output_dir: The output directory.
+
+        :return: The numbers of the existing trials.
+        """
+
+        existing = sorted(int(f.stem) for f in output_dir.glob("*.hdf5") if f.stem.isdigit())
+        self._append([self._record(i, COMPLETE, file=TDWUtils.zero_padding(i, 4) + ".hdf5",
+                                   size=output_dir.joinpath(TDWUtils.zero_padding(i, 4) + ".hdf5").stat().st_size,
+                                   md5=None)
+                      for i in existing])
+        return existing
+
+    def read(self) -> Dict[int, dict]:
+        """
+        :return: The last record of each trial. A partial last line is ignored.
+        """
+
+        trials = dict()
+        if not self.path.exists():
+            return trials
+        with open(str(self.path), "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                record = json.loads(line)
+                trials[record["trial"]] = record
+        return trials
+
+    def get_missing(self, num: int) -> List[int]:
+        """
+        :param num: The number of trials in the dataset.
+
+        :return: The numbers of the trials that aren't complete: never started, failed, or interrupted.
+        """
+
+        trials = self.read()
+        return [i for i in range(num) if i not in trials or trials[i]["status"] != COMPLETE]
+
+    def verify(self, output_dir: Path) -> List[int]:
+        """
+        Check each complete trial's file against its size and checksum.
+
+        :param output_dir: The output directory.
+
+        :return: The numbers of the complete trials whose files are missing or don't match.
+        """
+
+        bad = []
+        for i, record in sorted(self.read().items()):
+            if record["status"] != COMPLETE:
+                continue
+            filepath = output_dir.joinpath(record["file"])
+            if not filepath.exists() or filepath.stat().st_size != record["size"] or \
+                    (record["md5"] is not None and get_checksum(filepath) != record["md5"]):
+                bad.append(i)
+        return bad
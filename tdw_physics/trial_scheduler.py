@@ -0,0 +1,283 @@
+import json
+import time
+import random
+import threading
+import traceback
+import multiprocessing
+from pathlib import Path
+from typing import List, Dict, Optional, Union
+import numpy as np
+from tqdm import tqdm
+from tdw_physics.response_log import ResponseRecorder, ResponseReplayer
+from tdw_physics.metadata_log import MetadataLog
+
+# Matches the per-trial seeds of the controllers that reseed each trial, e.g. `Dominoes.MAX_TRIALS`.
+MAX_TRIALS = 1000
+
+
+class TrialScheduler:
+    """
+    Shard the trials of a `Dataset` across several builds, one port per worker.
+
+    Worker 0 is the controller itself, on the build it's already connected to. The other workers are forked from it
+    (so they inherit its full state) and each launches, or attaches to, a build on its own port.
+
+    Trial indices are dealt out as contiguous shards. A worker that finishes its shard steals the back half of the
+    largest shard that's left, so a slow or dead build doesn't hold up the others. Each worker writes to its own
+    temp file and command log; progress from every worker is reported through a single progress bar.
+
+    If the controller isn't randomized, `random` and `np.random` are reseeded from the controller's seed and the trial
+    index before every trial, so a trial is the same whichever worker runs it.
+    """
+
+    def __init__(self,
+                 controller,
+                 num_workers: int = 2,
+                 ports: Union[List[int], str, None] = None):
+        """
+        :param controller: The `Dataset` controller. Its scene must already be initialized.
+        :param num_workers: The number of workers.
+        :param ports: One port per worker; the first must be the controller's own port. If None, use consecutive ports.
+        """
+
+        if ports is None:
+            ports = [controller._port + k for k in range(num_workers)]
+        elif isinstance(ports, str):
+            ports = [int(p) for p in ports.split(',')]
+        ports = [int(p) for p in ports]
+        if len(ports) != num_workers:
+            raise ValueError("Got %d ports for %d workers" % (len(ports), num_workers))
+        if ports[0] != controller._port:
+            raise ValueError("The first port must be the controller's own port (%d), got %d" %
+                             (controller._port, ports[0]))
+
+        self.controller = controller
+        self.num_workers = num_workers
+        self.ports = ports
+
+        self._ctx = multiprocessing.get_context("fork")
+        self._indices: List[int] = []
+        self._lock = None
+        self._starts = None
+        self._ends = None
+        self._events = None
+
+        # Per-worker metrics, collected in this process.
+        self.completed: List[int] = [0] * num_workers
+        self.trial_times: List[List[float]] = [[] for _ in range(num_workers)]
+        self.failed: List[Dict[str, int]] = []
+        self.trial_metadata: Dict[int, dict] = dict()
+
+    def seed_trial(self, trial_num: int) -> None:
+        """
+        Reseed the random number generators for a trial, unless the controller is randomized.
+
+        :param trial_num: The index of the trial.
+        """
+
+        self.controller.seed_trial(trial_num)
+
+    def run(self,
+            num: int,
+            output_dir: str,
+            temp_path: str,
+            save_frame: int = None,
+            unload_assets_every: int = 10,
+            update_kwargs: List[dict] = {}) -> dict:
+        """
+        Run every trial that isn't complete yet. The arguments are the same as `Dataset.trial_loop()`.
+
+        :return: A summary of the run: trials and mean trial time per worker, failed trials, and trials that weren't run.
+        """
+
+        controller = self.controller
+        if not isinstance(update_kwargs, list):
+            update_kwargs = [update_kwargs] * num
+
+        output_dir = Path(output_dir)
+        if not output_dir.exists():
+            output_dir.mkdir(parents=True)
+        temp_path = Path(temp_path)
+        if not temp_path.parent.exists():
+            temp_path.parent.mkdir(parents=True)
+
+        # Run exactly the trials that the manifest doesn't have as complete, the same as `trial_loop()`.
+        self._indices = controller.get_trials_to_run(num, output_dir)
+
+        # Deal out contiguous shards of positions in `self._indices`.
+        n = len(self._indices)
+        self._lock = self._ctx.Lock()
+        self._starts = self._ctx.Array('q', self.num_workers, lock=False)
+        self._ends = self._ctx.Array('q', self.num_workers, lock=False)
+        for k in range(self.num_workers):
+            self._starts[k] = (n * k) // self.num_workers
+            self._ends[k] = (n * (k + 1)) // self.num_workers
+        self._events = self._ctx.Queue()
+
+        save_labels = getattr(controller, "save_labels", False)
+        if save_labels:
+            meta_log = controller.meta_log
+            trial_metadata = controller.trial_metadata
+
+        # Fork the other workers before this process starts any threads.
+        start = time.time()
+        workers = []
+        for k in range(1, self.num_workers):
+            p = self._ctx.Process(target=self._run_forked_worker,
+                                  args=(k, output_dir, temp_path, save_frame, unload_assets_every, update_kwargs),
+                                  name="TrialWorker-%d" % k)
+            p.start()
+            workers.append(p)
+
+        pbar = tqdm(total=num)
+        pbar.update(num - n)
+        collector = threading.Thread(target=self._collect, args=(pbar,), daemon=True)
+        collector.start()
+
+        # This process is worker 0.
+        self._work(0, output_dir, temp_path, save_frame, unload_assets_every, update_kwargs)
+
+        for p in workers:
+            p.join()
+            if p.exitcode != 0:
+                tqdm.write("%s exited with code %s" % (p.name, p.exitcode))
+        self._events.put(None)
+        collector.join()
+        pbar.close()
+
+        # Merge each worker's metadata log into the dataset's.
+        if save_labels:
+            controller.meta_log = meta_log
+            controller.trial_metadata = trial_metadata + [self.trial_metadata[i] for i in sorted(self.trial_metadata)]
+            worker_logs = [self._get_worker_path(meta_log.path, k) for k in range(self.num_workers)]
+            meta_log.merge([path for path in worker_logs if path.exists()])
+
+        not_run = [self._indices[pos] for k in range(self.num_workers)
+                   for pos in range(self._starts[k], self._ends[k])]
+        summary = {"num_workers": self.num_workers,
+                   "ports": self.ports,
+                   "trials_per_worker": self.completed,
+                   "mean_trial_seconds_per_worker": [float(np.mean(t)) if len(t) else None for t in self.trial_times],
+                   "failed": self.failed,
+                   "not_run": sorted(not_run),
+                   "elapsed_seconds": time.time() - start}
+        print("TRIAL SCHEDULER")
+        print(json.dumps(summary, indent=4))
+        return summary
+
+    @staticmethod
+    def _get_worker_path(path: Path, worker: int) -> Path:
+        return path.parent.joinpath("%s_worker%d%s" % (path.stem, worker, path.suffix))
+
+    def _take(self, worker: int) -> Optional[int]:
+        """
+        :param worker: The worker.
+
+        :return: The next position in `self._indices` for this worker, or None if there's no work left.
+        """
+
+        with self._lock:
+            if self._starts[worker] >= self._ends[worker]:
+                # Steal the back half of the largest remaining shard.
+                victim = max(range(self.num_workers), key=lambda k: self._ends[k] - self._starts[k])
+                remaining = self._ends[victim] - self._starts[victim]
+                if remaining <= 0:
+                    return None
+                stolen = max(1, remaining // 2)
+                self._starts[worker] = self._ends[victim] - stolen
+                self._ends[worker] = self._ends[victim]
+                self._ends[victim] -= stolen
+            pos = self._starts[worker]
+            self._starts[worker] += 1
+            return pos
+
+    def _work(self,
+              worker: int,
+              output_dir: Path,
+              temp_path: Path,
+              save_frame: Optional[int],
+              unload_assets_every: int,
+              update_kwargs: List[dict]) -> None:
+        controller = self.controller
+        temp_path = self._get_worker_path(temp_path, worker)
+        # Remove an incomplete temp path.
+        if temp_path.exists():
+            temp_path.unlink()
+        save_labels = getattr(controller, "save_labels", False)
+        if save_labels:
+            controller.meta_log = MetadataLog(self._get_worker_path(controller.meta_log.path, worker))
+            controller.trial_metadata = []
+
+        while True:
+            pos = self._take(worker)
+            if pos is None:
+                return
+            i = self._indices[pos]
+            self.seed_trial(i)
+            start = time.time()
+            num_labels = len(controller.trial_metadata) if save_labels else 0
+            num_timed = len(controller.timer.trials)
+            try:
+                controller._run_trial_index(i,
+                                            output_dir=output_dir,
+                                            temp_path=temp_path,
+                                            save_frame=save_frame,
+                                            unload_assets_every=unload_assets_every,
+                                            update_kwargs=update_kwargs[i])
+            except Exception:
+                # The build might be in a bad state; stop this worker and let the others steal its shard.
+                self._events.put(("failed", worker, i, traceback.format_exc()))
+                return
+            meta = controller.trial_metadata[-1] if save_labels and len(controller.trial_metadata) > num_labels else None
+            timing = controller.timer.trials[-1] if len(controller.timer.trials) > num_timed else None
+            self._events.put(("done", worker, i, time.time() - start, meta, timing))
+
+    def _run_forked_worker(self,
+                           worker: int,
+                           output_dir: Path,
+                           temp_path: Path,
+                           save_frame: Optional[int],
+                           unload_assets_every: int,
+                           update_kwargs: List[dict]) -> None:
+        controller = self.controller
+        # Forked workers would otherwise all draw the same "random" trials.
+        if bool(controller.randomize):
+            random.seed()
+            np.random.seed()
+        try:
+            if controller.command_log is not None:
+                controller.command_log = self._get_worker_path(Path(controller.command_log), worker)
+            if controller.response_recorder is not None:
+                controller.response_recorder = ResponseRecorder(
+                    self._get_worker_path(controller.response_recorder.path, worker))
+            if controller.response_replayer is not None:
+                # Don't share the parent's open hdf5 files.
+                controller.response_replayer = ResponseReplayer(controller.response_replayer.path)
+            controller.connect_to_build(self.ports[worker])
+            controller.communicate(controller.get_initialization_commands(width=controller._width,
+                                                                          height=controller._height))
+        except Exception:
+            self._events.put(("failed", worker, None, traceback.format_exc()))
+            return
+        self._work(worker, output_dir, temp_path, save_frame, unload_assets_every, update_kwargs)
+        controller.terminate_build()
+
+    def _collect(self, pbar: tqdm) -> None:
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            kind, worker, i = event[:3]
+            if kind == "done":
+                self.completed[worker] += 1
+                self.trial_times[worker].append(event[3])
+                if event[4] is not None:
+                    self.trial_metadata[i] = event[4]
+                # Worker 0's timer is the controller's own.
+                if worker != 0 and event[5] is not None:
+                    self.controller.timer.add_trial(event[5])
+                pbar.update(1)
+            else:
+                self.failed.append({"worker": worker, "trial": i})
+                tqdm.write("Worker %d (port %d) failed on trial %s:\n%s" % (worker, self.ports[worker], i, event[3]))
+            pbar.set_postfix(trials=",".join(str(c) for c in self.completed), failed=len(self.failed))
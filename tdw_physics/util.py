@@ -1,35 +1,76 @@
 from typing import Dict, List
 import random
 import numpy as np
-from tdw.librarian import ModelLibrarian, MaterialLibrarian, SceneLibrarian
+from tdw.librarian import ModelLibrarian, ModelRecord
 from tdw.tdw_utils import TDWUtils
+from tdw_physics.library_index import LIBRARY_INDEX, LazyDict
 import argparse
 
-# Every model library, sorted by name.
-MODEL_LIBRARIES: Dict[str, ModelLibrarian] = {}
-for filename in ModelLibrarian.get_library_filenames():
-    MODEL_LIBRARIES.update({filename: ModelLibrarian(filename)})
+# Every model library, sorted by name. A library is loaded the first time it's used.
+MODEL_LIBRARIES: Dict[str, ModelLibrarian] = LazyDict(ModelLibrarian.get_library_filenames(), ModelLibrarian)
 
 # All the models with flex enabled
-FLEX_MODELS: Dict[str, ModelLibrarian] = {}
-for filename in MODEL_LIBRARIES.keys():
-    FLEX_MODELS[filename] = {
-        record for record in MODEL_LIBRARIES[filename].records if record.flex == True}
+FLEX_MODELS: Dict[str, set] = LazyDict(
+    MODEL_LIBRARIES.keys(),
+    lambda filename: {record for record in MODEL_LIBRARIES[filename].records if record.flex == True})
 
-# All the model categories
-MODEL_CATEGORIES = []
-for record in MODEL_LIBRARIES["models_full.json"].records:
-    MODEL_CATEGORIES.append(record.wcategory)
-MODEL_CATEGORIES = list(set(MODEL_CATEGORIES))
 
-# All the material types and materials
-M = MaterialLibrarian()
-MATERIAL_TYPES = M.get_material_types()
-MATERIAL_NAMES = {mtype: [m.name for m in M.get_all_materials_of_type(mtype)] \
-                  for mtype in MATERIAL_TYPES}
+def get_model_names(library: str, usable: bool = False) -> List[str]:
+    """
+    :param library: The filename of a model library, e.g. "models_flex.json".
+    :param usable: If True, leave out the models that are marked `do_not_use`.
+
+    :return: The names of the models in the library, from the library index (the library isn't loaded).
+    """
+
+    return LIBRARY_INDEX.get_model_names(library, usable=usable)
+
+
+def get_model_record(name: str, library: str = None) -> ModelRecord:
+    """
+    :param name: The name of a model.
+    :param library: The library of the model. If None, the first library that has the model.
+
+    :return: The model's record. Only its library is loaded.
+    """
+
+    if library is None:
+        library = LIBRARY_INDEX.get_model_library(name)
+        if library is None:
+            raise KeyError("No model library has %s" % name)
+    return MODEL_LIBRARIES[library].get_record(name)
+
+
+def get_model_categories() -> List[str]:
+    """
+    :return: The categories of the models in models_full.json, from the library index.
+    """
+
+    return list(set(LIBRARY_INDEX.get_model_categories("models_full.json").values()))
+
+
+def get_material_names() -> Dict[str, List[str]]:
+    """
+    :return: The names of the materials of each type, from the library index.
+    """
+
+    return LIBRARY_INDEX.get_material_names()
+
+
+def get_material_types() -> List[str]:
+    """
+    :return: The material types, sorted alphabetically, from the library index.
+    """
+
+    return list(LIBRARY_INDEX.get_material_names().keys())
+
+
+def get_rooms() -> List[str]:
+    """
+    :return: The names of the scenes, from the library index.
+    """
 
-S = SceneLibrarian()
-ROOMS = [r.name for r in S.records]
+    return LIBRARY_INDEX.get_scene_names()
 
 
 # The names of the image passes
@@ -150,6 +191,21 @@ def get_parser(dataset_dir: str, get_help: bool=False):
     parser.add_argument("--save_labels", action='store_true', help="Whether to save out JSON labels for the full trial set.")
     parser.add_argument("--save_meshes", action='store_true', help="Whether to save meshes sent from the build")
     parser.add_argument("--unload_assets_every", type=int, default=10, help="Unload assets after how many trials")
+    parser.add_argument("--pipeline_writes", action='store_true', help="Whether to write each frame to the HDF5 on a background thread while the next frame renders")
+    parser.add_argument("--pipeline_commands", action='store_true', help="Whether to send the next frame's commands before the current frame is written, so the build runs the next frame meanwhile, on frames whose commands don't depend on the response")
+    parser.add_argument("--write_queue_size", type=int, default=8, help="Maximum number of frames waiting to be written when writes are pipelined")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of builds to shard trials across, one port each")
+    parser.add_argument("--worker_ports", type=none_or_str, default=None, help="Comma-separated list of one port per worker; the first is --port. Defaults to consecutive ports")
+    parser.add_argument("--record_responses", action='store_true', help="Whether to record the build's responses to each trial in responses/tdw_responses.hdf5")
+    parser.add_argument("--replay_responses", type=none_or_str, default=None, help="Replay the responses in this tdw_responses.hdf5 (or dataset dir) instead of using the build")
+    parser.add_argument("--save_timing", action='store_true', help="Whether to time each stage of each trial and save the times to timing.json and timing.csv")
+    parser.add_argument("--hdf5_layout", type=str, default="legacy", choices=["legacy", "columnar"], help="How to lay out the per-frame data of each hdf5 file: one group per frame (legacy), or one dataset per field over all frames (columnar)")
+    parser.add_argument("--image_storage", type=str, default=None, help="Comma-separated pass:storage pairs. Encoded passes are stored raw (default) or gzip; _depth is stored gzip (default), raw, lzf, or quantized to uint16 or float16. e.g. _depth:lzf,_img:raw")
+    parser.add_argument("--stats_workers", type=int, default=None, help="Number of processes that compute the across-trial label stats at the end of the run. Defaults to one per CPU")
+    parser.add_argument("--prescreen", type=none_or_str, default=None, help="Comma-separated labels, e.g. does_target_contact_zone. If set, every trial is first run without rendering, and only the trials whose labels are all true are rendered")
+    parser.add_argument("--balance", type=none_or_str, default=None, help="A trial-level label to balance, optionally with the fraction of trials for which it should be true, e.g. does_target_contact_zone:0.5. The parameters of each trial are chosen to meet the fraction, and only as many trials are run as are needed")
+    parser.add_argument("--balance_strata", type=str, default="room,probe_type", help="Comma-separated labels (or static data) whose values split trials into strata; outcomes are balanced within each stratum")
+    parser.add_argument("--pass_schedule", type=none_or_str, default=None, help="Comma-separated pass:rule pairs of which frames to render each pass on. A rule is |-separated terms, everyN or a frame number (-1 is the last frame), e.g. _img:every2,_id:0|-1,_depth:every5. Passes without a rule are rendered every frame")
 
     return parser
 